@@ -1,5 +1,9 @@
 # This will make sure the app is always imported when
 # Django starts.
 from .celery import app as celery_app
+# Connect the connection setup receivers before any connection opens
+from . import db  # noqa: F401
+# Connect the receiver flushing metrics after each Celery task
+from . import metrics  # noqa: F401
 
 __all__ = ('celery_app',)
\ No newline at end of file
@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+django.setup(set_prefix=False)
 
-application = get_asgi_application()
+# Imported once apps are loaded
+from files.asgi import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
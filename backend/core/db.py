@@ -0,0 +1,59 @@
+"""
+Database connection setup and read-replica routing.
+
+SQLite connections are tuned as they open (WAL, so readers never wait on the
+writer, plus the rest of SQLITE_PRAGMAS). On PostgreSQL with replicas
+configured, reads made inside ``replica_reads`` go to a random replica;
+every write, and every read outside it, stays on the primary.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@contextmanager
+def replica_reads():
+    """
+    Let reads inside the block (or decorated view) be served by a replica.
+
+    Only for read-only endpoints that can tolerate replication lag.
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Reads inside a transaction on the primary must see its writes
+        if not settings.DATABASE_REPLICAS or not _replica_reads.get() or connections['default'].in_atomic_block:
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects from any of them can be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
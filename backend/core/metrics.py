@@ -0,0 +1,251 @@
+"""
+Low-overhead instrumentation, exported in the Prometheus text format.
+
+Counters and histograms are aggregated in process memory and added to one
+Redis hash at most every METRICS_FLUSH_INTERVAL seconds, so web servers and
+Celery workers all feed the same ``/metrics`` endpoint and recording costs a
+dictionary update rather than a round trip. Without a METRICS_URL nothing
+leaves the process. Histogram buckets are stored
+uncumulated and summed when rendered. Gauges are read when scraped.
+"""
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+import redis
+from celery.signals import task_postrun
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'vault:metrics'
+RETRY_AFTER = 30  # Seconds to keep metrics in memory after Redis fails
+SEPARATOR = '\x1f'
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RUN_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'vault_http_requests_total': ('counter', 'HTTP requests served, by endpoint, method and status', None),
+    'vault_http_request_seconds': ('histogram', 'Time to produce a response, by endpoint', DURATION_BUCKETS),
+    'vault_db_queries_total': ('counter', 'Database queries run while serving requests, by endpoint', None),
+    'vault_db_query_seconds_total': ('counter', 'Time spent in database queries while serving requests, by endpoint', None),
+    'vault_upload_stage_seconds': (
+        'histogram',
+        'Time per uploaded file in each stage: receive (reading the body), hash, store (writing to '
+        'storage), insert (the database row) and signal (index and statistics updates, task queueing)',
+        DURATION_BUCKETS,
+    ),
+    'vault_dedup_run_seconds': ('histogram', 'Wall time of full dedup runs, by outcome', RUN_BUCKETS),
+    'vault_dedup_shard_seconds': ('histogram', 'Time to rebuild one shard of the duplicate index', RUN_BUCKETS),
+}
+
+_lock = threading.Lock()
+_pending = defaultdict(float)
+_last_flush = time.monotonic()
+_unavailable_until = 0.0
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        # Short timeouts: a slow metrics server must not slow requests down
+        _client = redis.Redis.from_url(settings.METRICS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _client
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_labels(items):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in items
+    )
+
+
+def _labels(labels):
+    # Label sets repeat endlessly (one per endpoint and status), so their text is cached
+    return _format_labels(tuple(sorted(labels.items())))
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to a counter"""
+    field = SEPARATOR.join((name, _labels(labels), ''))
+    with _lock:
+        _pending[field] += value
+
+
+def observe(name, value, **labels):
+    """Record one observation of a histogram"""
+    buckets = METRICS[name][2]
+    le = next((str(bound) for bound in buckets if value <= bound), '+Inf')
+    labels = _labels(labels)
+    with _lock:
+        _pending[SEPARATOR.join((name, labels, le))] += 1
+        _pending[SEPARATOR.join((name, labels, 'sum'))] += value
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the time the block takes in a histogram"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def flush(force=False):
+    """Add what was recorded to the shared totals, unless it was done recently"""
+    global _last_flush, _unavailable_until
+    now = time.monotonic()
+    if not settings.METRICS_URL or not _pending or now < _unavailable_until or (not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL):
+        return
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = now
+
+    try:
+        with get_client().pipeline(transaction=False) as pipe:
+            for field, value in pending.items():
+                pipe.hincrbyfloat(METRICS_KEY, field, value)
+            pipe.execute()
+    except redis.RedisError:
+        logger.warning('Could not flush metrics', exc_info=True)
+        _unavailable_until = now + RETRY_AFTER
+        # Keep the values for the next attempt
+        with _lock:
+            for field, value in pending.items():
+                _pending[field] += value
+
+
+@task_postrun.connect
+def flush_after_task(**kwargs):
+    # Tasks are rare and long next to requests, and a worker may exit before its next one
+    flush(force=True)
+
+
+class MetricsMiddleware:
+    """Count requests, their latency and their database queries per endpoint"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0, 0.0]
+
+        def count_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += 1
+                queries[1] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count_query))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        endpoint = match.view_name if match else 'unmatched'
+        inc('vault_http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        observe('vault_http_request_seconds', elapsed, endpoint=endpoint)
+        if queries[0]:
+            inc('vault_db_queries_total', queries[0], endpoint=endpoint)
+            inc('vault_db_query_seconds_total', queries[1], endpoint=endpoint)
+        flush()
+        return response
+
+
+def _series(name, labels):
+    return f'{name}{{{labels}}}' if labels else name
+
+
+def _format(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render(values):
+    """Prometheus text exposition of the stored counters and histograms"""
+    series = defaultdict(lambda: defaultdict(dict))
+    for field, value in values.items():
+        name, labels, part = field.split(SEPARATOR)
+        if name in METRICS:
+            series[name][labels][part] = float(value)
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for labels, parts in sorted(series[name].items()):
+            if kind == 'counter':
+                lines.append(f'{_series(name, labels)} {_format(parts[""])}')
+                continue
+            cumulative = 0
+            for bound in [*map(str, buckets), '+Inf']:
+                cumulative += parts.get(bound, 0)
+                bucket_labels = ','.join(filter(None, [labels, f'le="{bound}"']))
+                lines.append(f'{name}_bucket{{{bucket_labels}}} {_format(cumulative)}')
+            lines.append(f'{_series(name + "_sum", labels)} {_format(parts.get("sum", 0))}')
+            lines.append(f'{_series(name + "_count", labels)} {_format(cumulative)}')
+    return lines
+
+
+def gauges():
+    """Values read when scraped: vault totals, the last dedup run and the task queue"""
+    from dedup import scheduler
+    from dedup.models import DedupJob
+    from files import caching, stats
+    from .celery import app
+
+    counters = stats.snapshot()
+    job = DedupJob.objects.filter(status='completed').order_by('-created_at').first()
+    values = [
+        ('vault_files', 'Files in the vault', 'gauge', counters['total_files']),
+        ('vault_bytes', 'Bytes of files in the vault, before deduplication', 'gauge', counters['total_bytes']),
+        ('vault_reclaimable_bytes', 'Bytes taken by duplicate copies', 'gauge', counters['reclaimable_bytes']),
+        ('vault_duplicate_groups', 'Duplicate groups found by the last completed dedup run', 'gauge',
+         job.duplicate_groups if job else 0),
+        ('vault_duplicate_files', 'Duplicate files found by the last completed dedup run', 'gauge',
+         job.duplicate_files if job else 0),
+    ]
+
+    cache = caching.counters()
+    values += [
+        ('vault_response_cache_hits_total', 'Responses served from the response cache', 'counter', cache['hits']),
+        ('vault_response_cache_misses_total', 'Responses the response cache had to compute', 'counter', cache['misses']),
+    ]
+
+    try:
+        # The Redis broker keeps each queue as a list
+        queue_length = scheduler.get_client().llen(app.conf.task_default_queue)
+        values.append(('vault_celery_queue_length', 'Tasks waiting in the Celery queue', 'gauge', queue_length))
+    except redis.RedisError:
+        logger.warning('Could not read the Celery queue length', exc_info=True)
+
+    lines = []
+    for name, help_text, kind, value in values:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+    return lines
+
+
+def export(request):
+    """The ``/metrics`` endpoint"""
+    flush(force=True)
+    values = {}
+    if settings.METRICS_URL:
+        try:
+            values = {field.decode(): value for field, value in get_client().hgetall(METRICS_KEY).items()}
+        except redis.RedisError:
+            logger.warning('Could not read metrics', exc_info=True)
+    body = '\n'.join(render(values) + gauges()) + '\n'
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+  # First, so it times the whole response
+  "core.metrics.MetricsMiddleware",
   "django.middleware.security.SecurityMiddleware",
   "whitenoise.middleware.WhiteNoiseMiddleware",
   "django.contrib.sessions.middleware.SessionMiddleware",
@@ -76,16 +78,61 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "core.wsgi.application"
+ASGI_APPLICATION = "core.asgi.application"
 
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-  "default": {
-    "ENGINE": "django.db.backends.sqlite3",
-    "NAME": os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
+# SQLite by default; set POSTGRES_HOST to use PostgreSQL, and POSTGRES_REPLICA_HOSTS
+# (comma-separated) to serve the busiest read-only endpoints from replicas
+POSTGRES_HOST = os.environ.get('POSTGRES_HOST', '')
+DATABASE_REPLICAS = []
+# Seconds a replica may trail the primary; cache misses read from the primary for this long after a write
+DATABASE_REPLICA_MAX_LAG = int(os.environ.get('DATABASE_REPLICA_MAX_LAG', 10))
+# 'asgi' when start.sh serves the API with uvicorn
+SERVER_MODE = os.environ.get('SERVER_MODE', '')
+
+if POSTGRES_HOST:
+  POSTGRES = {
+    "ENGINE": "django.db.backends.postgresql",
+    "PORT": os.environ.get('POSTGRES_PORT', '5432'),
+    "NAME": os.environ.get('POSTGRES_DB', 'vault'),
+    "USER": os.environ.get('POSTGRES_USER', 'vault'),
+    "PASSWORD": os.environ.get('POSTGRES_PASSWORD', ''),
+    # Keep connections open across requests instead of reconnecting for each one. Not
+    # under ASGI, where each request's views run on a new thread and would leave its
+    # connection open until garbage collected; pool through PgBouncer (DB_POOLED) instead
+    "CONN_MAX_AGE": 0 if SERVER_MODE == 'asgi' else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+    "CONN_HEALTH_CHECKS": True,
+    # Server-side cursors break behind a transaction-pooling PgBouncer
+    "DISABLE_SERVER_SIDE_CURSORS": os.environ.get('DB_POOLED', 'False') == 'True',
+  }
+  DATABASES = {"default": {**POSTGRES, "HOST": POSTGRES_HOST}}
+  for number, host in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f"replica{number}"] = {**POSTGRES, "HOST": host.strip(), "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(f"replica{number}")
+else:
+  DATABASES = {
+    "default": {
+      "ENGINE": "django.db.backends.sqlite3",
+      "NAME": os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
+      "OPTIONS": {
+        # Seconds a write waits for the lock before "database is locked"
+        "timeout": int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),
+      },
+    }
   }
+
+DATABASE_ROUTERS = ['core.db.ReplicaRouter']
+
+# Applied to every SQLite connection as it opens
+SQLITE_PRAGMAS = {
+  "journal_mode": "wal",  # Readers and the writer no longer block each other
+  "synchronous": "normal",  # Safe with WAL; fsyncs at checkpoints instead of every commit
+  "cache_size": -64 * 1024,  # KiB of page cache per connection
+  "temp_store": "memory",
+  "mmap_size": 256 * 1024 * 1024,
 }
 
 
@@ -131,6 +178,57 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Hash uploads as they stream in so File.save never re-reads the content
+FILE_UPLOAD_HANDLERS = [
+  "files.uploadhandlers.HashingMemoryFileUploadHandler",
+  "files.uploadhandlers.HashingTemporaryFileUploadHandler",
+]
+
+# Batch deletes: files purged per transaction, and storage unlinks per second (0 for no limit)
+FILE_PURGE_BATCH_SIZE = 1000
+FILE_PURGE_UNLINK_RATE = int(os.environ.get('FILE_PURGE_UNLINK_RATE', 1000))
+
+# Batch uploads: files accepted per request, and threads hashing any not hashed on receipt
+DATA_UPLOAD_MAX_NUMBER_FILES = int(os.environ.get('DATA_UPLOAD_MAX_NUMBER_FILES', 5000))
+FILE_BATCH_HASH_WORKERS = 8
+
+# Block-level deduplication: split large blobs into content-defined chunks
+BLOCK_DEDUP_ENABLED = os.environ.get('BLOCK_DEDUP_ENABLED', 'False') == 'True'
+BLOCK_DEDUP_MIN_SIZE = 1024 * 1024
+
+# Near-duplicate detection (MinHash sketches in an LSH index), run by workers
+# consuming the 'similarity' queue
+SIMILARITY_ENABLED = os.environ.get('SIMILARITY_ENABLED', 'False') == 'True'
+SIMILARITY_MIN_SIZE = 16 * 1024  # Smaller files yield too few chunks to compare
+SIMILARITY_MAX_SIZE = 64 * 1024 * 1024  # Sketching reads the whole file
+SIMILARITY_THRESHOLD = 0.8  # Minimum estimated Jaccard similarity to report
+
+# Downloads: '' streams from Django (with os.sendfile under gunicorn), or hand the
+# body to the front proxy with 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache)
+FILE_DOWNLOAD_OFFLOAD = os.environ.get('FILE_DOWNLOAD_OFFLOAD', '')
+FILE_DOWNLOAD_ACCEL_PREFIX = os.environ.get('FILE_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')  # internal nginx location aliasing MEDIA_ROOT
+FILE_DOWNLOAD_MAX_AGE = 365 * 24 * 60 * 60  # Content behind a file id never changes
+
+# ASGI mode: threads doing blocking file I/O for request bodies and downloads, and
+# views allowed to run at once (each holds a thread and a database connection)
+ASGI_IO_WORKERS = int(os.environ.get('ASGI_IO_WORKERS', 32))
+ASGI_MAX_CONCURRENT_VIEWS = int(os.environ.get('ASGI_MAX_CONCURRENT_VIEWS', 8))
+
+# Cold storage tier: compress compressible content nobody has read for a while
+COLD_STORAGE_ENABLED = os.environ.get('COLD_STORAGE_ENABLED', 'False') == 'True'
+COLD_STORAGE_CODEC = os.environ.get('COLD_STORAGE_CODEC', 'gzip')  # gzip, xz or zstd (needs zstandard)
+COLD_STORAGE_AFTER = int(os.environ.get('COLD_STORAGE_AFTER', 30 * 24 * 60 * 60))  # seconds
+COLD_STORAGE_MIN_SIZE = 64 * 1024
+FILE_ACCESS_RESOLUTION = 60 * 60  # last_accessed_at is only rewritten once per this many seconds
+
+# Rows each vault statistics counter is spread over, to spread write contention
+STATS_COUNTER_SLOTS = 8
+
+# Chunked upload sessions
+UPLOAD_SESSION_ROOT = os.path.join(BASE_DIR, 'data', 'upload_sessions')
+UPLOAD_CHUNK_MAX_SIZE = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 60 * 60))  # seconds
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -152,5 +250,55 @@ REST_FRAMEWORK = {
 CORS_ALLOW_ALL_ORIGINS = True  # Configure appropriately in production
 CORS_ALLOW_CREDENTIALS = True
 
+# Response cache for the polled read endpoints, in the Redis already running for Celery.
+# Entries expire after RESPONSE_CACHE_TTL seconds; run Redis with a maxmemory and
+# maxmemory-policy volatile-lru so the least recently used entries are evicted
+# first, while the Celery queues, which never expire, are left alone.
+CACHES = {
+  "default": {
+    "BACKEND": "django.core.cache.backends.redis.RedisCache",
+    "LOCATION": os.environ.get('CACHE_URL', 'redis://localhost:6379/1'),
+  }
+}
+RESPONSE_CACHE_ALIAS = "default"
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 5 * 60))
+
+# Metrics served at /metrics; web and worker processes add to one Redis hash,
+# each at most every METRICS_FLUSH_INTERVAL seconds
+METRICS_URL = os.environ.get('METRICS_URL', os.environ.get('CACHE_URL', 'redis://localhost:6379/1'))
+METRICS_FLUSH_INTERVAL = 1
+
 # Celery settings
-CELERY_BROKER_URL = 'redis://localhost:6379/0'  # Redis as the message broker
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')  # Redis as the message broker
+# Results let a chord join the dedup shards; Redis counts finished shards atomically
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # Spread dedup shards over every worker process rather than one
+# Sketching reads whole files; its own queue keeps it from delaying dedup runs and purges
+CELERY_TASK_ROUTES = {
+  'dedup.tasks.sketch_blob': {'queue': 'similarity'},
+}
+
+# Full dedup runs rebuild the index in this many shards by file_hash prefix, run in
+# parallel across workers; a failed shard is retried up to DEDUP_SHARD_MAX_RETRIES times
+DEDUP_SHARD_COUNT = int(os.environ.get('DEDUP_SHARD_COUNT', 16))
+DEDUP_SHARD_MAX_RETRIES = 3
+
+# Full dedup runs requested within this many seconds are merged into one
+DEDUP_COALESCE_WINDOW = int(os.environ.get('DEDUP_COALESCE_WINDOW', 5))
+DEDUP_RUN_LOCK_TTL = 60 * 60  # seconds before a crashed run's lock expires
+
+# Periodic maintenance, run by the worker's embedded beat scheduler
+CELERY_BEAT_SCHEDULE = {
+  "purge-stale-upload-sessions": {
+    "task": "files.tasks.purge_stale_upload_sessions",
+    "schedule": 60 * 60,
+  },
+  "purge-deleted-files": {
+    "task": "files.tasks.purge_deleted_files",
+    "schedule": 60 * 60,
+  },
+  "compress-cold-blobs": {
+    "task": "files.tasks.compress_cold_blobs",
+    "schedule": 24 * 60 * 60,
+  },
+}
@@ -0,0 +1,42 @@
+"""
+Settings for the benchmark suite (``manage.py benchmark``).
+
+Everything runs offline in a throwaway directory: a fresh SQLite database,
+a temporary MEDIA_ROOT, Celery tasks executed inline and no Redis.
+"""
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+BENCHMARK_ROOT = tempfile.mkdtemp(prefix='vault-benchmark-')
+
+DATABASES = {
+  "default": {
+    "ENGINE": "django.db.backends.sqlite3",
+    "NAME": os.path.join(BENCHMARK_ROOT, 'db.sqlite3'),
+    "OPTIONS": {
+      "timeout": 20,
+    },
+  }
+}
+DATABASE_REPLICAS = []
+
+MEDIA_ROOT = os.path.join(BENCHMARK_ROOT, 'media')
+UPLOAD_SESSION_ROOT = os.path.join(BENCHMARK_ROOT, 'upload_sessions')
+
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_TASK_EAGER_PROPAGATES = True
+
+# Cached responses expire at once, so every request runs its view
+CACHES = {
+  "default": {
+    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+  }
+}
+RESPONSE_CACHE_TTL = 0
+
+# Metrics are still recorded, so their overhead is measured, but never sent anywhere
+METRICS_URL = None
@@ -0,0 +1,151 @@
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+
+import redis
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from dedup import scheduler
+from . import metrics
+from .db import ReplicaRouter, replica_reads
+
+try:
+    import fakeredis
+except ImportError:  # pragma: no cover - only needed by the metrics endpoint tests
+    fakeredis = None
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='vault-tests-')
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+class SQLitePragmaTests(TestCase):
+    def test_connections_are_tuned_as_they_open(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # MEMORY
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTests(TestCase):
+    router = ReplicaRouter()
+
+    def test_reads_stay_on_the_primary_by_default(self):
+        self.assertIsNone(self.router.db_for_read(None))
+
+    def test_reads_inside_replica_reads_go_to_a_replica(self):
+        with mock.patch.object(connection, 'in_atomic_block', False), replica_reads():
+            self.assertIn(self.router.db_for_read(None), ['replica1', 'replica2'])
+        self.assertIsNone(self.router.db_for_read(None))
+
+    def test_reads_inside_a_transaction_stay_on_the_primary(self):
+        with transaction.atomic(), replica_reads():
+            self.assertIsNone(self.router.db_for_read(None))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_reads_stay_on_the_primary(self):
+        with replica_reads():
+            self.assertIsNone(self.router.db_for_read(None))
+
+    def test_writes_and_migrations_go_to_the_primary(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_write(None), 'default')
+        self.assertTrue(self.router.allow_migrate('default', 'files'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'files'))
+
+
+class MetricsStateMixin:
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, metrics, '_unavailable_until', 0.0)
+        self.addCleanup(metrics._pending.clear)
+        metrics._pending.clear()
+
+    def recorded(self):
+        return dict(metrics._pending)
+
+
+class MetricsRenderTests(MetricsStateMixin, SimpleTestCase):
+    def test_counters(self):
+        metrics.inc('vault_db_queries_total', 3, endpoint='file-list')
+        metrics.inc('vault_db_queries_total', 2, endpoint='file-list')
+        self.assertIn('vault_db_queries_total{endpoint="file-list"} 5', metrics.render(self.recorded()))
+
+    def test_histograms_are_cumulative(self):
+        for value in [0.003, 0.004, 0.2, 100]:
+            metrics.observe('vault_http_request_seconds', value, endpoint='file-list')
+        lines = metrics.render(self.recorded())
+
+        for line in [
+            'vault_http_request_seconds_bucket{endpoint="file-list",le="0.001"} 0',
+            'vault_http_request_seconds_bucket{endpoint="file-list",le="0.005"} 2',
+            'vault_http_request_seconds_bucket{endpoint="file-list",le="0.25"} 3',
+            'vault_http_request_seconds_bucket{endpoint="file-list",le="60"} 3',
+            'vault_http_request_seconds_bucket{endpoint="file-list",le="+Inf"} 4',
+            'vault_http_request_seconds_count{endpoint="file-list"} 4',
+            'vault_http_request_seconds_sum{endpoint="file-list"} 100.207',
+        ]:
+            self.assertIn(line, lines)
+
+    def test_label_values_are_escaped(self):
+        metrics.inc('vault_http_requests_total', endpoint='a"b\\c\nd')
+        self.assertIn('vault_http_requests_total{endpoint="a\\"b\\\\c\\nd"} 1', metrics.render(self.recorded()))
+
+    def test_unknown_fields_are_ignored(self):
+        lines = metrics.render({metrics.SEPARATOR.join(['vault_retired_total', '', '']): '4'})
+        self.assertFalse([line for line in lines if 'vault_retired_total' in line])
+
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    METRICS_URL='redis://metrics',
+)
+class MetricsEndpointTests(MetricsStateMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.redis = fakeredis.FakeRedis()
+        for patcher in [mock.patch.object(metrics, '_client', self.redis),
+                        mock.patch.object(scheduler, '_client', self.redis)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode().splitlines()
+
+    def test_requests_and_uploads_are_measured(self):
+        upload = SimpleUploadedFile('a.txt', b'content', 'text/plain')
+        self.assertEqual(self.client.post('/api/files/', {'file': upload}, format='multipart').status_code, 201)
+
+        lines = self.scrape()
+
+        self.assertIn('vault_http_requests_total{endpoint="file-list",method="POST",status="201"} 1', lines)
+        self.assertTrue([line for line in lines if line.startswith('vault_db_queries_total{endpoint="file-list"}')])
+        for stage in ['hash', 'store', 'insert']:
+            self.assertIn(f'vault_upload_stage_seconds_count{{stage="{stage}"}} 1', lines)
+        self.assertIn('vault_files 1', lines)
+        self.assertIn('vault_celery_queue_length 0', lines)
+
+    def test_values_are_kept_while_redis_is_unreachable(self):
+        metrics.inc('vault_db_queries_total', 2, endpoint='file-list')
+        with mock.patch.object(self.redis, 'pipeline', side_effect=redis.RedisError('down')), \
+                self.assertLogs('core.metrics', 'WARNING'):
+            metrics.flush(force=True)
+        self.assertFalse(self.redis.exists(metrics.METRICS_KEY))
+
+        metrics._unavailable_until = 0.0
+        metrics.flush(force=True)
+        self.assertIn('vault_db_queries_total{endpoint="file-list"} 2', self.scrape())
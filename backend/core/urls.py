@@ -16,11 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
+
+from . import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics.export, name='metrics'),
     path('api/', include('dedup.urls')),
     path('api/', include('files.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
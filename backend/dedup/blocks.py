@@ -0,0 +1,37 @@
+"""
+Block-level overlap between files stored as content-defined chunks.
+"""
+from django.db.models import Exists, F, Func, OuterRef, Subquery
+
+from files.models import Blob, BlobChunk, Chunk, File
+
+
+def shared_content(blob, limit=20):
+    """
+    Find the chunked blobs that share chunks with ``blob``.
+
+    Returns ``(other_blob, shared_bytes, files)`` tuples, most shared bytes
+    first, where ``files`` are the File rows holding that content. Each
+    shared chunk counts once, however often it repeats in either blob, so
+    ``shared_bytes`` never exceeds the size of either one.
+    """
+    chunk_ids = BlobChunk.objects.filter(blob=blob).values('chunk_id')
+    in_other = BlobChunk.objects.filter(blob=OuterRef(OuterRef('pk')), chunk=OuterRef('pk'))
+    shared_bytes = (
+        Chunk.objects.filter(pk__in=chunk_ids)
+        .filter(Exists(in_other))
+        .order_by()
+        .annotate(total=Func(F('size'), function='SUM'))
+        .values('total')
+    )
+    others = BlobChunk.objects.filter(chunk_id__in=chunk_ids).exclude(blob=blob).values('blob_id')
+    blobs = list(
+        Blob.objects.filter(pk__in=others)
+        .annotate(shared_bytes=Subquery(shared_bytes))
+        .order_by('-shared_bytes', 'pk')[:limit]
+    )
+    files = {}
+    for file in File.objects.filter(blob__in=blobs).select_related('blob').order_by('uploaded_at'):
+        files.setdefault(file.blob_id, []).append(file)
+
+    return [(other, other.shared_bytes, files.get(other.pk, [])) for other in blobs]
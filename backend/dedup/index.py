@@ -0,0 +1,260 @@
+"""
+Incrementally maintained duplicate index.
+
+Every (file_hash, size) pair in the vault has a DuplicateGroup row counting
+the files with that content. The counts are adjusted in the same transaction
+as the File insert or delete, so the duplicate report is always current and
+only ``rebuild`` ever scans the whole files table.
+"""
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from files import stats
+from files.models import File
+from .models import DuplicateGroup
+
+BULK_BATCH_SIZE = 500  # Groups per bulk statement, well inside database parameter limits
+SHARD_PREFIX_LENGTH = 8  # Hex digits of file_hash that shard boundaries are drawn on
+
+
+def file_added(file_hash, size, file_type='', count=1):
+    """Record ``count`` new files with the given content"""
+    group = DuplicateGroup.objects.filter(file_hash=file_hash, size=size)
+    # SET expressions read the pre-update file_count
+    grow = {
+        'file_count': F('file_count') + count,
+        'reclaimable_bytes': F('size') * (F('file_count') + count - 1),
+    }
+    if not group.update(**grow):
+        try:
+            with transaction.atomic():
+                DuplicateGroup.objects.create(
+                    file_hash=file_hash, size=size, file_type=file_type,
+                    file_count=count, reclaimable_bytes=size * (count - 1),
+                )
+        except IntegrityError:
+            # Another transaction created the group first
+            group.update(**grow)
+
+    file_count = group.values_list('file_count', flat=True).first()
+    stats.duplicates_changed(size, file_count - count, file_count)
+
+
+def _lock_groups(keys):
+    """Lock and return the existing groups among ``keys``, keyed by (file_hash, size)"""
+    groups = DuplicateGroup.objects.select_for_update().filter(file_hash__in={file_hash for file_hash, _ in keys})
+    return {(group.file_hash, group.size): group for group in groups if (group.file_hash, group.size) in keys}
+
+
+def _shift_groups(groups, changes):
+    """
+    Add ``changes[key]`` files (negative to remove) to each group, returning
+    the resulting change to the duplicate statistics.
+
+    Groups are updated with one UPDATE per distinct change, which in a bulk
+    upload or delete is nearly always just one or two statements.
+    """
+    by_change = defaultdict(list)
+    duplicates = Counter()
+    for (file_hash, size), group in groups.items():
+        change = changes[file_hash, size]
+        by_change[change].append(group.pk)
+        duplicates.update(stats.duplicate_deltas(size, group.file_count, max(group.file_count + change, 0)))
+    for change, pks in by_change.items():
+        # SET expressions read the pre-update file_count
+        DuplicateGroup.objects.filter(pk__in=pks).update(
+            file_count=F('file_count') + change,
+            reclaimable_bytes=F('size') * (F('file_count') + change - 1),
+        )
+    return duplicates
+
+
+def _batches(keys):
+    keys = list(keys)
+    for start in range(0, len(keys), BULK_BATCH_SIZE):
+        yield keys[start:start + BULK_BATCH_SIZE]
+
+
+def files_added(files):
+    """
+    Record many new files at once, e.g. after a bulk insert.
+
+    Existing groups grow in one UPDATE and missing ones are created in one
+    INSERT per batch of groups, rather than a round trip per file.
+    """
+    added = Counter()
+    file_types = {}
+    for file in files:
+        if file.file_hash:
+            added[file.file_hash, file.size] += 1
+            file_types.setdefault((file.file_hash, file.size), file.file_type)
+
+    duplicates = Counter()
+    for keys in _batches(added):
+        groups = _lock_groups(set(keys))
+        duplicates.update(_shift_groups(groups, added))
+
+        missing = [
+            DuplicateGroup(
+                file_hash=file_hash, size=size, file_type=file_types[file_hash, size],
+                file_count=added[file_hash, size], reclaimable_bytes=size * (added[file_hash, size] - 1),
+            )
+            for file_hash, size in keys if (file_hash, size) not in groups
+        ]
+        try:
+            with transaction.atomic():
+                DuplicateGroup.objects.bulk_create(missing)
+        except IntegrityError:
+            # Another transaction created some of these groups first
+            for group in missing:
+                file_added(group.file_hash, group.size, group.file_type, group.file_count)
+        else:
+            for group in missing:
+                duplicates.update(stats.duplicate_deltas(group.size, 0, group.file_count))
+    stats.add(duplicates)
+
+
+def file_removed(file_hash, size, count=1):
+    """Record the removal of ``count`` files with the given content"""
+    group = DuplicateGroup.objects.filter(file_hash=file_hash, size=size)
+    group.update(
+        file_count=F('file_count') - count,
+        reclaimable_bytes=F('size') * (F('file_count') - count - 1),
+    )
+    file_count = group.values_list('file_count', flat=True).first()
+    if file_count is None:
+        return
+    group.filter(file_count__lte=0).delete()
+    stats.duplicates_changed(size, file_count + count, max(file_count, 0))
+
+
+def files_removed(queryset):
+    """
+    Record the removal of every hashed file in ``queryset`` before a bulk
+    delete.
+
+    The affected groups are shrunk by one UPDATE ... FROM joining the
+    removed counts per (file_hash, size), so the cost stays a few queries
+    however many groups the files span.
+    """
+    removed = (
+        queryset.exclude(file_hash__isnull=True)
+        .values('file_hash', 'size')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    counts = {(file_hash, size): count for file_hash, size, count in removed.values_list('file_hash', 'size', 'count')}
+    if not counts:
+        return
+
+    removed_sql, params = removed.query.sql_with_params()
+    group_table = connection.ops.quote_name(DuplicateGroup._meta.db_table)
+    with connection.cursor() as cursor:
+        # SET expressions read the pre-update file_count; RETURNING reports the new one
+        cursor.execute(
+            f"UPDATE {group_table} SET "
+            f"file_count = {group_table}.file_count - removed.count, "
+            f"reclaimable_bytes = {group_table}.size * ({group_table}.file_count - removed.count - 1) "
+            f"FROM ({removed_sql}) AS removed "
+            f"WHERE {group_table}.file_hash = removed.file_hash AND {group_table}.size = removed.size "
+            f"RETURNING {group_table}.file_hash, {group_table}.size, {group_table}.file_count",
+            params,
+        )
+        shrunk = cursor.fetchall()
+
+    duplicates = Counter()
+    for file_hash, size, file_count in shrunk:
+        duplicates.update(stats.duplicate_deltas(size, file_count + counts[file_hash, size], max(file_count, 0)))
+    DuplicateGroup.objects.filter(file_count__lte=0).delete()
+    stats.add(duplicates)
+
+
+def shard_range(shard, shard_count):
+    """
+    ``(start, end)`` bounds on file_hash for one of ``shard_count`` shards,
+    splitting the hash space evenly by prefix. ``end`` is exclusive, and
+    None for the last shard.
+    """
+    start = f'{shard * 16 ** SHARD_PREFIX_LENGTH // shard_count:0{SHARD_PREFIX_LENGTH}x}'
+    if shard == shard_count - 1:
+        return start, None
+    return start, shard_range(shard + 1, shard_count)[0]
+
+
+def in_shard(shard, shard_count):
+    """Filter for the rows whose file_hash falls in the given shard"""
+    if shard_count == 1:
+        return Q()
+    start, end = shard_range(shard, shard_count)
+    return Q(file_hash__gte=start, file_hash__lt=end) if end else Q(file_hash__gte=start)
+
+
+@transaction.atomic
+def rebuild(shard=0, shard_count=1):
+    """
+    Recount every group from the files table, repairing any drift in the
+    index, or only the groups in one shard of the hash space.
+
+    The recount is a single INSERT ... SELECT ... GROUP BY, so it runs
+    entirely inside the database with no rows held in Python. Shards are
+    disjoint, so they can be rebuilt in parallel.
+    """
+    DuplicateGroup.objects.filter(in_shard(shard, shard_count)).delete()
+
+    start, end = shard_range(shard, shard_count)
+    group_table = connection.ops.quote_name(DuplicateGroup._meta.db_table)
+    file_table = connection.ops.quote_name(File._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {group_table} "
+            f"(file_hash, size, file_type, file_count, reclaimable_bytes, updated_at) "
+            f"SELECT file_hash, size, MIN(file_type), COUNT(*), size * (COUNT(*) - 1), %s "
+            f"FROM {file_table} WHERE file_hash >= %s {'AND file_hash < %s' if end else ''} "
+            f"AND deleted_at IS NULL GROUP BY file_hash, size",
+            [connection.ops.adapt_datetimefield_value(timezone.now()), start, *([end] if end else [])],
+        )
+
+
+def file_entry(file):
+    """Serialize a file for the duplicate report"""
+    return {
+        'id': str(file.id),
+        'url': file.content_url,
+        'name': file.original_filename,
+        'size': file.size,
+        'file_type': file.file_type,
+        'uploaded_at': file.uploaded_at.isoformat(),
+    }
+
+
+def load_members(groups):
+    """
+    Attach ``original`` and ``duplicates`` to each group with one query for
+    all of their member files. The earliest upload is the original.
+    """
+    groups = list(groups)
+    members = {}
+    files = (
+        File.objects.filter(file_hash__in={group.file_hash for group in groups})
+        .select_related('blob')
+        .order_by('file_hash', 'size', 'uploaded_at', 'id')
+    )
+    for file in files:
+        members.setdefault((file.file_hash, file.size), []).append(file)
+
+    for group in groups:
+        group.original, *group.duplicates = members.get((group.file_hash, group.size), [None])
+    return groups
+
+
+def summary(shard=0, shard_count=1):
+    """Aggregate duplicate totals from the index without touching the files table"""
+    totals = DuplicateGroup.objects.filter(in_shard(shard, shard_count), file_count__gt=1).aggregate(
+        duplicate_groups=Count('id'),
+        duplicate_files=Sum(F('file_count') - 1),
+        reclaimable_bytes=Sum(F('size') * (F('file_count') - 1)),
+    )
+    return {key: value or 0 for key, value in totals.items()}
@@ -0,0 +1,35 @@
+import redis
+from django.core.management.base import BaseCommand, CommandError
+
+from dedup import scheduler
+from dedup.tasks import run_dedup_job
+
+
+class Command(BaseCommand):
+    help = "Rebuild the duplicate index from the files table, repairing any drift."
+
+    def handle(self, *args, **options):
+        try:
+            run = scheduler.start_run()
+        except redis.RedisError:
+            # A repair tool has to work while Redis is down; there is then no lock to take
+            self.stderr.write(self.style.WARNING(
+                "Dedup scheduler unreachable; rebuilding without the run lock."
+            ))
+            result = run_dedup_job()
+        else:
+            if run is None:
+                raise CommandError("A dedup run is already in progress.")
+
+            run_token, triggers_merged = run
+            try:
+                result = run_dedup_job(triggers_merged)
+            finally:
+                scheduler.finish_run(run_token)
+        if 'error' in result:
+            raise CommandError(f"Rebuild failed: {result['error']}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt duplicate index: {result['duplicates_found']} duplicate groups "
+            f"(job {result['dedup_job_id']})"
+        ))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dedup import similarity
+from files.models import Blob
+
+
+class Command(BaseCommand):
+    help = "Sketch stored content for near-duplicate detection, e.g. content uploaded before it was enabled."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-sketch blobs that already have a sketch")
+
+    def handle(self, *args, **options):
+        blobs = Blob.objects.filter(size__gte=settings.SIMILARITY_MIN_SIZE, size__lte=settings.SIMILARITY_MAX_SIZE)
+        if not options['all']:
+            blobs = blobs.filter(sketch__isnull=True)
+
+        sketched = pairs = 0
+        for blob_id in blobs.order_by('pk').values_list('pk', flat=True).iterator():
+            found = similarity.sketch_blob(blob_id)
+            if found is not None:
+                sketched += 1
+                pairs += found
+
+        self.stdout.write(self.style.SUCCESS(f"Sketched {sketched} blobs; {pairs} similar pairs recorded"))
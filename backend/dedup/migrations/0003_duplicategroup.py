@@ -0,0 +1,48 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:36
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_duplicate_groups(apps, schema_editor):
+    File = apps.get_model('files', 'File')
+    DuplicateGroup = apps.get_model('dedup', 'DuplicateGroup')
+    counts = (
+        File.objects.exclude(file_hash__isnull=True)
+        .values('file_hash', 'size')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    DuplicateGroup.objects.bulk_create(
+        [DuplicateGroup(file_hash=g['file_hash'], size=g['size'], file_count=g['count']) for g in counts],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dedup', '0002_dedupjob_status'),
+        ('files', '0002_file_file_hash_file_files_file_file_ha_868749_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_hash', models.CharField(max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('file_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['file_count'], name='dedup_dupli_file_co_efa181_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='duplicategroup',
+            constraint=models.UniqueConstraint(fields=('file_hash', 'size'), name='unique_duplicate_group'),
+        ),
+        migrations.RunPython(populate_duplicate_groups, migrations.RunPython.noop),
+    ]
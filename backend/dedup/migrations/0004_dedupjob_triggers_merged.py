@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dedup', '0003_duplicategroup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dedupjob',
+            name='triggers_merged',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
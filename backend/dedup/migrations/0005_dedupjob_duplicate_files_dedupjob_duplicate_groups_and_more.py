@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dedup', '0004_dedupjob_triggers_merged'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dedupjob',
+            name='duplicate_files',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dedupjob',
+            name='duplicate_groups',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dedupjob',
+            name='reclaimable_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:50
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def populate_group_columns(apps, schema_editor):
+    File = apps.get_model('files', 'File')
+    DuplicateGroup = apps.get_model('dedup', 'DuplicateGroup')
+    first_file_type = (
+        File.objects.filter(file_hash=OuterRef('file_hash'), size=OuterRef('size'))
+        .order_by('uploaded_at')
+        .values('file_type')[:1]
+    )
+    DuplicateGroup.objects.update(
+        file_type=Subquery(first_file_type),
+        reclaimable_bytes=F('size') * (F('file_count') - 1),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dedup', '0005_dedupjob_duplicate_files_dedupjob_duplicate_groups_and_more'),
+        ('files', '0004_uploadsession_uploadchunk_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='dedupjob',
+            name='duplicates',
+        ),
+        migrations.AddField(
+            model_name='duplicategroup',
+            name='file_type',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='duplicategroup',
+            name='reclaimable_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='duplicategroup',
+            index=models.Index(fields=['-reclaimable_bytes', 'id'], name='dedup_dupli_reclaim_d44f10_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='duplicategroup',
+            index=models.Index(fields=['file_type', '-reclaimable_bytes', 'id'], name='dedup_dupli_file_ty_1bee3a_idx'),
+        ),
+        migrations.RunPython(populate_group_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_chunk_blob_chunked_blobchunk'),
+        ('dedup', '0006_duplicategroup_reclaimable_bytes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlobSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.BinaryField()),
+                ('feature_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sketch', to='files.blob')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SimilarityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('sketch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='dedup.blobsketch')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SimilarPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('similarity', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('first', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='files.blob')),
+                ('second', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='files.blob')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-similarity', 'id'], name='dedup_simil_similar_a873dd_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='similarpair',
+            constraint=models.UniqueConstraint(fields=('first', 'second'), name='unique_similar_pair'),
+        ),
+        migrations.AddIndex(
+            model_name='similaritybucket',
+            index=models.Index(fields=['band', 'bucket'], name='dedup_simil_band_383c0c_idx'),
+        ),
+    ]
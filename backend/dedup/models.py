@@ -15,8 +15,80 @@ class DedupJob(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     is_valid = models.BooleanField(default=True)  # Mark as invalid when files change
-    duplicates = models.JSONField(default=list, blank=True)  # Store duplicate file data as JSON
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    triggers_merged = models.PositiveIntegerField(default=0)  # Triggers coalesced into this run
+    duplicate_groups = models.PositiveIntegerField(default=0)
+    duplicate_files = models.PositiveIntegerField(default=0)  # Files beyond the original in each group
+    reclaimable_bytes = models.BigIntegerField(default=0)
 
     def __str__(self):
-        return f"DedupJob {self.id}"
\ No newline at end of file
+        return f"DedupJob {self.id}"
+
+
+class DuplicateGroup(models.Model):
+    """
+    Number of files sharing one (file_hash, size), updated as files are added
+    and deleted. Groups with more than one file are duplicates; their member
+    files are found through the (size, file_hash) index on File.
+    """
+    file_hash = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    file_type = models.CharField(max_length=100, blank=True)  # Type of the first file indexed
+    file_count = models.PositiveIntegerField(default=0)
+    reclaimable_bytes = models.BigIntegerField(default=0)  # size * (file_count - 1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['file_hash', 'size'], name='unique_duplicate_group'),
+        ]
+        indexes = [
+            models.Index(fields=['file_count']),
+            models.Index(fields=['-reclaimable_bytes', 'id']),
+            models.Index(fields=['file_type', '-reclaimable_bytes', 'id']),
+        ]
+
+    def __str__(self):
+        return f"DuplicateGroup {self.file_hash} ({self.file_count} files)"
+
+
+class BlobSketch(models.Model):
+    """MinHash signature of a blob's content, for near-duplicate detection"""
+    blob = models.OneToOneField('files.Blob', on_delete=models.CASCADE, related_name='sketch')
+    signature = models.BinaryField()  # Packed by similarity.pack
+    feature_count = models.PositiveIntegerField()  # Distinct content chunks sketched
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"BlobSketch {self.blob_id}"
+
+
+class SimilarityBucket(models.Model):
+    """One LSH band of a sketch; blobs sharing a (band, bucket) are candidates"""
+    sketch = models.ForeignKey(BlobSketch, on_delete=models.CASCADE, related_name='buckets')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket']),
+        ]
+
+
+class SimilarPair(models.Model):
+    """Two blobs whose estimated similarity is at least SIMILARITY_THRESHOLD"""
+    first = models.ForeignKey('files.Blob', on_delete=models.CASCADE, related_name='+')  # Lower blob id
+    second = models.ForeignKey('files.Blob', on_delete=models.CASCADE, related_name='+')
+    similarity = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['first', 'second'], name='unique_similar_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['-similarity', 'id']),
+        ]
+
+    def __str__(self):
+        return f"SimilarPair {self.first_id}/{self.second_id} ({self.similarity:.2f})"
@@ -0,0 +1,78 @@
+"""
+Coalescing scheduler for full dedup runs.
+
+Triggers that arrive within ``DEDUP_COALESCE_WINDOW`` seconds of each other
+share one queued run, and a Redis lock keeps more than one run from executing
+at a time, so there is never more than one run executing and one pending.
+Each run holds the lock under its own token, so a run that outlived the
+lock's TTL cannot release the lock of the run after it.
+"""
+import uuid
+
+import redis
+from django.conf import settings
+
+PENDING_KEY = 'dedup:pending'    # set while a run is queued but has not started
+TRIGGERS_KEY = 'dedup:triggers'  # triggers received since the last run started
+RUNNING_KEY = 'dedup:running'    # holds the token of the run currently executing
+
+# Delete the lock only while it still holds the caller's token
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return _client
+
+
+def request_run():
+    """
+    Ask for a full dedup run.
+
+    Returns the id of the newly queued task, or None when the trigger was
+    merged into a run that is already pending.
+    """
+    from .tasks import deduplicate_files
+
+    client = get_client()
+    client.incr(TRIGGERS_KEY)
+    pending_ttl = settings.DEDUP_COALESCE_WINDOW + settings.DEDUP_RUN_LOCK_TTL
+    if not client.set(PENDING_KEY, 1, nx=True, ex=pending_ttl):
+        return None
+
+    return deduplicate_files.apply_async(countdown=settings.DEDUP_COALESCE_WINDOW).id
+
+
+def start_run():
+    """
+    Claim the run lock and consume the pending slot.
+
+    Returns ``(token, triggers)``, the token to pass to ``finish_run`` and
+    how many triggers this run covers, or None if another run holds the lock.
+    """
+    client = get_client()
+    token = uuid.uuid4().hex
+    if not client.set(RUNNING_KEY, token, nx=True, ex=settings.DEDUP_RUN_LOCK_TTL):
+        return None
+
+    # Triggers arriving from here on queue the next run
+    with client.pipeline() as pipe:
+        pipe.getset(TRIGGERS_KEY, 0)
+        pipe.delete(PENDING_KEY)
+        triggers, _ = pipe.execute()
+    return token, int(triggers or 0)
+
+
+def finish_run(token):
+    """Release the run lock, unless it expired and another run has claimed it"""
+    client = get_client()
+    client.register_script(RELEASE_SCRIPT)(keys=[RUNNING_KEY], args=[token])
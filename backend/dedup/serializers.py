@@ -1,8 +1,45 @@
 from rest_framework import serializers
-from .models import DedupJob
+from .models import DedupJob, DuplicateGroup, SimilarPair
+from . import index
 
 class DedupJobSerializer(serializers.ModelSerializer):
     class Meta:
         model = DedupJob
-        fields = ['id', 'created_at', 'is_valid', 'duplicates', 'status']
-        read_only_fields = ['id', 'created_at', 'duplicates']
\ No newline at end of file
+        fields = ['id', 'created_at', 'is_valid', 'status', 'triggers_merged',
+                  'duplicate_groups', 'duplicate_files', 'reclaimable_bytes']
+        read_only_fields = ['id', 'created_at', 'triggers_merged',
+                            'duplicate_groups', 'duplicate_files', 'reclaimable_bytes']
+
+class DuplicateGroupSerializer(serializers.ModelSerializer):
+    """Expects groups prepared by ``index.load_members``"""
+    original_file = serializers.SerializerMethodField()
+    duplicate_files = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DuplicateGroup
+        fields = ['id', 'file_hash', 'size', 'file_type', 'file_count', 'reclaimable_bytes',
+                  'original_file', 'duplicate_files']
+        read_only_fields = fields
+
+    def get_original_file(self, obj):
+        return index.file_entry(obj.original) if obj.original else None
+
+    def get_duplicate_files(self, obj):
+        return [index.file_entry(dup) for dup in obj.duplicates]
+
+
+class SimilarPairSerializer(serializers.ModelSerializer):
+    """Expects pairs prepared by ``similarity.load_files``"""
+    files = serializers.SerializerMethodField()
+    similar_files = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SimilarPair
+        fields = ['id', 'similarity', 'files', 'similar_files']
+        read_only_fields = fields
+
+    def get_files(self, obj):
+        return [index.file_entry(file) for file in obj.files]
+
+    def get_similar_files(self, obj):
+        return [index.file_entry(file) for file in obj.similar_files]
@@ -0,0 +1,148 @@
+"""
+Near-duplicate detection with MinHash sketches and an LSH band index.
+
+Each blob is reduced to the set of its content-defined chunks. A MinHash
+signature of that set estimates the Jaccard similarity of any two blobs,
+and splitting the signature into bands gives locality-sensitive buckets:
+blobs that share a bucket in any band are candidates, so finding the
+similar blobs of a new upload never compares it against the whole vault.
+"""
+import random
+import struct
+from hashlib import blake2b
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from files import chunking
+from files.models import Blob, File
+from .models import BlobSketch, SimilarityBucket, SimilarPair
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS  # With 16 x 8, pairs above ~0.8 Jaccard are found ~95% of the time
+
+# Smaller chunks than block-level dedup uses, so modest files still yield
+# enough features for a meaningful sketch
+FEATURE_MIN_SIZE = 1024
+FEATURE_AVG_SIZE = 4 * 1024
+FEATURE_MAX_SIZE = 16 * 1024
+
+_PRIME = (1 << 61) - 1
+# Fixed seed: signatures are stored and must stay comparable across processes
+_rng = random.Random(0x6d696e68617368)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_SIGNATURE = struct.Struct(f'>{NUM_PERM}Q')
+_BAND = struct.Struct(f'>{ROWS}Q')
+
+
+def content_features(stream):
+    """Return the set of 64-bit chunk fingerprints of a binary stream"""
+    return {
+        int.from_bytes(blake2b(data, digest_size=8).digest(), 'big')
+        for data in chunking.iter_chunks(stream, FEATURE_MIN_SIZE, FEATURE_AVG_SIZE, FEATURE_MAX_SIZE)
+    }
+
+
+def minhash(features):
+    """Compute the MinHash signature of a non-empty feature set"""
+    values = [feature % _PRIME for feature in features]
+    return [min((a * x + b) % _PRIME for x in values) for a, b in _PERMUTATIONS]
+
+
+def pack(signature):
+    return _SIGNATURE.pack(*signature)
+
+
+def unpack(data):
+    return list(_SIGNATURE.unpack(bytes(data)))
+
+
+def band_keys(signature):
+    """Yield ``(band, bucket)`` pairs, with buckets as signed 64-bit ints"""
+    for band in range(BANDS):
+        rows = _BAND.pack(*signature[band * ROWS:(band + 1) * ROWS])
+        yield band, int.from_bytes(blake2b(rows, digest_size=8).digest(), 'big', signed=True)
+
+
+def estimate(signature, other):
+    """Estimate Jaccard similarity as the fraction of matching MinHash values"""
+    return sum(a == b for a, b in zip(signature, other)) / NUM_PERM
+
+
+def sketch_blob(blob_id):
+    """
+    Sketch a blob's content, index it in the LSH buckets and record every
+    similar blob it has. Returns the number of similar pairs, or None if the
+    blob no longer exists.
+    """
+    blob = Blob.objects.filter(pk=blob_id).first()
+    if not blob:
+        return None
+    try:
+        with blob.open() as content:
+            features = content_features(content)
+    except FileNotFoundError:
+        # Converted to chunks while we were opening it; read the manifest instead
+        blob = Blob.objects.filter(pk=blob_id).first()
+        if not blob:
+            return None
+        with blob.open() as content:
+            features = content_features(content)
+    if not features:
+        return None
+    signature = minhash(features)
+    keys = list(band_keys(signature))
+
+    with transaction.atomic():
+        if not Blob.objects.select_for_update().filter(pk=blob_id).exists():
+            return None
+        BlobSketch.objects.filter(blob_id=blob_id).delete()
+        SimilarPair.objects.filter(Q(first_id=blob_id) | Q(second_id=blob_id)).delete()
+        sketch = BlobSketch.objects.create(blob_id=blob_id, signature=pack(signature), feature_count=len(features))
+        SimilarityBucket.objects.bulk_create(
+            SimilarityBucket(sketch=sketch, band=band, bucket=bucket) for band, bucket in keys
+        )
+
+        buckets = Q()
+        for band, bucket in keys:
+            buckets |= Q(band=band, bucket=bucket)
+        candidate_ids = (
+            SimilarityBucket.objects.filter(buckets).exclude(sketch=sketch)
+            .values('sketch_id').distinct()
+        )
+        pairs = []
+        for other_blob_id, other_signature in BlobSketch.objects.filter(pk__in=candidate_ids).values_list('blob_id', 'signature'):
+            score = estimate(signature, unpack(other_signature))
+            if score >= settings.SIMILARITY_THRESHOLD:
+                first, second = sorted((blob_id, other_blob_id))
+                pairs.append(SimilarPair(first_id=first, second_id=second, similarity=score))
+        SimilarPair.objects.bulk_create(pairs)
+
+    return len(pairs)
+
+
+def similar_pairs(file=None):
+    """Similar pairs, optionally only those involving ``file``'s content"""
+    pairs = SimilarPair.objects.all()
+    if file is not None:
+        pairs = pairs.filter(Q(first_id=file.blob_id) | Q(second_id=file.blob_id))
+    return pairs
+
+
+def load_files(pairs):
+    """
+    Attach ``files`` and ``similar_files`` to each pair, the File rows
+    holding its first and second blob, with one query for all of them.
+    """
+    pairs = list(pairs)
+    members = {}
+    blob_ids = {pair.first_id for pair in pairs} | {pair.second_id for pair in pairs}
+    for file in File.objects.filter(blob_id__in=blob_ids).select_related('blob').order_by('uploaded_at', 'id'):
+        members.setdefault(file.blob_id, []).append(file)
+
+    for pair in pairs:
+        pair.files = members.get(pair.first_id, [])
+        pair.similar_files = members.get(pair.second_id, [])
+    return pairs
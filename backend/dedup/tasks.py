@@ -1,76 +1,149 @@
-from celery import shared_task
+from celery import chord, shared_task
+from django.conf import settings
+from django.utils import timezone
+from core import metrics
+from files import caching, stats
 from .models import DedupJob
-from files.models import File
-from django.db.models import Count
+from . import index, scheduler, similarity
 
-@shared_task
-def deduplicate_files():
+
+def start_dedup_job(triggers_merged=0):
+    """Invalidate previous dedup jobs and record a new one in progress"""
+    DedupJob.objects.filter(is_valid=True).update(is_valid=False)
+    return DedupJob.objects.create(status='in_progress', is_valid=True, triggers_merged=triggers_merged)
+
+
+def rebuild_shard(shard, shard_count):
+    """Rebuild one shard of the duplicate index, returning its duplicate totals"""
+    with metrics.timer('vault_dedup_shard_seconds'):
+        index.rebuild(shard, shard_count)
+        return index.summary(shard, shard_count)
+
+
+def record_run_time(dedup_job, status):
+    """Observe a finished run's wall time, from the job's creation"""
+    elapsed = (timezone.now() - dedup_job.created_at).total_seconds()
+    metrics.observe('vault_dedup_run_seconds', elapsed, status=status)
+
+
+def complete_dedup_job(dedup_job, shard_totals):
     """
-    Task to find duplicate files for a specific user.
+    Merge the shards' duplicate totals into ``dedup_job`` and mark it
+    completed. The vault statistics are recounted here, once the whole
+    index has been rebuilt.
     """
-    # Invalidate previous dedup jobs for this user
-    DedupJob.objects.filter(is_valid=True).update(is_valid=False)
-    
-    # Create a new dedup job
-    dedup_job = DedupJob.objects.create(duplicates=[], status='in_progress', is_valid=True)
+    stats.rebuild()
+    caching.bump_version()
 
-    try:
-        duplicates = []
-
-        # Find duplicate files by hash and size
-        duplicate_groups = (
-            File.objects.exclude(file_hash__isnull=True)
-            .values('file_hash', 'size')
-            .annotate(count=Count('id'))
-            .filter(count__gt=1)
-        )
+    # Update the dedup job with results
+    dedup_job.duplicate_groups = sum(totals['duplicate_groups'] for totals in shard_totals)
+    dedup_job.duplicate_files = sum(totals['duplicate_files'] for totals in shard_totals)
+    dedup_job.reclaimable_bytes = sum(totals['reclaimable_bytes'] for totals in shard_totals)
+    dedup_job.status = 'completed'
+    dedup_job.save()
+    record_run_time(dedup_job, 'completed')
 
-        for group in duplicate_groups:
-            file_hash = group['file_hash']
-            size = group['size']
-
-            # Get all files in this duplicate group
-            group_files = File.objects.filter(file_hash=file_hash, size=size).order_by('uploaded_at')
-
-            # Keep the first file as the original
-            original = group_files.first()
-            duplicate_list = list(group_files.exclude(id=original.id))
-
-            duplicates.append({
-                'original_file': {
-                    'id': str(original.id),
-                    'url': original.file.url,
-                    'name': original.original_filename,
-                    'size': original.size,
-                    'file_type': original.file_type,
-                    'uploaded_at': original.uploaded_at.isoformat(),
-                },
-                'duplicate_files': [
-                    {
-                        'id': str(dup.id),
-                        'url': dup.file.url,
-                        'name': dup.original_filename,
-                        'size': dup.size,
-                        'file_type': dup.file_type,
-                        'uploaded_at': dup.uploaded_at.isoformat(),
-                    } for dup in duplicate_list
-                ],
-            })
-
-        # Update the dedup job with results
-        dedup_job.duplicates = duplicates
-        dedup_job.status = 'completed'
-        dedup_job.save()
+    return {
+        'dedup_job_id': str(dedup_job.id),
+        'duplicates_found': dedup_job.duplicate_groups,
+        'triggers_merged': dedup_job.triggers_merged,
+    }
 
-        return {
-            'dedup_job_id': str(dedup_job.id),
-            'duplicates_found': len(duplicates),
-        }
+
+def run_dedup_job(triggers_merged=0):
+    """
+    Rebuild the duplicate index from scratch and record the run as a DedupJob,
+    shard by shard in this process.
+
+    The index is kept current as files change, so this only repairs drift
+    (e.g. after rows were written outside the ORM). The job stores summary
+    totals; the per-group report is read from the index on demand.
+    """
+    dedup_job = start_dedup_job(triggers_merged)
+    shard_count = settings.DEDUP_SHARD_COUNT
+    try:
+        shard_totals = [rebuild_shard(shard, shard_count) for shard in range(shard_count)]
+        return complete_dedup_job(dedup_job, shard_totals)
     except Exception as e:
         # Handle exceptions and update the dedup job status
         dedup_job.status = 'failed'
         dedup_job.save()
+        record_run_time(dedup_job, 'failed')
         return {
             'dedup_job_id': str(dedup_job.id),
             'error': str(e),
-        }
\ No newline at end of file
+        }
+
+
+@shared_task
+def deduplicate_files():
+    """
+    Task to run a coalesced dedup job; queue it through ``scheduler.request_run``.
+
+    The index is rebuilt by one ``dedup_shard`` task per shard of the hash
+    space, spread over every worker process, and ``finish_dedup_job``
+    merges their totals once all of them succeed. The run lock is held
+    until then.
+    """
+    run = scheduler.start_run()
+    if run is None:
+        # Another run is executing; try again later, keeping our pending slot
+        deduplicate_files.apply_async(countdown=settings.DEDUP_COALESCE_WINDOW)
+        return {'deferred': True}
+
+    run_token, triggers_merged = run
+    try:
+        dedup_job = start_dedup_job(triggers_merged)
+        shard_count = settings.DEDUP_SHARD_COUNT
+        finish = finish_dedup_job.s(str(dedup_job.id), run_token).on_error(
+            fail_dedup_job.si(str(dedup_job.id), run_token)
+        )
+        chord(dedup_shard.s(shard, shard_count) for shard in range(shard_count))(finish)
+    except Exception:
+        scheduler.finish_run(run_token)
+        raise
+    return {'dedup_job_id': str(dedup_job.id), 'shards': shard_count, 'triggers_merged': triggers_merged}
+
+
+@shared_task(autoretry_for=(Exception,), max_retries=settings.DEDUP_SHARD_MAX_RETRIES, retry_backoff=True)
+def dedup_shard(shard, shard_count):
+    """
+    Task to rebuild one shard of the duplicate index. A failed shard is
+    retried on its own; the rest of the run is unaffected.
+    """
+    return rebuild_shard(shard, shard_count)
+
+
+@shared_task
+def finish_dedup_job(shard_totals, dedup_job_id, run_token):
+    """
+    Task run once every shard is rebuilt, completing the dedup job.
+    """
+    try:
+        return complete_dedup_job(DedupJob.objects.get(pk=dedup_job_id), shard_totals)
+    finally:
+        scheduler.finish_run(run_token)
+
+
+@shared_task
+def fail_dedup_job(dedup_job_id, run_token):
+    """
+    Task run when a shard fails for good, or the merge does, marking the
+    dedup job failed.
+    """
+    try:
+        dedup_job = DedupJob.objects.get(pk=dedup_job_id)
+        dedup_job.status = 'failed'
+        dedup_job.save()
+        record_run_time(dedup_job, 'failed')
+    finally:
+        scheduler.finish_run(run_token)
+
+
+@shared_task
+def sketch_blob(blob_id):
+    """
+    Task to sketch a blob's content and record the blobs similar to it.
+    """
+    pairs = similarity.sketch_blob(blob_id)
+    return {'blob_id': blob_id, 'skipped': pairs is None, 'similar_pairs': pairs or 0}
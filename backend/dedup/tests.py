@@ -1,3 +1,435 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import redis
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from files.chunking import MAX_CHUNK_SIZE
+from files.models import File
+from files.tasks import chunk_blob
+from core.celery import app
+from . import index, scheduler, similarity
+from .models import BlobSketch, DedupJob, DuplicateGroup, SimilarPair
+from .tasks import deduplicate_files, fail_dedup_job, finish_dedup_job, run_dedup_job
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='vault-tests-')
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    METRICS_URL=None,
+)
+class DedupTestCase(TestCase):
+    """Runs against a temporary media directory and an in-memory response cache"""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+
+    def upload(self, content, name='file.txt', content_type='text/plain'):
+        upload = SimpleUploadedFile(name, content, content_type)
+        response = self.client.post('/api/files/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return File.objects.get(pk=response.data['id'])
+
+    def groups(self):
+        return {
+            (group.file_hash, group.size): group.file_count
+            for group in DuplicateGroup.objects.all()
+        }
+
+    def assertMatchesRebuild(self):
+        """The incrementally maintained index equals a recount"""
+        groups = self.groups()
+        index.rebuild()
+        self.assertEqual(self.groups(), groups)
+
+
+class DuplicateIndexTests(DedupTestCase):
+    def test_uploads_are_counted(self):
+        first = self.upload(b'twice', 'a.txt')
+        self.upload(b'twice', 'b.txt')
+        once = self.upload(b'once', 'c.txt')
+
+        self.assertEqual(self.groups(), {(first.file_hash, 5): 2, (once.file_hash, 4): 1})
+        self.assertEqual(DuplicateGroup.objects.get(file_hash=first.file_hash).reclaimable_bytes, 5)
+        self.assertEqual(index.summary(), {'duplicate_groups': 1, 'duplicate_files': 1, 'reclaimable_bytes': 5})
+        self.assertMatchesRebuild()
+
+    def test_deleting_a_file_uncounts_it(self):
+        first = self.upload(b'twice', 'a.txt')
+        second = self.upload(b'twice', 'b.txt')
+
+        first.delete()
+
+        self.assertEqual(self.groups(), {(first.file_hash, 5): 1})
+        self.assertEqual(index.summary()['duplicate_groups'], 0)
+        self.assertMatchesRebuild()
+
+        second.delete()
+
+        self.assertEqual(self.groups(), {})
+        self.assertMatchesRebuild()
+
+    def test_bulk_changes_are_counted(self):
+        files = File.objects.bulk_create([
+            File(file=f'uploads/{i}.txt', file_hash=file_hash, original_filename=f'{i}.txt',
+                 file_type='text/plain', size=10)
+            for i, file_hash in enumerate(['a' * 64, 'a' * 64, 'a' * 64, 'b' * 64])
+        ])
+        index.files_added(files)
+        self.assertEqual(self.groups(), {('a' * 64, 10): 3, ('b' * 64, 10): 1})
+        self.assertMatchesRebuild()
+
+        removed = File.objects.filter(pk__in=[files[0].pk, files[3].pk])
+        index.files_removed(removed)
+        removed.update(deleted_at=timezone.now())
+        self.assertEqual(self.groups(), {('a' * 64, 10): 2})
+        self.assertMatchesRebuild()
+
+
+@override_settings(DEDUP_SHARD_COUNT=4)
+class DedupEngineTests(DedupTestCase):
+    def test_rebuild_repairs_drift(self):
+        file = self.upload(b'content', 'a.txt')
+        # Rows written outside the ORM's signals leave the index behind
+        File.objects.bulk_create([File(file=file.file.name, blob=file.blob, file_hash=file.file_hash,
+                                       original_filename='copy.txt', file_type='text/plain', size=file.size)])
+        self.assertEqual(self.groups(), {(file.file_hash, 7): 1})
+
+        result = run_dedup_job()
+
+        self.assertEqual(result['duplicates_found'], 1)
+        self.assertEqual(self.groups(), {(file.file_hash, 7): 2})
+        job = DedupJob.objects.get(pk=result['dedup_job_id'])
+        self.assertEqual((job.status, job.duplicate_files, job.reclaimable_bytes), ('completed', 1, 7))
+
+    def test_a_new_run_invalidates_older_jobs(self):
+        first = run_dedup_job()['dedup_job_id']
+        second = run_dedup_job()['dedup_job_id']
+        self.assertEqual(list(DedupJob.objects.filter(is_valid=True).values_list('pk', flat=True)),
+                         [DedupJob.objects.get(pk=second).pk])
+        self.assertFalse(DedupJob.objects.get(pk=first).is_valid)
+
+    def test_failed_runs_are_recorded(self):
+        with mock.patch.object(index, 'rebuild', side_effect=RuntimeError('disk full')):
+            result = run_dedup_job()
+        self.assertEqual(result['error'], 'disk full')
+        self.assertEqual(DedupJob.objects.get(pk=result['dedup_job_id']).status, 'failed')
+
+
+class DuplicateReportTests(DedupTestCase):
+    def setUp(self):
+        super().setUp()
+        # Groups of 2 to 6 copies, wasting 10 to 50 bytes
+        for copies in range(2, 7):
+            for copy in range(copies):
+                self.upload(bytes([copies]) * 10, f'{copies}-{copy}.bin', 'application/octet-stream')
+        self.upload(b'image', 'image.png', 'image/png')
+        self.upload(b'image', 'copy.png', 'image/png')
+        self.upload(b'unique', 'unique.txt')
+
+    def test_groups_are_paginated_most_wasteful_first(self):
+        response = self.client.get('/api/dedup/groups/', {'page_size': 2})
+        pages = [response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append(response.data['results'])
+
+        groups = [group for page in pages for group in page]
+        self.assertEqual([len(page) for page in pages], [2, 2, 2])
+        self.assertEqual([group['reclaimable_bytes'] for group in groups], [50, 40, 30, 20, 10, 5])
+        first = groups[0]
+        self.assertEqual(first['file_count'], 6)
+        self.assertEqual(first['original_file']['name'], '6-0.bin')
+        self.assertEqual([entry['name'] for entry in first['duplicate_files']], [f'6-{i}.bin' for i in range(1, 6)])
+
+    def test_groups_filtered_by_category(self):
+        response = self.client.get('/api/dedup/groups/', {'fileType': 'images'})
+        self.assertEqual([group['file_type'] for group in response.data['results']], ['image/png'])
+
+    def test_latest_reports_totals_and_the_top_groups(self):
+        response = self.client.get('/api/dedup/latest/', {'limit': 2})
+
+        self.assertEqual(response.data['duplicate_groups'], 6)
+        self.assertEqual(response.data['duplicate_files'], 16)
+        self.assertEqual(response.data['reclaimable_bytes'], 155)
+        self.assertEqual([group['reclaimable_bytes'] for group in response.data['duplicates']], [50, 40])
+        self.assertEqual(self.client.get('/api/dedup/latest/', {'limit': 'x'}).status_code, 400)
+
+
+class SharedContentTests(DedupTestCase):
+    def chunked_upload(self, content, name):
+        file = self.upload(content, name, 'application/octet-stream')
+        chunk_blob(file.blob_id)
+        return file
+
+    def test_files_sharing_blocks(self):
+        common = os.urandom(1024 * 1024)
+        file = self.chunked_upload(common + os.urandom(1024 * 1024), 'a.bin')
+        other = self.chunked_upload(os.urandom(512 * 1024) + common, 'b.bin')
+        self.chunked_upload(os.urandom(512 * 1024), 'unrelated.bin')
+
+        response = self.client.get('/api/dedup/shared/', {'file': str(file.pk)})
+
+        self.assertEqual([result['file']['id'] for result in response.data['results']], [str(other.pk)])
+        shared = response.data['results'][0]
+        # Only the chunks straddling either end of the common content differ
+        self.assertGreater(shared['shared_bytes'], len(common) - 2 * MAX_CHUNK_SIZE)
+        self.assertLessEqual(shared['shared_bytes'], len(common))
+
+    def test_repeated_blocks_count_once(self):
+        # Zero-filled content splits into identical maximum size chunks
+        file = self.chunked_upload(bytes(MAX_CHUNK_SIZE) + os.urandom(MAX_CHUNK_SIZE), 'a.bin')
+        other = self.chunked_upload(bytes(16 * MAX_CHUNK_SIZE), 'zeros.bin')
+
+        for this, that in [(file, other), (other, file)]:
+            with self.subTest(file=this.original_filename):
+                response = self.client.get('/api/dedup/shared/', {'file': str(this.pk)})
+                result, = response.data['results']
+                self.assertEqual(result['file']['id'], str(that.pk))
+                self.assertEqual(result['shared_bytes'], MAX_CHUNK_SIZE)
+                self.assertEqual(result['shared_ratio'], round(MAX_CHUNK_SIZE / (16 * MAX_CHUNK_SIZE), 4))
+
+    def test_files_not_stored_as_chunks(self):
+        file = self.upload(b'whole file', 'a.txt')
+        self.assertEqual(self.client.get('/api/dedup/shared/', {'file': str(file.pk)}).status_code, 404)
+        self.assertEqual(self.client.get('/api/dedup/shared/', {'file': 'nope'}).status_code, 404)
+
+
+class SimilarityTests(DedupTestCase):
+    def test_near_duplicates_are_paired(self):
+        content = os.urandom(256 * 1024)
+        file = self.upload(content, 'a.bin')
+        edited = self.upload(content[:100 * 1024] + b'edit' + content[100 * 1024:], 'b.bin')
+        unrelated = self.upload(os.urandom(256 * 1024), 'c.bin')
+
+        for blob_id in [file.blob_id, edited.blob_id, unrelated.blob_id]:
+            similarity.sketch_blob(blob_id)
+
+        pair = SimilarPair.objects.get()
+        self.assertEqual({pair.first_id, pair.second_id}, {file.blob_id, edited.blob_id})
+        self.assertGreaterEqual(pair.similarity, 0.8)
+        response = self.client.get('/api/dedup/similar/', {'file': str(edited.pk)})
+        result, = response.data['results']
+        self.assertEqual({entry['id'] for entry in result['files'] + result['similar_files']},
+                         {str(file.pk), str(edited.pk)})
+        self.assertEqual(self.client.get('/api/dedup/similar/', {'file': str(unrelated.pk)}).data['results'], [])
+
+    def test_sketching_again_replaces_the_sketch(self):
+        file = self.upload(os.urandom(64 * 1024), 'a.bin')
+        similarity.sketch_blob(file.blob_id)
+        similarity.sketch_blob(file.blob_id)
+        self.assertEqual(BlobSketch.objects.filter(blob_id=file.blob_id).count(), 1)
+        self.assertIsNone(similarity.sketch_blob(0))
+
+    @override_settings(SIMILARITY_ENABLED=True, SIMILARITY_MIN_SIZE=10, SIMILARITY_MAX_SIZE=100)
+    def test_new_blobs_in_the_size_range_are_queued_for_sketching(self):
+        with mock.patch('dedup.tasks.sketch_blob.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                file = self.upload(b'x' * 50, 'a.txt')
+                self.upload(b'x' * 50, 'copy.txt')
+                self.upload(b'x' * 5, 'small.txt')
+                self.upload(b'x' * 500, 'large.txt')
+        delay.assert_called_once_with(file.blob_id)
+
+    def test_sketching_runs_on_its_own_queue(self):
+        self.assertEqual(app.amqp.router.route({}, 'dedup.tasks.sketch_blob')['queue'].name, 'similarity')
+
+
+class ShardTests(SimpleTestCase):
+    def test_shards_tile_the_hash_space(self):
+        for shard_count in [1, 2, 3, 16, 255]:
+            with self.subTest(shard_count=shard_count):
+                ranges = [index.shard_range(shard, shard_count) for shard in range(shard_count)]
+                self.assertEqual(ranges[0][0], '0' * index.SHARD_PREFIX_LENGTH)
+                self.assertIsNone(ranges[-1][1])
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, start)
+                self.assertEqual(ranges, sorted(ranges, key=lambda bounds: bounds[0]))
+
+    def test_boundaries(self):
+        self.assertEqual(index.shard_range(1, 16), ('10000000', '20000000'))
+        self.assertEqual(index.shard_range(15, 16), ('f0000000', None))
+        self.assertEqual(index.in_shard(0, 1).children, [])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, METRICS_URL=None)
+class ShardRebuildTests(TestCase):
+    HASHES = [
+        '0' * 64,
+        '0fffffff' + 'f' * 56,
+        '10000000' + '0' * 56,
+        '7fffffff' + 'f' * 56,
+        '80000000' + '0' * 56,
+        'f' * 64,
+    ]
+
+    def setUp(self):
+        files = []
+        for i, file_hash in enumerate(self.HASHES):
+            # One more copy of each hash than the one before
+            files += [
+                File(file=f'uploads/{i}-{copy}.bin', file_hash=file_hash, original_filename=f'{i}-{copy}.bin',
+                     file_type='text/plain', size=100 + i)
+                for copy in range(i + 1)
+            ]
+        File.objects.bulk_create(files)
+
+    def test_every_group_is_rebuilt_by_exactly_one_shard(self):
+        for shard_count in [2, 3, 16]:
+            with self.subTest(shard_count=shard_count):
+                seen = {}
+                for shard in range(shard_count):
+                    DuplicateGroup.objects.all().delete()
+                    index.rebuild(shard, shard_count)
+                    start, end = index.shard_range(shard, shard_count)
+                    for group in DuplicateGroup.objects.all():
+                        self.assertNotIn(group.file_hash, seen)
+                        self.assertTrue(start <= group.file_hash and (end is None or group.file_hash < end))
+                        seen[group.file_hash] = group.file_count
+                self.assertEqual(seen, {file_hash: i + 1 for i, file_hash in enumerate(self.HASHES)})
+
+    def test_shard_summaries_add_up(self):
+        index.rebuild()
+        total = index.summary()
+        for shard_count in [2, 3, 16]:
+            with self.subTest(shard_count=shard_count):
+                shards = [index.summary(shard, shard_count) for shard in range(shard_count)]
+                for key, value in total.items():
+                    self.assertEqual(sum(summary[key] for summary in shards), value)
+
+    def test_rebuilding_a_shard_leaves_the_others_alone(self):
+        index.rebuild()
+        DuplicateGroup.objects.filter(file_hash=self.HASHES[0]).update(file_count=99)
+        DuplicateGroup.objects.filter(file_hash=self.HASHES[-1]).update(file_count=99)
+
+        index.rebuild(0, 2)
+
+        self.assertEqual(DuplicateGroup.objects.get(file_hash=self.HASHES[0]).file_count, 1)
+        self.assertEqual(DuplicateGroup.objects.get(file_hash=self.HASHES[-1]).file_count, 99)
+
+
+@override_settings(METRICS_URL=None)
+class ShardedRunTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(scheduler, 'finish_run')
+        self.finish_run = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_shard_totals_are_merged(self):
+        job = DedupJob.objects.create(status='in_progress', is_valid=True, triggers_merged=3)
+        totals = [
+            {'duplicate_groups': 1, 'duplicate_files': 2, 'reclaimable_bytes': 10},
+            {'duplicate_groups': 0, 'duplicate_files': 0, 'reclaimable_bytes': 0},
+            {'duplicate_groups': 2, 'duplicate_files': 3, 'reclaimable_bytes': 5},
+        ]
+
+        result = finish_dedup_job(totals, str(job.pk), 'token')
+
+        self.assertEqual(result, {'dedup_job_id': str(job.pk), 'duplicates_found': 3, 'triggers_merged': 3})
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.duplicate_files, job.reclaimable_bytes), ('completed', 5, 15))
+        self.finish_run.assert_called_once_with('token')
+
+    def test_a_failed_shard_fails_the_run(self):
+        job = DedupJob.objects.create(status='in_progress', is_valid=True)
+        fail_dedup_job(str(job.pk), 'token')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.finish_run.assert_called_once_with('token')
+
+    @override_settings(DEDUP_SHARD_COUNT=3)
+    def test_runs_queue_one_task_per_shard(self):
+        with mock.patch.object(scheduler, 'start_run', return_value=('token', 1)), \
+                mock.patch('dedup.tasks.chord') as queue_chord:
+            result = deduplicate_files()
+
+        header = list(queue_chord.call_args.args[0])
+        self.assertEqual([task.args for task in header], [(0, 3), (1, 3), (2, 3)])
+        self.assertEqual(result['shards'], 3)
+        self.assertEqual(DedupJob.objects.get(pk=result['dedup_job_id']).status, 'in_progress')
+        self.finish_run.assert_not_called()
+
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+class SchedulerTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(scheduler, '_client', fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(DEDUP_COALESCE_WINDOW=5)
+    def test_triggers_in_the_window_share_one_run(self):
+        with mock.patch('dedup.tasks.deduplicate_files.apply_async') as apply_async:
+            apply_async.return_value.id = 'task-1'
+            self.assertEqual(scheduler.request_run(), 'task-1')
+            self.assertIsNone(scheduler.request_run())
+            self.assertIsNone(scheduler.request_run())
+        apply_async.assert_called_once_with(countdown=5)
+
+        token, triggers = scheduler.start_run()
+        self.assertEqual(triggers, 3)
+        # The pending slot is consumed, so the next trigger queues the next run
+        with mock.patch('dedup.tasks.deduplicate_files.apply_async') as apply_async:
+            self.assertIsNotNone(scheduler.request_run())
+        scheduler.finish_run(token)
+
+    def test_one_run_at_a_time(self):
+        token, _ = scheduler.start_run()
+        self.assertIsNone(scheduler.start_run())
+        scheduler.finish_run(token)
+        self.assertIsNotNone(scheduler.start_run())
+
+    def test_an_expired_run_does_not_release_the_next_runs_lock(self):
+        expired, _ = scheduler.start_run()
+        # The lock's TTL runs out before the first run finishes
+        scheduler.get_client().delete(scheduler.RUNNING_KEY)
+        current, _ = scheduler.start_run()
+
+        scheduler.finish_run(expired)
+
+        self.assertIsNone(scheduler.start_run())
+        scheduler.finish_run(current)
+        self.assertIsNotNone(scheduler.start_run())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, METRICS_URL=None, DEDUP_SHARD_COUNT=2)
+class RebuildCommandTests(TestCase):
+    def test_rebuilds_without_the_lock_when_redis_is_unreachable(self):
+        stderr = StringIO()
+        with mock.patch.object(scheduler, 'start_run', side_effect=redis.ConnectionError):
+            call_command('rebuild_dedup_index', stdout=StringIO(), stderr=stderr)
+        self.assertIn('unreachable', stderr.getvalue())
+        self.assertEqual(DedupJob.objects.get().status, 'completed')
+
+    def test_refuses_to_run_while_another_run_holds_the_lock(self):
+        with mock.patch.object(scheduler, 'start_run', return_value=None):
+            with self.assertRaises(CommandError):
+                call_command('rebuild_dedup_index', stdout=StringIO())
+        self.assertFalse(DedupJob.objects.exists())
+
+    def test_releases_its_lock(self):
+        with mock.patch.object(scheduler, 'start_run', return_value=('token', 2)), \
+                mock.patch.object(scheduler, 'finish_run') as finish_run:
+            call_command('rebuild_dedup_index', stdout=StringIO())
+        finish_run.assert_called_once_with('token')
+        self.assertEqual(DedupJob.objects.get().triggers_merged, 2)
@@ -1,9 +1,30 @@
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import DedupJob
-from .serializers import DedupJobSerializer
-from .tasks import deduplicate_files
+from rest_framework.pagination import CursorPagination
+from django.utils import timezone
+from django.core.exceptions import ValidationError
+from files import caching
+from files.categories import filter_by_category
+from files.models import File
+from .models import DedupJob, DuplicateGroup
+from .serializers import DedupJobSerializer, DuplicateGroupSerializer, SimilarPairSerializer
+from . import blocks, index, scheduler, similarity
+
+LATEST_GROUP_LIMIT = 50
+MAX_LATEST_GROUP_LIMIT = 500
+
+class DuplicateGroupPagination(CursorPagination):
+    ordering = ('-reclaimable_bytes', 'id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class SimilarPairPagination(CursorPagination):
+    ordering = ('-similarity', 'id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
 
 class DedupViewSet(viewsets.ModelViewSet):
     """
@@ -15,26 +36,103 @@ class DedupViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def trigger(self, request):
         """
-        Trigger a new deduplication job for the current user.
+        Trigger a full rebuild of the duplicate index.
         """
 
-        # Trigger the Celery task
-        task = deduplicate_files.delay()
+        # Triggers close together share one queued run
+        task_id = scheduler.request_run()
+        message = (
+            'Deduplication task has been started.' if task_id
+            else 'Deduplication task is already pending; trigger merged.'
+        )
 
         return Response({
-            'message': 'Deduplication task has been started.',
-            'task_id': task.id
+            'message': message,
+            'task_id': task_id
         }, status=status.HTTP_202_ACCEPTED)
 
     @action(detail=False, methods=['get'])
+    @caching.cached_response
     def latest(self, request):
         """
-        Get the latest valid deduplication job for the current user.
+        Get the current duplicate totals and the ``limit`` most wasteful groups,
+        read from the live duplicate index.
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', LATEST_GROUP_LIMIT)), MAX_LATEST_GROUP_LIMIT)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        groups = self.duplicate_groups(request).order_by('-reclaimable_bytes', 'id')[:max(limit, 0)]
+        serializer = DuplicateGroupSerializer(index.load_members(groups), many=True)
+        return Response({
+            'status': 'completed',
+            'is_valid': True,
+            'generated_at': timezone.now().isoformat(),
+            **index.summary(),
+            'duplicates': serializer.data,
+        })
+
+    @action(detail=False, methods=['get'], pagination_class=DuplicateGroupPagination)
+    @caching.cached_response
+    def groups(self, request):
+        """
+        List duplicate groups, most reclaimable bytes first, with cursor pagination.
+        """
+        page = self.paginate_queryset(self.duplicate_groups(request))
+        serializer = DuplicateGroupSerializer(index.load_members(page), many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], pagination_class=SimilarPairPagination)
+    def similar(self, request):
         """
-        dedup_job = DedupJob.objects.filter(is_valid=True).first()
+        List near-duplicate pairs, most similar first, with cursor pagination.
+
+        ``?file=<id>`` restricts the list to pairs involving that file's content.
+        """
+        file = None
+        if 'file' in request.query_params:
+            try:
+                file = File.objects.filter(pk=request.query_params['file']).first()
+            except ValidationError:
+                file = None
+            if not file:
+                return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        page = self.paginate_queryset(similarity.similar_pairs(file))
+        serializer = SimilarPairSerializer(similarity.load_files(page), many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def shared(self, request):
+        """
+        List files sharing content blocks with ``?file=<id>``, most shared bytes first.
+
+        ``shared_ratio`` is the shared bytes over the larger of the two files,
+        so 1.0 means identical content. Only files stored as chunks are compared.
+        """
+        try:
+            file = File.objects.select_related('blob').filter(pk=request.query_params.get('file')).first()
+        except ValidationError:
+            file = None
+        if not file:
+            return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not file.blob_id or not file.blob.chunked:
+            return Response({'message': 'File is not stored as chunks.'}, status=status.HTTP_404_NOT_FOUND)
+
+        results = []
+        for other, shared_bytes, other_files in blocks.shared_content(file.blob):
+            results.extend({
+                'file': index.file_entry(other_file),
+                'shared_bytes': shared_bytes,
+                'shared_ratio': round(shared_bytes / max(file.blob.size, other.size, 1), 4),
+            } for other_file in other_files)
 
-        if not dedup_job:
-            return Response({'message': 'No valid deduplication job found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'file': index.file_entry(file), 'results': results})
 
-        serializer = self.get_serializer(dedup_job)
-        return Response(serializer.data)
\ No newline at end of file
+    def duplicate_groups(self, request):
+        queryset = DuplicateGroup.objects.filter(file_count__gt=1)
+        file_type = request.query_params.get('fileType', '')
+        if file_type and file_type != 'all':
+            queryset = filter_by_category(queryset, file_type)
+        return queryset
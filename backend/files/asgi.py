@@ -0,0 +1,89 @@
+"""
+Serving the API over ASGI without tying up a thread per transfer.
+
+Django's ASGI handler already receives request bodies and sends responses
+on the event loop, but writes each body chunk to disk on the loop and loads
+a synchronous streaming response (a download) into memory before sending
+it. This handler does the blocking file work on a bounded thread pool
+instead, so a slow client costs a coroutine rather than a worker; views run
+only once the whole body is on disk, and downloads go out one block at a
+time as the client reads them.
+"""
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import RequestAborted
+from django.core.handlers.asgi import ASGIHandler
+from django.http import FileResponse
+
+# Request bodies are written to disk in blocks of at least this many bytes
+WRITE_SIZE = 256 * 1024
+
+executor = ThreadPoolExecutor(max_workers=settings.ASGI_IO_WORKERS, thread_name_prefix='asgi-io')
+
+
+async def run_io(func, *args):
+    """Run blocking file I/O on the bounded executor"""
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def read_blocks(iterator):
+    """Async iterator over a synchronous one that reads files, advanced on the executor"""
+    while True:
+        block = await run_io(next, iterator, None)
+        if block is None:
+            return
+        yield block
+
+
+def reads_files(response):
+    """
+    Whether a streaming response only reads from storage. Others (e.g.
+    generators querying the database) are left to Django, which consumes
+    them on the request's own thread.
+    """
+    return isinstance(response, FileResponse) or getattr(response, 'reads_files', False)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    view_slots = None
+
+    async def get_response_async(self, request):
+        """
+        Run the view once a slot is free. Transfers hold no slot, but every
+        running (synchronous) view holds a thread and a database connection.
+        """
+        if self.view_slots is None:
+            self.view_slots = asyncio.Semaphore(settings.ASGI_MAX_CONCURRENT_VIEWS)
+        async with self.view_slots:
+            return await super().get_response_async(request)
+
+    async def read_body(self, receive):
+        """Receive the request body, spooling it to disk through the executor"""
+        body_file = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE, mode='w+b')
+        pending = bytearray()
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    # Early client disconnect
+                    raise RequestAborted()
+                pending += message.get('body', b'')
+                more_body = message.get('more_body', False)
+                if len(pending) >= WRITE_SIZE or (pending and not more_body):
+                    await run_io(body_file.write, pending)
+                    pending.clear()
+                if not more_body:
+                    break
+        except BaseException:
+            body_file.close()
+            raise
+        body_file.seek(0)
+        return body_file
+
+    async def send_response(self, response, send):
+        if response.streaming and not response.is_async and reads_files(response):
+            response.streaming_content = read_blocks(iter(response.streaming_content))
+        await super().send_response(response, send)
@@ -0,0 +1,77 @@
+"""
+Backfill of missing file hashes.
+
+Rows written before hashing existed, or imported outside the ORM, have a
+NULL file_hash and are invisible to deduplication until they are hashed.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from dedup import index
+from . import caching
+from .hashing import hash_path_mmap
+from .models import File
+
+
+def _hash_file(file):
+    try:
+        return hash_path_mmap(default_storage.path(file.file.name))
+    except (OSError, ValueError):
+        return None
+
+
+def backfill_file_hashes(batch_size=500, workers=8, after=None, progress=None):
+    """
+    Hash every File whose file_hash is NULL.
+
+    Rows are read in keyset batches ordered by id and hashed by a thread pool
+    over memory-mapped reads; each batch is written with one bulk_update and
+    counted into the duplicate index in the same transaction. Hashed rows
+    drop out of the query, so an interrupted run resumes where it stopped;
+    ``after`` skips past rows whose files could not be read last time.
+
+    ``progress`` is called after every batch with a dict of running totals.
+    """
+    totals = {
+        'remaining': File.objects.filter(file_hash__isnull=True).count(),
+        'hashed': 0,
+        'failed': 0,
+        'last_id': after,
+    }
+    pending = File.objects.filter(file_hash__isnull=True).order_by('id')
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = pending
+            if totals['last_id']:
+                batch = batch.filter(id__gt=totals['last_id'])
+            batch = list(batch.only('id', 'file', 'size', 'file_type')[:batch_size])
+            if not batch:
+                break
+
+            hashed = []
+            for file, digest in zip(batch, pool.map(_hash_file, batch)):
+                if digest is None:
+                    totals['failed'] += 1
+                    continue
+                file.file_hash = digest
+                hashed.append(file)
+
+            with transaction.atomic():
+                File.objects.bulk_update(hashed, ['file_hash'])
+                groups = Counter((f.file_hash, f.size, f.file_type) for f in hashed)
+                for (file_hash, size, file_type), count in groups.items():
+                    index.file_added(file_hash, size, file_type, count)
+                if hashed:
+                    caching.bump_version()
+
+            totals['hashed'] += len(hashed)
+            totals['remaining'] -= len(batch)
+            totals['last_id'] = str(batch[-1].id)
+            if progress:
+                progress(dict(totals))
+
+    return totals
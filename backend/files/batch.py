@@ -0,0 +1,62 @@
+"""
+Batch uploads: store many files with one transaction and a fixed number of
+queries, however many files the request carries.
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from dedup import index
+from . import caching, hashing, stats
+from .models import Blob, File, blob_writes
+
+
+def upload_digest(upload):
+    """SHA-256 of an uploaded file, reusing the digest taken while it was received"""
+    if getattr(upload, 'sha256', None):
+        return upload.sha256
+    if hasattr(upload, 'temporary_file_path'):
+        return hashing.hash_path_mmap(upload.temporary_file_path())
+    upload.seek(0)
+    digest = hashlib.sha256(upload.read()).hexdigest()
+    upload.seek(0)
+    return digest
+
+
+def create_files(uploads):
+    """
+    Store ``uploads`` as new files, returned in the order given.
+
+    Uploads without a digest are hashed on a thread pool (hashlib releases
+    the GIL), blobs are created or referenced in bulk, and the File rows,
+    duplicate index and statistics are written in one transaction.
+    """
+    with ThreadPoolExecutor(max_workers=settings.FILE_BATCH_HASH_WORKERS) as pool:
+        digests = list(pool.map(upload_digest, uploads))
+
+    # One blob per distinct content, referenced once per file
+    contents = {}
+    for upload, digest in zip(uploads, digests):
+        size, content, refs = contents.get(digest, (upload.size, upload, 0))
+        contents[digest] = (size, content, refs + 1)
+
+    with blob_writes():
+        blobs = Blob.objects.acquire_many(contents)
+        files = [
+            File(
+                blob=blobs[digest],
+                file=blobs[digest].file.name,
+                file_hash=digest,
+                original_filename=upload.name,
+                file_type=upload.content_type,
+                size=upload.size,
+            )
+            for upload, digest in zip(uploads, digests)
+        ]
+        # bulk_create skips File.save and its signals; the index and statistics are updated in bulk instead
+        File.objects.bulk_create(files)
+        index.files_added(files)
+        stats.files_added(files)
+        caching.bump_version()
+    return files
@@ -0,0 +1,169 @@
+"""
+Versioned response cache for the polled read endpoints.
+
+Every cache key embeds the vault version, a counter bumped (after commit)
+whenever files change. Invalidation is a single INCR: entries written under
+an older version are simply never read again and age out through their TTL
+or the server's LRU eviction. The version starts at a random value, so if
+the key itself is ever lost, old entries cannot be mistaken for current ones.
+
+With read replicas configured, misses are served from a replica unless the
+version was bumped within the last DATABASE_REPLICA_MAX_LAG seconds, when the
+replica may not have the write yet.
+"""
+import functools
+import hashlib
+import logging
+import random
+import time
+
+import redis
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.db import replica_reads
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'vault:version'
+HITS_KEY = 'vault:cache:hits'
+MISSES_KEY = 'vault:cache:misses'
+RECENT_BUMP_KEY = 'vault:version:recent'
+RETRY_AFTER = 30  # Seconds to bypass the cache after Redis fails
+
+_unavailable_until = 0.0
+_missed_bump = False
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _available():
+    return time.monotonic() >= _unavailable_until
+
+
+def _failed(message):
+    global _unavailable_until
+    logger.warning(message, exc_info=True)
+    _unavailable_until = time.monotonic() + RETRY_AFTER
+
+
+def version():
+    global _missed_bump
+    cache = get_cache()
+    if _missed_bump:
+        # A bump was lost while Redis was unreachable; start over so nothing older is served
+        _mark_recent_bump(cache)
+        cache.set(VERSION_KEY, random.getrandbits(48), timeout=None)
+        _missed_bump = False
+    # No timeout: LRU eviction only considers keys that expire
+    return cache.get_or_set(VERSION_KEY, random.getrandbits(48), timeout=None)
+
+
+def _mark_recent_bump(cache):
+    # Set before the version changes, so a reader that sees the new version sees this too
+    cache.set(RECENT_BUMP_KEY, 1, timeout=settings.DATABASE_REPLICA_MAX_LAG)
+
+
+def _bump():
+    global _missed_bump
+    if not _available():
+        _missed_bump = True
+        return
+    cache = get_cache()
+    try:
+        _mark_recent_bump(cache)
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Not set yet (or lost); any fresh random start invalidates every entry
+        cache.set(VERSION_KEY, random.getrandbits(48), timeout=None)
+    except redis.RedisError:
+        _missed_bump = True
+        _failed('Could not bump the vault version')
+
+
+def bump_version():
+    """Invalidate every cached response once the current transaction commits"""
+    transaction.on_commit(_bump)
+
+
+def counters():
+    values = {}
+    if _available():
+        try:
+            values = get_cache().get_many([HITS_KEY, MISSES_KEY])
+        except redis.RedisError:
+            _failed('Could not read the response cache counters')
+    hits, misses = values.get(HITS_KEY, 0), values.get(MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+    }
+
+
+def _count(key):
+    cache = get_cache()
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key)
+    except redis.RedisError:
+        _failed('Could not count a response cache lookup')
+
+
+def cached_response(view):
+    """
+    Cache a read-only view's successful responses, keyed by the vault
+    version and the full request URL. Runs the view uncached for a while
+    whenever Redis is unreachable.
+
+    Misses may be served by a replica once the last write has had time to
+    replicate; a lagging replica could otherwise return rows from before the
+    write that bumped the version, and they would be cached under it. Their
+    responses are stored only if the version is still the one they were read
+    under.
+    """
+    @functools.wraps(view)
+    def wrapper(viewset, request, *args, **kwargs):
+        if not _available():
+            with replica_reads():
+                return view(viewset, request, *args, **kwargs)
+
+        cache = get_cache()
+        url = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()
+        try:
+            current = version()
+            key = f'vault:response:{current}:{url}'
+            found = cache.get_many([key, RECENT_BUMP_KEY])
+        except redis.RedisError:
+            _failed('Response cache unavailable')
+            with replica_reads():
+                return view(viewset, request, *args, **kwargs)
+
+        if key in found:
+            _count(HITS_KEY)
+            return Response(found[key])
+
+        _count(MISSES_KEY)
+        from_replica = bool(settings.DATABASE_REPLICAS) and RECENT_BUMP_KEY not in found
+        if from_replica:
+            with replica_reads():
+                response = view(viewset, request, *args, **kwargs)
+        else:
+            response = view(viewset, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            try:
+                if not from_replica or version() == current:
+                    cache.set(key, response.data, timeout=settings.RESPONSE_CACHE_TTL)
+            except redis.RedisError:
+                _failed('Could not store a cached response')
+        return response
+
+    return wrapper
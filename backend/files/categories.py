@@ -0,0 +1,54 @@
+# Map frontend filter categories to MIME types
+FILE_TYPE_MAPPING = {
+    'images': [
+        'image/jpeg', 'image/jpg', 'image/png', 'image/gif', 
+        'image/bmp', 'image/svg+xml', 'image/webp', 'image/tiff'
+    ],
+    'documents': [
+        'application/pdf', 'application/msword', 
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        'text/plain', 'application/rtf', 'application/vnd.oasis.opendocument.text',
+        'application/vnd.ms-excel', 
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'application/vnd.ms-powerpoint', 
+        'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+        'text/csv', 'application/vnd.oasis.opendocument.spreadsheet',
+        'application/vnd.oasis.opendocument.presentation'
+    ],
+    'videos': [
+        'video/mp4', 'video/avi', 'video/quicktime', 'video/x-msvideo',
+        'video/x-flv', 'video/webm', 'video/x-matroska', 'video/mpeg',
+        'video/3gpp', 'video/x-ms-wmv'
+    ],
+    'audio': [
+        'audio/mpeg', 'audio/wav', 'audio/flac', 'audio/aac',
+        'audio/ogg', 'audio/x-ms-wma', 'audio/mp3', 'audio/x-wav',
+        'audio/vorbis', 'audio/mp4'
+    ],
+    'archives': [
+        'application/zip', 'application/x-rar-compressed', 
+        'application/x-7z-compressed', 'application/x-tar',
+        'application/gzip', 'application/x-bzip2', 'application/x-compress',
+        'application/x-compressed', 'application/x-zip-compressed'
+    ]
+}
+
+ALL_KNOWN_TYPES = [file_type for types in FILE_TYPE_MAPPING.values() for file_type in types]
+
+CATEGORY_BY_TYPE = {file_type: category for category, types in FILE_TYPE_MAPPING.items() for file_type in types}
+CATEGORIES = [*FILE_TYPE_MAPPING, 'other']
+
+
+def category_of(file_type):
+    """The frontend category a MIME type falls under"""
+    return CATEGORY_BY_TYPE.get(file_type, 'other')
+
+
+def filter_by_category(queryset, category, field='file_type'):
+    """Restrict ``queryset`` to a frontend file category, matching MIME types in ``field``"""
+    if category in FILE_TYPE_MAPPING:
+        return queryset.filter(**{f'{field}__in': FILE_TYPE_MAPPING[category]})
+    if category == 'other':
+        # Filter out known file types
+        return queryset.exclude(**{f'{field}__in': ALL_KNOWN_TYPES})
+    return queryset
@@ -0,0 +1,94 @@
+"""
+Content-defined chunking (FastCDC) for block-level deduplication.
+
+Chunk boundaries are picked from a rolling gear hash of the content itself,
+so inserting or removing a few bytes only changes the chunks around the
+edit and every other chunk still matches the previous version of the file.
+The hashing runs in the fastcdc package's compiled implementation.
+"""
+import io
+from bisect import bisect_right
+
+try:
+    from fastcdc.fastcdc_cy import fastcdc_cy as fastcdc
+except ImportError:
+    # Same boundaries, found by a much slower pure Python loop
+    from fastcdc.fastcdc_py import fastcdc_py as fastcdc
+
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+READ_SIZE = 4 * 1024 * 1024
+
+
+def iter_chunks(stream, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """Yield the content-defined chunks of a binary stream as bytes"""
+    buffer = b""
+    eof = False
+    while not eof:
+        block = stream.read(max(READ_SIZE, max_size))
+        eof = not block
+        buffer += block
+        consumed = 0
+        for chunk in fastcdc(buffer, min_size, avg_size, max_size):
+            # Until the stream ends, a boundary within max_size of the end may move once more is read
+            if not eof and len(buffer) - chunk.offset < max_size:
+                break
+            consumed = chunk.offset + chunk.length
+            yield buffer[chunk.offset:consumed]
+        buffer = buffer[consumed:]
+
+
+class ChunkedReader(io.RawIOBase):
+    """Read-only, seekable view of content stored as a sequence of chunk files"""
+
+    def __init__(self, parts):
+        # parts: (offset, size, path) for each chunk, in content order
+        self.parts = parts
+        self.offsets = [offset for offset, _, _ in parts]
+        self.size = sum(size for _, size, _ in parts)
+        self.pos = 0
+        self._open_index = None
+        self._open_file = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def readinto(self, buffer):
+        if self.pos >= self.size:
+            return 0
+        index = bisect_right(self.offsets, self.pos) - 1
+        offset, size, path = self.parts[index]
+        if self._open_index != index:
+            self._close_part()
+            self._open_file = open(path, 'rb')
+            self._open_index = index
+        self._open_file.seek(self.pos - offset)
+        view = memoryview(buffer)[:offset + size - self.pos]
+        read = self._open_file.readinto(view)
+        self.pos += read
+        return read
+
+    def close(self):
+        self._close_part()
+        super().close()
+
+    def _close_part(self):
+        if self._open_file:
+            self._open_file.close()
+        self._open_file = self._open_index = None
@@ -0,0 +1,141 @@
+"""
+Compressed storage tier for cold content.
+
+Blobs whose files nobody has read for COLD_STORAGE_AFTER seconds, and whose
+type compresses well, are rewritten through COLD_STORAGE_CODEC. Reads
+decompress as a stream, so callers of ``Blob.open`` never see the codec.
+"""
+import gzip
+import io
+import lzma
+import shutil
+import tempfile
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+from django.db.models import Q
+
+try:
+    import zstandard
+except ImportError:  # Optional; gzip and xz need nothing beyond the stdlib
+    zstandard = None
+
+CODEC_CHOICES = [
+    ('gzip', 'gzip'),
+    ('xz', 'xz'),
+    ('zstd', 'Zstandard'),
+]
+EXTENSIONS = {'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+
+# Raised while reading truncated or corrupt compressed data
+DECODE_ERRORS = (OSError, EOFError, lzma.LZMAError, zlib.error) + (
+    (zstandard.ZstdError,) if zstandard else ()
+)
+
+COMPRESSIBLE_TYPES = [
+    'application/json', 'application/xml', 'application/javascript',
+    'application/x-ndjson', 'application/sql', 'application/x-yaml',
+    'application/yaml', 'application/rtf', 'application/x-tar',
+    'image/svg+xml', 'image/bmp',
+]
+
+# Content is only kept compressed if it shrinks by at least this fraction
+MIN_SAVINGS = 0.2
+SAMPLE_SIZE = 1024 * 1024
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+def compressible_types(field='file_type'):
+    """Q matching MIME types in ``field`` that are worth compressing"""
+    return (
+        Q(**{f'{field}__startswith': 'text/'})
+        | Q(**{f'{field}__endswith': '+json'})
+        | Q(**{f'{field}__endswith': '+xml'})
+        | Q(**{f'{field}__in': COMPRESSIBLE_TYPES})
+    )
+
+
+def check_codec(codec):
+    if codec not in EXTENSIONS:
+        raise ImproperlyConfigured(f"Unknown cold storage codec {codec!r}")
+    if codec == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured("The zstd codec needs the zstandard package installed")
+
+
+def compress_stream(source, target, codec):
+    """Write ``source`` compressed with ``codec`` to ``target``, leaving both open"""
+    if codec == 'zstd':
+        zstandard.ZstdCompressor(level=10).copy_stream(source, target)
+        return
+    if codec == 'gzip':
+        writer = gzip.GzipFile(fileobj=target, mode='wb', compresslevel=6, mtime=0)
+    else:
+        writer = lzma.LZMAFile(target, 'wb', preset=6)
+    with writer:
+        shutil.copyfileobj(source, writer, COPY_BLOCK_SIZE)
+
+
+def worth_compressing(sample, codec):
+    """Whether a leading sample of the content compresses enough to bother"""
+    compressed = io.BytesIO()
+    compress_stream(io.BytesIO(sample), compressed, codec)
+    return compressed.tell() <= len(sample) * (1 - MIN_SAVINGS)
+
+
+def compress_to_storage(source, storage, name, codec):
+    """
+    Compress ``source`` into ``storage`` next to ``name``.
+
+    Returns ``(stored_name, stored_size)``, or None when the result would not
+    save at least MIN_SAVINGS of the original size.
+    """
+    size = source.seek(0, io.SEEK_END)
+    source.seek(0)
+    with tempfile.TemporaryFile() as compressed:
+        compress_stream(source, compressed, codec)
+        stored_size = compressed.tell()
+        if stored_size > size * (1 - MIN_SAVINGS):
+            return None
+        compressed.seek(0)
+        return storage.save(name + EXTENSIONS[codec], DjangoFile(compressed)), stored_size
+
+
+class _DecodedReader(io.RawIOBase):
+    """
+    Forward-only view of a decompressing stream.
+
+    Decompressors can seek, but only by decoding everything before the
+    target, so this hides ``seek`` from callers such as FileResponse that
+    would otherwise seek to the end to measure the content.
+    """
+
+    def __init__(self, stream, source):
+        self._stream = stream
+        self._source = source
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+            self._source.close()
+        super().close()
+
+
+def open_decoded(source, codec):
+    """Wrap a binary file of ``codec``-compressed bytes as a stream of the original content"""
+    if codec == 'zstd':
+        check_codec(codec)
+        stream = zstandard.ZstdDecompressor().stream_reader(source, closefd=False)
+    elif codec == 'gzip':
+        stream = gzip.GzipFile(fileobj=source, mode='rb')
+    else:
+        stream = lzma.LZMAFile(source, 'rb')
+    return io.BufferedReader(_DecodedReader(stream, source), buffer_size=COPY_BLOCK_SIZE)
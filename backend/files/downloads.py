@@ -0,0 +1,213 @@
+"""
+Serving file content over HTTP: conditional requests, byte ranges and
+handing the body off to the front proxy or the kernel.
+
+Content addressed by file_hash never changes, so the hash is a strong ETag
+and responses can be cached for as long as clients like.
+"""
+import re
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+# Requests for more ranges than this get the whole file instead
+MAX_RANGES = 16
+BLOCK_SIZE = 256 * 1024
+
+_RANGE_SPEC = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_range(header, size):
+    """
+    Parse a Range header into sorted, coalesced ``(start, end)`` offsets,
+    with ``end`` exclusive.
+
+    Returns None when the header should be ignored (absent, malformed, not
+    in bytes, or asking for too many ranges) and an empty list when none of
+    the ranges can be satisfied.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    specs = specs.split(',')
+    if unit.strip().lower() != 'bytes' or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        match = _RANGE_SPEC.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = int(last) + 1 if last else size
+        else:
+            # Suffix range: the final ``last`` bytes
+            start, end = max(size - int(last), 0), size if int(last) else 0
+        end = min(end, size)
+        if start < end:
+            ranges.append((start, end))
+
+    coalesced = []
+    for start, end in sorted(ranges):
+        if coalesced and start <= coalesced[-1][1]:
+            coalesced[-1] = (coalesced[-1][0], max(end, coalesced[-1][1]))
+        else:
+            coalesced.append((start, end))
+    return coalesced
+
+
+class RangeReader:
+    """
+    At most ``length`` bytes of ``stream`` from its current position.
+
+    ``fileno`` is passed through so a server using ``wsgi.file_wrapper``
+    (gunicorn) can send a plain file with ``os.sendfile``; it sends exactly
+    Content-Length bytes from the descriptor's current offset.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def close(self):
+        self.stream.close()
+
+
+def _advance(stream, position, target):
+    """Move ``stream`` forward from ``position`` to ``target``, reading if it cannot seek"""
+    if stream.seekable():
+        stream.seek(target)
+        return
+    while position < target:
+        data = stream.read(min(BLOCK_SIZE, target - position))
+        if not data:
+            raise EOFError("Content ended before the requested range")
+        position += len(data)
+
+
+def _plain_name(file):
+    """Storage name of the file's content if it is stored unmodified in one file"""
+    if file.blob_id:
+        return file.blob.file.name if file.blob.is_plain else None
+    return file.file.name
+
+
+def _if_range_matches(value, etag, last_modified):
+    if value.startswith('"'):
+        return etag is not None and value == etag
+    if value.startswith('W/'):
+        return False  # Ranges need a strong validator
+    return parse_http_date_safe(value) == last_modified
+
+
+def serve(request, file, as_attachment=True):
+    """Return a response serving ``file``'s content for a GET or HEAD request"""
+    size = file.size
+    etag = quote_etag(file.file_hash) if file.file_hash else None
+    last_modified = int(file.uploaded_at.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        # 304 Not Modified or 412 Precondition Failed
+        return _add_headers(response, file, etag, last_modified, as_attachment)
+
+    ranges = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or _if_range_matches(if_range, etag, last_modified):
+        ranges = parse_range(request.headers.get('Range'), size)
+
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return _add_headers(response, file, etag, last_modified, as_attachment)
+
+    name = _plain_name(file)
+    if settings.FILE_DOWNLOAD_OFFLOAD and name:
+        # The proxy serves the bytes, ranges included, without holding a worker
+        response = _offload(file, name)
+    elif ranges and len(ranges) > 1:
+        response = _multipart(file, ranges, size)
+    else:
+        start, end = ranges[0] if ranges else (0, size)
+        content = file.open_content()
+        _advance(content, 0, start)
+        response = FileResponse(RangeReader(content, end - start),
+                                content_type=file.file_type or 'application/octet-stream')
+        response.block_size = BLOCK_SIZE
+        response['Content-Length'] = end - start
+        if ranges:
+            response.status_code = 206
+            response['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+
+    return _add_headers(response, file, etag, last_modified, as_attachment)
+
+
+def _offload(file, name):
+    response = HttpResponse(content_type=file.file_type or 'application/octet-stream')
+    if settings.FILE_DOWNLOAD_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.FILE_DOWNLOAD_ACCEL_PREFIX + quote(name)
+    else:
+        response['X-Sendfile'] = file.file.storage.path(name)
+    return response
+
+
+def _multipart(file, ranges, size):
+    boundary = uuid.uuid4().hex
+    content_type = file.file_type or 'application/octet-stream'
+    headers = [
+        (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+         f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n').encode()
+        for start, end in ranges
+    ]
+    closing = f'--{boundary}--\r\n'.encode()
+
+    def parts():
+        with file.open_content() as content:
+            position = 0
+            for header, (start, end) in zip(headers, ranges):
+                yield header
+                _advance(content, position, start)
+                reader = RangeReader(content, end - start)
+                yield from iter(lambda: reader.read(BLOCK_SIZE), b'')
+                position = end
+                yield b'\r\n'
+        yield closing
+
+    response = StreamingHttpResponse(
+        parts(), status=206, content_type=f'multipart/byteranges; boundary={boundary}'
+    )
+    # Only reads storage, so an ASGI server may advance it off the event loop (see files.asgi)
+    response.reads_files = True
+    response['Content-Length'] = (
+        sum(len(header) + end - start + 2 for header, (start, end) in zip(headers, ranges)) + len(closing)
+    )
+    return response
+
+
+def _add_headers(response, file, etag, last_modified, as_attachment):
+    if etag:
+        response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    if response.status_code in (200, 206):
+        response['Content-Disposition'] = content_disposition_header(as_attachment, file.original_filename)
+    patch_cache_control(response, private=True, max_age=settings.FILE_DOWNLOAD_MAX_AGE, immutable=True)
+    return response
@@ -0,0 +1,130 @@
+"""
+Hashing helpers for work over files already in storage.
+
+Functions prefixed ``pool_`` run inside worker processes: they take plain
+paths, never touch the database, and share the I/O budget configured by
+``init_pool_worker``.
+"""
+import hashlib
+import mmap
+import os
+import threading
+import time
+
+from . import coldstorage
+
+READ_BLOCK_SIZE = 1024 * 1024
+PARTIAL_SAMPLE_SIZE = 64 * 1024
+
+
+class RateLimiter:
+    """
+    Token bucket capping throughput at ``bytes_per_second`` (0 disables it).
+
+    The units are whatever callers consume, e.g. unlinks for the purge task.
+    """
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self.allowance = bytes_per_second
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= nbytes
+            delay = -self.allowance / self.rate if self.allowance < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def hash_path(path, limiter=None):
+    """SHA-256 of the whole file at ``path``"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+            if limiter:
+                limiter.consume(len(block))
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def hash_path_mmap(path):
+    """
+    SHA-256 of the file at ``path`` read through a memory map.
+
+    Hashing a mapped buffer avoids copying through Python-level reads and
+    releases the GIL, so several threads can hash files in parallel.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+
+def partial_hash(path, limiter=None, sample_size=PARTIAL_SAMPLE_SIZE):
+    """
+    SHA-256 over the first and last ``sample_size`` bytes of a file.
+
+    Files that differ here cannot be identical, so only files whose partial
+    hashes collide need a full read.
+    """
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        head = f.read(sample_size)
+        hasher.update(head)
+        size = os.fstat(f.fileno()).st_size
+        if size > sample_size:
+            f.seek(max(size - sample_size, sample_size))
+            tail = f.read(sample_size)
+            hasher.update(tail)
+        else:
+            tail = b""
+    if limiter:
+        limiter.consume(len(head) + len(tail))
+    return hasher.hexdigest()
+
+
+_pool_limiter = None
+
+
+def init_pool_worker(bytes_per_second):
+    global _pool_limiter
+    _pool_limiter = RateLimiter(bytes_per_second)
+
+
+def pool_hash_path(path):
+    """Return ``(path, digest)``, with a None digest if the file is unreadable"""
+    try:
+        return path, hash_path(path, _pool_limiter)
+    except OSError:
+        return path, None
+
+
+def pool_hash_decoded(args):
+    """Like ``pool_hash_path`` for a compressed file, hashing the decoded content"""
+    path, codec = args
+    hasher = hashlib.sha256()
+    try:
+        with coldstorage.open_decoded(open(path, 'rb'), codec) as f:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+                if _pool_limiter:
+                    _pool_limiter.consume(len(block))
+                hasher.update(block)
+    except coldstorage.DECODE_ERRORS:
+        # Missing, truncated or corrupt compressed data
+        return path, None
+    return path, hasher.hexdigest()
+
+
+def pool_partial_hash(path):
+    try:
+        return path, partial_hash(path, _pool_limiter)
+    except OSError:
+        return path, None
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from files.backfill import backfill_file_hashes
+
+
+class Command(BaseCommand):
+    help = "Hash every file whose file_hash is NULL so it takes part in deduplication."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Threads hashing files in parallel.")
+        parser.add_argument('--after', default=None,
+                            help="Resume after this file id, skipping rows that failed before.")
+
+    def handle(self, *args, **options):
+        totals = backfill_file_hashes(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            after=options['after'],
+            progress=self.report,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Hashed {totals['hashed']} files, {totals['failed']} unreadable"
+        ))
+
+    def report(self, totals):
+        self.stdout.write(
+            f"hashed {totals['hashed']}, failed {totals['failed']}, "
+            f"{totals['remaining']} remaining (last id {totals['last_id']})"
+        )
@@ -0,0 +1,304 @@
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import time
+import tracemalloc
+import uuid
+
+import django
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from dedup import index
+from dedup.tasks import run_dedup_job
+from files import hashing, stats
+from files.categories import FILE_TYPE_MAPPING
+from files.models import File, calculate_file_hash
+
+WORDS = [
+    'report', 'invoice', 'photo', 'holiday', 'backup', 'draft', 'final', 'scan',
+    'notes', 'budget', 'contract', 'slides', 'recording', 'archive', 'export', 'summary',
+]
+FILE_TYPES = [file_type for types in FILE_TYPE_MAPPING.values() for file_type in types[:3]] + [
+    'application/octet-stream', 'application/json', 'text/html',
+]
+
+# List requests timed against every vault, by name
+LIST_SCENARIOS = {
+    'default': {},
+    'sort=name': {'sortBy': 'name'},
+    'sort=size': {'sortBy': 'size'},
+    'sort=type': {'sortBy': 'type'},
+    'type=images': {'fileType': 'images'},
+    'type=documents': {'fileType': 'documents'},
+    'type=other': {'fileType': 'other'},
+    'search=report': {'search': 'report'},
+    'search=rep,sort=relevance': {'search': 'rep', 'sortBy': 'relevance'},
+    'search=report,type=documents': {'search': 'report', 'fileType': 'documents'},
+}
+
+# Metrics compared against a baseline, and whether a higher value is better
+COMPARED_METRICS = {'p50_ms': False, 'seconds': False, 'queries': False, 'mib_per_s': True}
+
+
+def latency(durations):
+    """Summarize request durations in seconds as milliseconds"""
+    durations = sorted(durations)
+    return {
+        'runs': len(durations),
+        'mean_ms': round(statistics.fmean(durations) * 1000, 3),
+        'p50_ms': round(statistics.median(durations) * 1000, 3),
+        'p95_ms': round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000, 3),
+        'max_ms': round(durations[-1] * 1000, 3),
+    }
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f'{prefix}{key}.')
+        else:
+            yield f'{prefix}{key}', value
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark hashing, uploads, dedup runs and file listing against synthetic "
+        "vaults, writing the results as JSON. Run with "
+        "DJANGO_SETTINGS_MODULE=core.settings_benchmark."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000],
+                            help="Vault sizes to benchmark, e.g. 10000 100000 1000000.")
+        parser.add_argument('--duplicate-ratio', type=float, default=0.3,
+                            help="Fraction of files that copy an earlier file's content.")
+        parser.add_argument('--max-file-size', type=int, default=1 << 30,
+                            help="Largest size recorded for a synthetic file row, in bytes.")
+        parser.add_argument('--upload-size', type=int, default=64 * 1024,
+                            help="Bytes per file uploaded when timing uploads.")
+        parser.add_argument('--uploads', type=int, default=50)
+        parser.add_argument('--hash-size', type=int, default=64 * 1024 * 1024,
+                            help="Bytes of content hashed when timing hashing.")
+        parser.add_argument('--repeat', type=int, default=20, help="Requests per list scenario.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--trace-memory', action='store_true',
+                            help="Report peak Python allocations of dedup runs (slows them down).")
+        parser.add_argument('--output', help="Write the JSON results here instead of to stdout.")
+        parser.add_argument('--compare', help="Baseline JSON results to check for regressions.")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Relative slowdown over the baseline reported as a regression.")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'BENCHMARK_ROOT', None):
+            raise CommandError(
+                "The benchmark writes millions of rows; run it with "
+                "DJANGO_SETTINGS_MODULE=core.settings_benchmark."
+            )
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.contents = []
+        # Progress goes to stderr, leaving stdout to the JSON results
+        self.stderr.style_func = None
+        try:
+            call_command('migrate', verbosity=0)
+            results = {
+                'meta': self.meta(),
+                'hashing': self.bench_hashing(options['hash_size']),
+                'vaults': {str(rows): self.bench_vault(rows) for rows in sorted(options['rows'])},
+            }
+        finally:
+            connections.close_all()
+            shutil.rmtree(settings.BENCHMARK_ROOT, ignore_errors=True)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self.compare(results, options['compare'], options['tolerance'])
+
+    def log(self, message):
+        self.stderr.write(message)
+
+    def meta(self):
+        return {
+            'started_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'options': {
+                key: self.options[key] for key in (
+                    'rows', 'duplicate_ratio', 'max_file_size', 'upload_size', 'uploads',
+                    'hash_size', 'repeat', 'seed',
+                )
+            },
+        }
+
+    def bench_hashing(self, size, repeat=3):
+        """Hashing throughput over a file already in the page cache, so it measures the hashing"""
+        path = os.path.join(settings.BENCHMARK_ROOT, 'hash.bin')
+        with open(path, 'wb') as f:
+            for offset in range(0, size, hashing.READ_BLOCK_SIZE):
+                f.write(self.rng.randbytes(min(hashing.READ_BLOCK_SIZE, size - offset)))
+
+        def read_whole(path):
+            with open(path, 'rb') as f:
+                return calculate_file_hash(f)
+
+        results = {'bytes': size}
+        for label, func in [
+            ('calculate_file_hash', read_whole),
+            ('hash_path', hashing.hash_path),
+            ('hash_path_mmap', hashing.hash_path_mmap),
+        ]:
+            durations = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                func(path)
+                durations.append(time.perf_counter() - started)
+            seconds = statistics.median(durations)
+            results[label] = {'seconds': round(seconds, 4), 'mib_per_s': round(size / seconds / 2**20, 1)}
+            self.log(f"hash {label}: {results[label]['mib_per_s']} MiB/s")
+        os.remove(path)
+        return results
+
+    def bench_vault(self, rows):
+        started = time.perf_counter()
+        self.seed(rows)
+        # Rows were bulk inserted behind the ORM's back; bring the index and counters up to date
+        index.rebuild()
+        stats.rebuild()
+        results = {
+            'rows': File.objects.count(),
+            'seeding_s': round(time.perf_counter() - started, 2),
+        }
+        self.log(f"vault of {results['rows']} rows seeded in {results['seeding_s']}s")
+
+        results['dedup'] = {
+            'run': self.measure('dedup run', run_dedup_job, trace_memory=self.options['trace_memory']),
+            'summary': self.measure('dedup summary', index.summary),
+        }
+        # Listing before uploading, so every vault size lists the seeded rows only
+        results['list'] = {
+            name: self.bench_list(name, params) for name, params in LIST_SCENARIOS.items()
+        }
+        results['create'] = self.bench_create()
+        return results
+
+    def seed(self, rows, batch_size=5000):
+        """Bulk insert synthetic file rows until the vault holds ``rows`` files"""
+        rng = self.rng
+        batch = []
+        for i in range(File.objects.count(), rows):
+            if self.contents and rng.random() < self.options['duplicate_ratio']:
+                file_hash, size, file_type = rng.choice(self.contents)
+            else:
+                file_hash = f'{rng.getrandbits(256):064x}'
+                size = rng.randint(1, self.options['max_file_size'])
+                file_type = rng.choice(FILE_TYPES)
+                self.contents.append((file_hash, size, file_type))
+            batch.append(File(
+                id=uuid.UUID(int=rng.getrandbits(128), version=4), file=f'uploads/{i}.bin',
+                original_filename=f'{rng.choice(WORDS)}-{rng.choice(WORDS)}-{i}.bin',
+                file_type=file_type, size=size, file_hash=file_hash,
+            ))
+            if len(batch) >= batch_size:
+                File.objects.bulk_create(batch)
+                batch = []
+        File.objects.bulk_create(batch)
+
+    def measure(self, label, func, trace_memory=False):
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        results = {'seconds': round(time.perf_counter() - started, 4), 'queries': len(queries)}
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results['peak_mib'] = round(peak / 2**20, 1)
+        self.log(f"{label}: {results['seconds']}s, {results['queries']} queries")
+        return results
+
+    def bench_list(self, name, params):
+        client = APIClient()
+        client.get('/api/files/', params)  # Warm up
+        durations = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(self.options['repeat']):
+                started = time.perf_counter()
+                response = client.get('/api/files/', params)
+                durations.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f"List {name} failed with {response.status_code}: {response.data}")
+        results = {**latency(durations), 'queries': len(queries) // self.options['repeat']}
+        self.log(f"list {name}: p50 {results['p50_ms']}ms, {results['queries']} queries")
+        return results
+
+    def bench_create(self):
+        """Upload latency through FileViewSet.create, sharing content at the configured duplicate ratio"""
+        client = APIClient()
+        uploaded = []
+        durations = []
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(self.options['uploads']):
+                if uploaded and self.rng.random() < self.options['duplicate_ratio']:
+                    content = self.rng.choice(uploaded)
+                else:
+                    content = self.rng.randbytes(self.options['upload_size'])
+                    uploaded.append(content)
+                upload = SimpleUploadedFile(f'upload-{i}.bin', content, 'application/octet-stream')
+                started = time.perf_counter()
+                response = client.post('/api/files/', {'file': upload}, format='multipart')
+                durations.append(time.perf_counter() - started)
+                if response.status_code != 201:
+                    raise CommandError(f"Upload failed with {response.status_code}: {response.data}")
+        results = {**latency(durations), 'queries': len(queries) // self.options['uploads']}
+        self.log(f"create: p50 {results['p50_ms']}ms, {results['queries']} queries")
+        return results
+
+    def compare(self, results, baseline_path, tolerance):
+        """Fail if any compared metric got worse than the baseline by more than ``tolerance``"""
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        options = {key: value for key, value in results['meta']['options'].items() if key != 'rows'}
+        if any(baseline['meta']['options'].get(key) != value for key, value in options.items()):
+            self.log("Warning: the baseline ran with different options; results may not be comparable")
+        baseline = dict(flatten(baseline))
+
+        regressions = []
+        for path, value in flatten(results):
+            metric = path.rsplit('.', 1)[-1]
+            if metric not in COMPARED_METRICS or path.startswith('meta.') or not baseline.get(path):
+                continue
+            before = baseline[path]
+            if metric == 'queries':
+                # Query counts are deterministic; any increase is a regression
+                worse = value > before
+            elif COMPARED_METRICS[metric]:
+                worse = value < before / (1 + tolerance)
+            else:
+                worse = value > before * (1 + tolerance)
+            if worse:
+                regressions.append(f"{path}: {before} -> {value}")
+
+        if regressions:
+            raise CommandError("Regressions against {}:\n  {}".format(baseline_path, '\n  '.join(regressions)))
+        self.log(f"No regressions against {baseline_path}")
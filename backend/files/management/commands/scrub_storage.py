@@ -0,0 +1,223 @@
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import F
+
+from dedup import index
+from files import caching, hashing, stats
+from files.models import Blob, Chunk, File
+
+# Directories under MEDIA_ROOT that hold vault content
+CONTENT_DIRS = ['blobs', 'chunks', 'uploads']
+
+# Files this recent may belong to an upload whose row is not committed yet
+ORPHAN_GRACE_PERIOD = 60 * 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Check stored media against the database: report missing and orphaned "
+        "files and content that no longer matches its recorded hash, and "
+        "optionally repair file_hash. Files are fingerprinted in stages "
+        "(size, then head/tail hash, then full hash) so files with a unique "
+        "size are never fully read."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Hashing processes to run.")
+        parser.add_argument('--io-budget', type=float, default=0,
+                            help="Read throughput cap in MB/s shared by all workers (0 = unlimited).")
+        parser.add_argument('--full', action='store_true',
+                            help="Fully hash every file instead of using the staged cascade.")
+        parser.add_argument('--repair', action='store_true',
+                            help="Update file_hash and size in the database to match stored content.")
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help="Delete stored files that no database row references.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        objects = self.load_objects()
+        present = self.check_presence(objects)
+        orphans = self.find_orphans({obj['name'] for obj in objects}, options['delete_orphans'])
+
+        workers = max(options['workers'], 1)
+        bytes_per_second = options['io_budget'] * 1024 * 1024 / workers
+        # Worker processes must not inherit open database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=hashing.init_pool_worker,
+                                 initargs=(bytes_per_second,)) as pool:
+            to_hash = present if options['full'] else self.select_for_full_hash(present, pool)
+            digests = dict(pool.map(
+                hashing.pool_hash_path, [obj['path'] for obj in to_hash if not obj['codec']], chunksize=16
+            ))
+            digests.update(pool.map(
+                hashing.pool_hash_decoded, [(obj['path'], obj['codec']) for obj in to_hash if obj['codec']]
+            ))
+
+        mismatched = 0
+        repaired = 0
+        for obj in to_hash:
+            digest = digests.get(obj['path'])
+            if digest is None:
+                self.stdout.write(f"unreadable: {obj['name']}")
+                continue
+            if digest == obj['file_hash'] and obj['disk_size'] == obj['size']:
+                continue
+            mismatched += 1
+            self.stdout.write(
+                f"hash mismatch: {obj['name']} recorded {obj['file_hash']} ({obj['size']} bytes), "
+                f"stored {digest} ({obj['disk_size']} bytes)"
+            )
+            if options['repair'] and self.repair(obj, digest):
+                repaired += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Scrubbed {len(objects)} stored objects in {time.monotonic() - started:.1f}s: "
+            f"{len(objects) - len(present)} missing, {orphans} orphaned, "
+            f"{len(to_hash)} fully hashed, {mismatched} mismatched, {repaired} repaired"
+        ))
+
+    def load_objects(self):
+        """Every stored file the database expects, as plain dicts"""
+        # Compressed blobs are checked against their stored size and decoded to hash
+        objects = [
+            {'kind': 'blob', 'pk': pk, 'name': name, 'size': stored_size if codec else size,
+             'file_hash': file_hash, 'codec': codec}
+            for pk, name, size, stored_size, file_hash, codec in
+            Blob.objects.filter(chunked=False)
+            .values_list('pk', 'file', 'size', 'stored_size', 'file_hash', 'codec').iterator()
+        ]
+        # Chunked blobs have no whole file; their chunks are checked instead
+        objects += [
+            {'kind': 'chunk', 'pk': pk, 'name': name, 'size': size, 'file_hash': chunk_hash}
+            for pk, name, size, chunk_hash in
+            Chunk.objects.values_list('pk', 'file', 'size', 'chunk_hash').iterator()
+        ]
+        # Files uploaded before the blob store own their bytes
+        objects += [
+            {'kind': 'file', 'pk': pk, 'name': name, 'size': size, 'file_hash': file_hash}
+            for pk, name, size, file_hash in
+            File.objects.filter(blob__isnull=True).values_list('pk', 'file', 'size', 'file_hash').iterator()
+        ]
+        for obj in objects:
+            obj['path'] = default_storage.path(obj['name'])
+            obj.setdefault('codec', '')
+        return objects
+
+    def check_presence(self, objects):
+        """Stat every object, reporting missing ones; returns those on disk"""
+        present = []
+        for obj in objects:
+            try:
+                obj['disk_size'] = os.stat(obj['path']).st_size
+            except FileNotFoundError:
+                self.stdout.write(f"missing: {obj['name']}")
+                continue
+            present.append(obj)
+        return present
+
+    def find_orphans(self, referenced, delete):
+        orphans = 0
+        cutoff = time.time() - ORPHAN_GRACE_PERIOD
+        for content_dir in CONTENT_DIRS:
+            for root, _, filenames in os.walk(os.path.join(settings.MEDIA_ROOT, content_dir)):
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    name = os.path.relpath(path, settings.MEDIA_ROOT)
+                    if name in referenced or os.path.getmtime(path) > cutoff:
+                        continue
+                    orphans += 1
+                    self.stdout.write(f"orphaned: {name}")
+                    if delete:
+                        os.remove(path)
+        return orphans
+
+    def select_for_full_hash(self, present, pool):
+        """
+        Pick the objects whose full hash could change the duplicate picture.
+
+        Files whose size on disk is unique cannot duplicate anything, and files
+        whose head/tail hash is unique among same-size files cannot either, so
+        only partial-hash collisions, size mismatches, unhashed rows and rows
+        the database claims are identical but disagree on disk are read fully.
+        """
+        need_full = {id(obj): obj for obj in present
+                     if obj['file_hash'] is None or obj['disk_size'] != obj['size']}
+
+        by_size = defaultdict(list)
+        for obj in present:
+            # Compressed bytes say nothing about the content they decode to
+            if not obj['codec']:
+                by_size[obj['disk_size']].append(obj)
+        colliding = [obj for group in by_size.values() if len(group) > 1 for obj in group]
+        partials = dict(pool.map(hashing.pool_partial_hash, [obj['path'] for obj in colliding], chunksize=64))
+
+        def fingerprint(obj):
+            return obj['disk_size'], partials.get(obj['path'])
+
+        by_partial = defaultdict(list)
+        for obj in colliding:
+            by_partial[fingerprint(obj)].append(obj)
+        by_recorded = defaultdict(list)
+        for obj in present:
+            if obj['file_hash']:
+                by_recorded[(obj['file_hash'], obj['size'])].append(obj)
+
+        for group in by_partial.values():
+            if len(group) > 1:
+                need_full.update((id(obj), obj) for obj in group)
+        for group in by_recorded.values():
+            if len(group) > 1 and len({fingerprint(obj) for obj in group}) > 1:
+                need_full.update((id(obj), obj) for obj in group)
+        return list(need_full.values())
+
+    @transaction.atomic
+    def repair(self, obj, digest):
+        size = obj['disk_size']
+        caching.bump_version()
+        if obj['kind'] == 'file':
+            file = File.objects.select_for_update().get(pk=obj['pk'])
+            if file.file_hash:
+                index.file_removed(file.file_hash, file.size)
+            index.file_added(digest, size, file.file_type)
+            stats.file_removed(file.size, file.file_type)
+            stats.file_added(size, file.file_type)
+            File.objects.filter(pk=file.pk).update(file_hash=digest, size=size)
+            return True
+
+        if obj['kind'] == 'chunk':
+            # Every blob using the chunk is damaged; its content cannot be rebuilt here
+            self.stdout.write(self.style.WARNING(f"cannot repair corrupt chunk {obj['name']}"))
+            return False
+
+        if obj['codec']:
+            self.stdout.write(self.style.WARNING(f"cannot repair corrupt compressed blob {obj['name']}"))
+            return False
+
+        # Include files awaiting purge, so none is left pointing at a deleted blob
+        files = File.all_objects.select_for_update().filter(blob_id=obj['pk'])
+        for file in files.filter(deleted_at__isnull=True):
+            index.file_removed(file.file_hash, file.size)
+            index.file_added(digest, size, file.file_type)
+            stats.file_removed(file.size, file.file_type)
+            stats.file_added(size, file.file_type)
+
+        existing = Blob.objects.select_for_update().filter(file_hash=digest).exclude(pk=obj['pk']).first()
+        if existing is None:
+            files.update(file_hash=digest, size=size)
+            Blob.objects.filter(pk=obj['pk']).update(file_hash=digest, size=size)
+            return True
+
+        # The bytes now match content stored elsewhere; share that blob instead
+        moved = files.update(blob=existing, file=existing.file.name, file_hash=digest, size=size)
+        Blob.objects.filter(pk=existing.pk).update(ref_count=F('ref_count') + moved)
+        Blob.objects.filter(pk=obj['pk']).delete()
+        transaction.on_commit(lambda: default_storage.delete(obj['name']))
+        return True
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+import files.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0004_uploadsession_uploadchunk_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_hash', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(upload_to=files.models.chunk_upload_path)),
+                ('size', models.PositiveIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='chunked',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='blob',
+            name='file',
+            field=models.FileField(blank=True, upload_to=files.models.blob_upload_path),
+        ),
+        migrations.CreateModel(
+            name='BlobChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('offset', models.BigIntegerField()),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='manifest', to='files.blob')),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='blob_entries', to='files.chunk')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='blobchunk',
+            constraint=models.UniqueConstraint(fields=('blob', 'index'), name='unique_blob_chunk_index'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:03
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from files.search import ensure_index
+    ensure_index(schema_editor.connection, rebuild=True)
+
+
+def drop_search_index(apps, schema_editor):
+    from files.search import drop_index
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0006_blob_codec_blob_stored_size_file_last_accessed_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
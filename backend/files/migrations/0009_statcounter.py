@@ -0,0 +1,36 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+from files import stats
+
+
+def populate_counters(apps, schema_editor):
+    StatCounter = apps.get_model('files', 'StatCounter')
+    totals = stats.compute(apps.get_model('files', 'File'), apps.get_model('dedup', 'DuplicateGroup'))
+    StatCounter.objects.bulk_create(StatCounter(name=name, value=value) for name, value in totals.items())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dedup', '0007_blobsketch_similaritybucket_similarpair_and_more'),
+        ('files', '0008_file_files_file_origina_fff08f_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='statcounter',
+            constraint=models.UniqueConstraint(fields=('name', 'slot'), name='unique_stat_counter_slot'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
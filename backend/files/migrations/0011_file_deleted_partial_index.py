@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0010_file_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='files_file_deleted_idx'),
+        ),
+    ]
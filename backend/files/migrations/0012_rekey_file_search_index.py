@@ -0,0 +1,21 @@
+# Generated by Django 4.2.23 on 2026-10-18 14:10
+
+from django.db import migrations
+
+
+def rekey_search_index(apps, schema_editor):
+    # Entries keyed by the files table's implicit rowid are rebuilt keyed by file id
+    from files.search import drop_index, ensure_index
+    drop_index(schema_editor.connection)
+    ensure_index(schema_editor.connection, rebuild=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0011_file_deleted_partial_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_search_index, migrations.RunPython.noop),
+    ]
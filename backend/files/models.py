@@ -1,7 +1,25 @@
-from django.db import models
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.db.models.signals import post_save
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+import io
 import uuid
 import os
+import math
+import shutil
 import hashlib
+import time
+import contextvars
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from core import metrics
+from .chunking import ChunkedReader
+from . import caching, coldstorage
 
 def file_upload_path(instance, filename):
     """Generate file path for new file upload"""
@@ -9,18 +27,303 @@ def file_upload_path(instance, filename):
     filename = f"{uuid.uuid4()}.{ext}"
     return os.path.join('uploads', filename)
 
+def blob_upload_path(instance, filename):
+    """Generate content-addressed path for a blob, fanned out by hash prefix"""
+    file_hash = instance.file_hash
+    return os.path.join('blobs', file_hash[:2], file_hash[2:4], file_hash)
+
+def chunk_upload_path(instance, filename):
+    """Generate content-addressed path for a deduplicated chunk"""
+    chunk_hash = instance.chunk_hash
+    return os.path.join('chunks', chunk_hash[:2], chunk_hash[2:4], chunk_hash)
+
 def calculate_file_hash(file_obj):
     """Calculate SHA-256 hash of file content"""
     hash_sha256 = hashlib.sha256()
     # Reset file pointer to beginning
     file_obj.seek(0)
     # Read file in chunks to handle large files
-    for chunk in iter(lambda: file_obj.read(4096), b""):
-        hash_sha256.update(chunk)
+    with metrics.timer('vault_upload_stage_seconds', stage='hash'):
+        for chunk in iter(lambda: file_obj.read(4096), b""):
+            hash_sha256.update(chunk)
     # Reset file pointer again
     file_obj.seek(0)
     return hash_sha256.hexdigest()
 
+_blob_writes = contextvars.ContextVar('blob_writes', default=None)
+
+
+@contextmanager
+def blob_writes():
+    """
+    A transaction that unlinks the blob content it stored if it rolls back.
+
+    Blob bytes are written before their rows are inserted, so a rollback
+    would otherwise leave them on disk with nothing referencing them. Writes
+    made outside such a block are left for ``scrub_storage --delete-orphans``.
+    """
+    written = []
+    token = _blob_writes.set(written)
+    try:
+        with transaction.atomic():
+            yield
+    except BaseException:
+        for storage, name in written:
+            storage.delete(name)
+        raise
+    finally:
+        _blob_writes.reset(token)
+    outer = _blob_writes.get()
+    if outer is not None:
+        # Committed to a savepoint only; the enclosing block may still roll back
+        outer.extend(written)
+
+
+def _store_blob(blob, content):
+    with metrics.timer('vault_upload_stage_seconds', stage='store'):
+        blob.file.save(blob.file_hash, content, save=False)
+    written = _blob_writes.get()
+    if written is not None:
+        written.append((blob.file.storage, blob.file.name))
+
+
+class BlobManager(models.Manager):
+    def acquire(self, file_hash, size, content=None):
+        """
+        Take a reference on the blob holding ``file_hash``.
+
+        The bytes in ``content`` are only written to storage when no blob with
+        that hash exists yet. Must be called inside a transaction, which
+        ``blob_writes`` cleans up after if it rolls back.
+        """
+        blob = self.select_for_update().filter(file_hash=file_hash).first()
+        if blob is not None:
+            self.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+            blob.ref_count += 1
+            return blob
+
+        if content is None:
+            raise self.model.DoesNotExist(f"No blob stored for hash {file_hash}")
+
+        blob = self.model(file_hash=file_hash, size=size, ref_count=1)
+        _store_blob(blob, content)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # A concurrent upload of the same content won the insert; share its blob
+            blob.file.delete(save=False)
+            return self.acquire(file_hash, size)
+        return blob
+
+    def acquire_many(self, contents):
+        """
+        Take references on blobs for many uploads at once.
+
+        ``contents`` maps each hash to ``(size, content, refs)``; unseen
+        content is written to storage and every blob is created or
+        re-referenced with a fixed number of queries. Returns blobs keyed by
+        hash. Must be called inside a transaction, which ``blob_writes``
+        cleans up after if it rolls back.
+        """
+        blobs = {blob.file_hash: blob for blob in self.select_for_update().filter(file_hash__in=list(contents))}
+        self._add_refs({blob.pk: contents[file_hash][2] for file_hash, blob in blobs.items()})
+        for file_hash, blob in blobs.items():
+            blob.ref_count += contents[file_hash][2]
+
+        new_blobs = []
+        for file_hash, (size, content, refs) in contents.items():
+            if file_hash not in blobs:
+                blob = self.model(file_hash=file_hash, size=size, ref_count=refs)
+                _store_blob(blob, content)
+                new_blobs.append(blob)
+        if not new_blobs:
+            return blobs
+
+        try:
+            with transaction.atomic():
+                self.bulk_create(new_blobs)
+        except IntegrityError:
+            # A concurrent upload stored some of this content first; insert one at a time
+            for blob in new_blobs:
+                blobs[blob.file_hash] = self._save_or_share(blob)
+            return blobs
+
+        for blob in self.filter(file_hash__in=[blob.file_hash for blob in new_blobs]):
+            blobs[blob.file_hash] = blob
+            # bulk_create skips save signals, which queue new blobs for chunking and sketching
+            post_save.send(sender=self.model, instance=blob, created=True, raw=False,
+                           using=self.db, update_fields=None)
+        return blobs
+
+    def _add_refs(self, changes):
+        """Adjust ref counts given as a mapping of blob id to change, one UPDATE per distinct change"""
+        by_change = defaultdict(list)
+        for blob_id, change in changes.items():
+            by_change[change].append(blob_id)
+        for change, blob_ids in by_change.items():
+            self.filter(pk__in=blob_ids).update(ref_count=F('ref_count') + change)
+
+    def _save_or_share(self, blob):
+        """Insert a blob whose bytes are stored, or take its references on the row a concurrent upload inserted"""
+        try:
+            with transaction.atomic():
+                blob.save()
+            return blob
+        except IntegrityError:
+            blob.file.delete(save=False)
+            existing = self.select_for_update().get(file_hash=blob.file_hash)
+            self.filter(pk=existing.pk).update(ref_count=F('ref_count') + blob.ref_count)
+            existing.ref_count += blob.ref_count
+            return existing
+
+    def release_many(self, blob_refs):
+        """
+        Drop references given as a mapping of blob id to count. Blobs nobody
+        uses any more are deleted and the storage names to unlink returned,
+        leaving the caller to pace the unlinks. Must be called inside a
+        transaction.
+        """
+        self._add_refs({blob_id: -count for blob_id, count in blob_refs.items()})
+        unused = dict(
+            self.select_for_update().filter(pk__in=list(blob_refs), ref_count__lte=0).values_list('pk', 'file')
+        )
+        chunk_refs = Counter(
+            BlobChunk.objects.filter(blob_id__in=list(unused)).values_list('chunk_id', flat=True)
+        )
+        self.filter(pk__in=list(unused)).delete()
+        if chunk_refs:
+            Chunk.objects.release(chunk_refs)
+        return [name for name in unused.values() if name]
+
+    def release(self, blob_id):
+        """
+        Drop a reference on a blob, unlinking its bytes once the last
+        reference goes away. Must be called inside a transaction.
+        """
+        blob = self.select_for_update().get(pk=blob_id)
+        if blob.ref_count > 1:
+            self.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+            return
+
+        storage, name = blob.file.storage, blob.file.name
+        chunk_refs = Counter(blob.manifest.values_list('chunk_id', flat=True))
+        blob.delete()
+        if chunk_refs:
+            Chunk.objects.release(chunk_refs)
+        if name:
+            transaction.on_commit(lambda: storage.delete(name))
+
+
+class Blob(models.Model):
+    """
+    Stored file content, shared by every File with the same hash.
+
+    Content is either one whole file or, once converted for block-level
+    deduplication, a manifest of shared chunks with no whole file on disk.
+    """
+    file_hash = models.CharField(max_length=64, unique=True)  # SHA-256 hash
+    file = models.FileField(upload_to=blob_upload_path, blank=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    chunked = models.BooleanField(default=False)  # Stored as a chunk manifest
+    codec = models.CharField(max_length=8, choices=coldstorage.CODEC_CHOICES, blank=True, default='')
+    stored_size = models.BigIntegerField(null=True, blank=True)  # Bytes on disk once compressed
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BlobManager()
+
+    def __str__(self):
+        return self.file_hash
+
+    def open(self):
+        """Open the content for reading, however it is laid out in storage"""
+        if self.chunked:
+            parts = [
+                (entry.offset, entry.chunk.size, entry.chunk.file.path)
+                for entry in self.manifest.select_related('chunk').order_by('index')
+            ]
+            return io.BufferedReader(ChunkedReader(parts), buffer_size=1024 * 1024)
+        if self.codec:
+            return coldstorage.open_decoded(self.file.storage.open(self.file.name, 'rb'), self.codec)
+        return self.file.storage.open(self.file.name, 'rb')
+
+    @property
+    def is_plain(self):
+        """Whether the stored file holds the content as-is and can be served directly"""
+        return not self.chunked and not self.codec
+
+
+class ChunkManager(models.Manager):
+    def acquire(self, data):
+        """
+        Take a reference on the chunk holding ``data``, writing it only if new.
+
+        Returns ``(chunk, created)``.
+        """
+        chunk_hash = hashlib.sha256(data).hexdigest()
+        with transaction.atomic():
+            chunk = self.select_for_update().filter(chunk_hash=chunk_hash).first()
+            if chunk is not None:
+                self.filter(pk=chunk.pk).update(ref_count=F('ref_count') + 1)
+                return chunk, False
+
+            chunk = self.model(chunk_hash=chunk_hash, size=len(data), ref_count=1)
+            chunk.file.save(chunk_hash, ContentFile(data), save=False)
+            try:
+                with transaction.atomic():
+                    chunk.save()
+            except IntegrityError:
+                chunk.file.delete(save=False)
+                return self.acquire(data)
+        return chunk, True
+
+    def release(self, chunk_refs):
+        """
+        Drop references given as a mapping of chunk id to count, unlinking
+        chunks nobody uses any more. Must be called inside a transaction.
+        """
+        for chunk_id, count in chunk_refs.items():
+            self.filter(pk=chunk_id).update(ref_count=F('ref_count') - count)
+        unused = self.filter(pk__in=list(chunk_refs), ref_count__lte=0)
+        names = list(unused.values_list('file', flat=True))
+        unused.delete()
+        storage = self.model._meta.get_field('file').storage
+        transaction.on_commit(lambda: [storage.delete(name) for name in names])
+
+
+class Chunk(models.Model):
+    """A content-defined chunk stored once and shared by chunked blobs"""
+    chunk_hash = models.CharField(max_length=64, unique=True)  # SHA-256 hash
+    file = models.FileField(upload_to=chunk_upload_path)
+    size = models.PositiveIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+    objects = ChunkManager()
+
+    def __str__(self):
+        return self.chunk_hash
+
+
+class BlobChunk(models.Model):
+    """One entry in a chunked blob's manifest"""
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name='manifest')
+    index = models.PositiveIntegerField()
+    offset = models.BigIntegerField()
+    chunk = models.ForeignKey(Chunk, on_delete=models.PROTECT, related_name='blob_entries')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'index'], name='unique_blob_chunk_index'),
+        ]
+
+
+class FileManager(models.Manager):
+    def get_queryset(self):
+        # Deleted files linger until the purge task reclaims their storage
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class File(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     file = models.FileField(upload_to=file_upload_path)
@@ -29,30 +332,204 @@ class File(models.Model):
     size = models.BigIntegerField()
     uploaded_at = models.DateTimeField(auto_now_add=True)
     file_hash = models.CharField(max_length=64, db_index=True, null=True, blank=True)  # SHA-256 hash
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='files', null=True, blank=True)
+    last_accessed_at = models.DateTimeField(null=True, blank=True, db_index=True)  # Last content read
+    deleted_at = models.DateTimeField(null=True, blank=True)  # Awaiting purge_deleted_files
+
+    objects = FileManager()
+    all_objects = models.Manager()
     
     class Meta:
         ordering = ['-uploaded_at']
         indexes = [
             models.Index(fields=['file_hash']),
             models.Index(fields=['size', 'file_hash']),
+            # One per file list sort, with id as the keyset tie-breaker
+            models.Index(fields=['original_filename', 'id']),
+            models.Index(fields=['size', 'id']),
+            models.Index(fields=['uploaded_at', 'id']),
+            models.Index(fields=['file_type', 'id']),
+            # Partial, so live-file queries (deleted_at IS NULL) keep using the sort indexes above
+            models.Index(fields=['deleted_at'], condition=Q(deleted_at__isnull=False), name='files_file_deleted_idx'),
         ]
     
     def __str__(self):
         return self.original_filename
     
     def save(self, *args, **kwargs):
+        # New content is routed through the blob store so identical uploads share storage
+        if self._state.adding and (self.blob_id or self.file):
+            with blob_writes():
+                self._attach_blob()
+                # Split into insert and signal times by record_insert_time in signals.py
+                self._insert_started = time.perf_counter()
+                super().save(*args, **kwargs)
+                signals_started = getattr(self, '_signals_started', None)
+                if signals_started is not None:
+                    metrics.observe(
+                        'vault_upload_stage_seconds', time.perf_counter() - signals_started, stage='signal'
+                    )
+            return
+
         # Calculate hash if not set and file exists
         if not self.file_hash and self.file:
             self.file_hash = calculate_file_hash(self.file)
         super().save(*args, **kwargs)
-    
+
+    def _attach_blob(self):
+        """Point this file at the blob for its content, storing the bytes only if unseen"""
+        if self.blob_id:
+            self.blob = Blob.objects.acquire(self.blob.file_hash, self.blob.size)
+        else:
+            if not self.file_hash:
+                self.file_hash = calculate_file_hash(self.file)
+            # Hand storage the raw upload so spooled temp files are moved, not copied
+            self.blob = Blob.objects.acquire(self.file_hash, self.file.size, self.file.file)
+        self.file_hash = self.blob.file_hash
+        self.file = self.blob.file.name
+
+    @property
+    def content_url(self):
+        """URL serving this file's bytes, decoded from however they are stored"""
+        return reverse('file-download', args=[self.pk])
+
+    def mark_accessed(self):
+        """Record a read of the content, writing at most once per FILE_ACCESS_RESOLUTION"""
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.FILE_ACCESS_RESOLUTION)
+        if File.objects.filter(pk=self.pk).filter(
+            Q(last_accessed_at__isnull=True) | Q(last_accessed_at__lt=stale)
+        ).update(last_accessed_at=now):
+            caching.bump_version()
+
+    def open_content(self):
+        """Open this file's bytes for reading"""
+        if self.blob_id:
+            return self.blob.open()
+        return self.file.storage.open(self.file.name, 'rb')
+
     def delete(self, *args, **kwargs):
-        """Override delete to remove the actual file from storage"""
-        # Delete the file from storage if it exists
-        if self.file:
-            if os.path.isfile(self.file.path):
-                os.remove(self.file.path)
-        
-        # Call the parent delete method to remove from database
-        super().delete(*args, **kwargs)
+        """Override delete to release the blob, removing its bytes when no longer shared"""
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            if self.blob_id:
+                Blob.objects.release(self.blob_id)
+            elif self.file:
+                # Files uploaded before the blob store own their bytes outright
+                storage, name = self.file.storage, self.file.name
+                transaction.on_commit(lambda: storage.delete(name))
+        return result
+
+
+class UploadSession(models.Model):
+    """A resumable upload whose content arrives as numbered chunks"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    original_filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"UploadSession {self.id}"
 
+    @property
+    def total_chunks(self):
+        return math.ceil(self.size / self.chunk_size)
+
+    @property
+    def chunk_dir(self):
+        return os.path.join(settings.UPLOAD_SESSION_ROOT, str(self.id))
+
+    def chunk_path(self, index):
+        return os.path.join(self.chunk_dir, str(index))
+
+    def expected_chunk_size(self, index):
+        if index == self.total_chunks - 1:
+            return self.size - self.chunk_size * index
+        return self.chunk_size
+
+    def write_chunk(self, index, stream):
+        """
+        Write one chunk from ``stream`` and return its size and SHA-256.
+
+        The chunk is written to a scratch file and renamed into place, so a
+        retried or concurrent PUT of the same index never leaves a torn chunk.
+        Raises ValueError, keeping any previously received copy, when the
+        chunk is not the expected length.
+        """
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        path = self.chunk_path(index)
+        scratch = f"{path}.{uuid.uuid4().hex}.part"
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(scratch, 'wb') as out:
+                for block in iter(lambda: stream.read(64 * 1024), b""):
+                    hasher.update(block)
+                    out.write(block)
+                    size += len(block)
+            if size != self.expected_chunk_size(index):
+                raise ValueError(
+                    f"Chunk {index} must be {self.expected_chunk_size(index)} bytes, got {size}"
+                )
+            os.replace(scratch, path)
+        finally:
+            if os.path.exists(scratch):
+                os.remove(scratch)
+        return size, hasher.hexdigest()
+
+    def assemble(self):
+        """
+        Concatenate the chunks into a temporary upload, hashing as it is written.
+
+        SHA-256 state cannot be merged across independently hashed chunks, so
+        the file hash is built in this single ordered pass; the resulting temp
+        file is then moved, not copied, into the blob store.
+        """
+        upload = TemporaryUploadedFile(self.original_filename, self.file_type, self.size, None)
+        hasher = hashlib.sha256()
+        for index in range(self.total_chunks):
+            with open(self.chunk_path(index), 'rb') as chunk:
+                for block in iter(lambda: chunk.read(1024 * 1024), b""):
+                    hasher.update(block)
+                    upload.write(block)
+        upload.flush()
+        upload.seek(0)
+        upload.sha256 = hasher.hexdigest()
+        return upload
+
+    def discard(self):
+        """Delete the session along with any chunks received so far"""
+        chunk_dir = self.chunk_dir
+        self.delete()
+        transaction.on_commit(lambda: shutil.rmtree(chunk_dir, ignore_errors=True))
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='unique_upload_chunk'),
+        ]
+
+
+class StatCounter(models.Model):
+    """One slot of a vault statistics counter; a counter is the sum of its slots"""
+    name = models.CharField(max_length=64)
+    slot = models.PositiveSmallIntegerField(default=0)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'slot'], name='unique_stat_counter_slot'),
+        ]
+
+    def __str__(self):
+        return f"{self.name}[{self.slot}] = {self.value}"
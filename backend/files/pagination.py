@@ -0,0 +1,207 @@
+"""
+Keyset pagination for the file list.
+
+Pages are addressed by the sort key of the row they start after, with the
+primary key as a unique tie-breaker, so fetching any page is one index
+range scan of ``page_size`` rows however deep it is. Each sort the file
+list offers has a matching (field, id) index on File.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import BooleanField, F, Func, Q, Value
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class RowComparison(Func):
+    """``(a, b, ...) <op> (x, y, ...)`` between columns and values"""
+    conditional = True
+    output_field = BooleanField()
+
+    def __init__(self, columns, values, operator):
+        self.operator = operator
+        self.width = len(columns)
+        super().__init__(*columns, *values)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        parts, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            parts.append(sql)
+            params.extend(expression_params)
+        lhs, rhs = ', '.join(parts[:self.width]), ', '.join(parts[self.width:])
+        return f'({lhs}) {self.operator} ({rhs})', params
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over the queryset's own ordering plus ``pk``.
+
+    Orderings on expressions that are not model fields (e.g. a search rank)
+    cannot be seeked, so those pages fall back to an offset in the cursor.
+    The total is counted only up to ``count_limit`` rows, and skipped
+    entirely with ``?count=false``.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_limit = 10000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count, self.count_exact = self.get_count(queryset, request)
+
+        keys = self.get_keys(queryset)
+        cursor = self.decode_cursor(request)
+        if keys is None:
+            offset = cursor.get('offset', 0) if cursor else 0
+            if not isinstance(offset, int) or offset < 0:
+                raise NotFound(self.invalid_cursor_message)
+            return self.paginate_by_offset(queryset, offset)
+
+        reverse = bool(cursor and cursor.get('reverse'))
+        order = [(name, descending != reverse) for name, descending in keys]
+        queryset = queryset.order_by(*[f"{'-' if descending else ''}{name}" for name, descending in order])
+        if cursor:
+            position = cursor.get('position')
+            if not isinstance(position, list) or len(position) != len(order):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                queryset = queryset.filter(self.after(queryset.model, order, position))
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.keys = keys
+        self.rows = rows
+        return rows
+
+    def paginate_by_offset(self, queryset, offset):
+        rows = list(queryset[offset:offset + self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.has_previous = offset > 0
+        self.offset = offset
+        self.keys = None
+        self.rows = rows[:self.page_size]
+        return self.rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_count(self, queryset, request):
+        if request.query_params.get('count', '').lower() == 'false':
+            return None, False
+        # Counting a capped subquery keeps the cost bounded on huge result sets
+        count = queryset.order_by()[:self.count_limit + 1].count()
+        if count > self.count_limit:
+            return self.count_limit, False
+        return count, True
+
+    def get_keys(self, queryset):
+        """The ordering as ``(field, descending)`` pairs ending in pk, or None if not seekable"""
+        model = queryset.model
+        ordering = list(queryset.query.order_by or model._meta.ordering)
+        keys = []
+        for term in ordering:
+            if not isinstance(term, str):
+                return None
+            name = term.lstrip('-')
+            if name == 'pk':
+                name = model._meta.pk.name
+            try:
+                model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            keys.append((name, term.startswith('-')))
+        if not keys or keys[-1][0] != model._meta.pk.name:
+            keys.append((model._meta.pk.name, keys[-1][1] if keys else False))
+        return keys
+
+    @staticmethod
+    def after(model, order, position):
+        """Condition for rows strictly after ``position`` in ``order``"""
+        fields = [model._meta.get_field(name) for name, _ in order]
+        values = [field.to_python(value) for field, value in zip(fields, position)]
+        directions = {descending for _, descending in order}
+        if len(directions) == 1:
+            # A row-value comparison lets the database seek the (key, id) index directly
+            return RowComparison(
+                [F(name) for name, _ in order],
+                [Value(value, output_field=field) for field, value in zip(fields, values)],
+                '<' if directions.pop() else '>',
+            )
+
+        condition = Q()
+        for (name, descending), value in reversed(list(zip(order, values))):
+            beyond = Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            condition = beyond | (Q(**{name: value}) & condition) if condition else beyond
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            if not isinstance(cursor, dict):
+                raise ValueError
+        except (TypeError, ValueError, BinasciiError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, cursor):
+        data = json.dumps(cursor, separators=(',', ':'))
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, urlsafe_b64encode(data.encode()).decode()
+        )
+
+    def position(self, row):
+        # value_to_string keeps full precision; JSON encoders round datetimes
+        return [row._meta.get_field(name).value_to_string(row) for name, _ in self.keys]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.keys is None:
+            return self.encode_cursor({'offset': self.offset + self.page_size})
+        return self.encode_cursor({'position': self.position(self.rows[-1])})
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.keys is None:
+            if self.offset <= self.page_size:
+                return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+            return self.encode_cursor({'offset': self.offset - self.page_size})
+        if not self.rows:
+            return None
+        return self.encode_cursor({'position': self.position(self.rows[0]), 'reverse': True})
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'count_exact': self.count_exact,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
@@ -0,0 +1,150 @@
+"""
+Indexed filename search.
+
+On SQLite, files are indexed in an FTS5 table kept in step with the files
+table by triggers, and searches match whole tokens and token prefixes
+(``rep`` finds ``Q3-report.pdf``), ranked with bm25. The files table has a
+UUID primary key, so its implicit rowid may be renumbered by VACUUM; index
+entries are instead keyed by an INTEGER PRIMARY KEY in a table mapping each
+to its file id. On PostgreSQL a
+trigram GIN index serves substring matches, ranked by word similarity.
+Other databases fall back to an unindexed substring scan.
+"""
+import re
+
+from django.db import connections
+from django.db.models import F, Q, Value
+from django.db.models.functions import Upper
+
+from .models import File
+
+FTS_TABLE = 'files_file_search'
+FTS_IDS_TABLE = 'files_file_search_ids'
+# Filenames weigh more than MIME types when ranking
+FTS_WEIGHTS = (10.0, 1.0)
+
+_TOKEN = re.compile(r'\w+')
+
+SQLITE_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {FTS_IDS_TABLE} (
+        docid INTEGER PRIMARY KEY,
+        file_id CHAR(32) NOT NULL UNIQUE
+    )
+    """,
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        original_filename, file_type,
+        tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON files_file BEGIN
+        INSERT INTO {FTS_IDS_TABLE}(file_id) VALUES (new.id);
+        INSERT INTO {FTS_TABLE}(rowid, original_filename, file_type)
+        VALUES (last_insert_rowid(), new.original_filename, new.file_type);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON files_file BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = (SELECT docid FROM {FTS_IDS_TABLE} WHERE file_id = old.id);
+        DELETE FROM {FTS_IDS_TABLE} WHERE file_id = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF original_filename, file_type ON files_file BEGIN
+        UPDATE {FTS_TABLE} SET original_filename = new.original_filename, file_type = new.file_type
+        WHERE rowid = (SELECT docid FROM {FTS_IDS_TABLE} WHERE file_id = old.id);
+    END
+    """,
+]
+
+SQLITE_REBUILD = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"DELETE FROM {FTS_IDS_TABLE}",
+    f"INSERT INTO {FTS_IDS_TABLE}(file_id) SELECT id FROM files_file",
+    f"""
+    INSERT INTO {FTS_TABLE}(rowid, original_filename, file_type)
+    SELECT ids.docid, files_file.original_filename, files_file.file_type
+    FROM {FTS_IDS_TABLE} AS ids JOIN files_file ON files_file.id = ids.file_id
+    """,
+]
+
+POSTGRES_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Matches the UPPER(...) LIKE UPPER(...) that icontains compiles to
+    "CREATE INDEX IF NOT EXISTS files_file_filename_trgm ON files_file USING gin (UPPER(original_filename) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS files_file_type_trgm ON files_file USING gin (UPPER(file_type) gin_trgm_ops)",
+]
+
+
+def ensure_index(connection, rebuild=False):
+    """
+    Create the search index for ``connection`` if it is missing.
+
+    On SQLite the index is rebuilt from the files table when its triggers
+    had to be (re)created, e.g. after a migration remade the table.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                [f'{FTS_TABLE}_%'],
+            )
+            rebuild = rebuild or cursor.fetchone()[0] < 3
+            for statement in SQLITE_SCHEMA:
+                cursor.execute(statement)
+            if rebuild:
+                for statement in SQLITE_REBUILD:
+                    cursor.execute(statement)
+        elif connection.vendor == 'postgresql':
+            for statement in POSTGRES_SCHEMA:
+                cursor.execute(statement)
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_IDS_TABLE}")
+            for suffix in ('insert', 'delete', 'update'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        elif connection.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS files_file_filename_trgm")
+            cursor.execute("DROP INDEX IF EXISTS files_file_type_trgm")
+
+
+def fts_query(text):
+    """Turn user input into an FTS5 query requiring every token as a prefix"""
+    return ' '.join(f'"{token}"*' for token in _TOKEN.findall(text))
+
+
+def search(queryset, text):
+    """
+    Filter ``queryset`` to files matching ``text`` and annotate ``search_rank``,
+    where lower ranks are better matches.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        query = fts_query(text)
+        if not query:
+            # Nothing searchable, e.g. only punctuation
+            return queryset.annotate(search_rank=Value(0.0))
+        table = File._meta.db_table
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        return queryset.extra(
+            select={'search_rank': f'bm25({FTS_TABLE}, {weights})'},
+            tables=[FTS_TABLE, FTS_IDS_TABLE],
+            where=[
+                f'{FTS_TABLE} MATCH %s',
+                f'{FTS_IDS_TABLE}.docid = {FTS_TABLE}.rowid',
+                f'{FTS_IDS_TABLE}.file_id = {table}.id',
+            ],
+            params=[query],
+        )
+
+    matches = queryset.filter(Q(original_filename__icontains=text) | Q(file_type__icontains=text))
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        return matches.annotate(search_rank=-TrigramWordSimilarity(Upper(Value(text)), Upper(F('original_filename'))))
+    return matches.annotate(search_rank=Value(0.0))
@@ -1,8 +1,61 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import File
+from .models import File, UploadSession
 
 class FileSerializer(serializers.ModelSerializer):
+    codec = serializers.SerializerMethodField()
+    stored_size = serializers.SerializerMethodField()
+
     class Meta:
         model = File
-        fields = ['id', 'file', 'original_filename', 'file_type', 'size', 'uploaded_at']
-        read_only_fields = ['id', 'uploaded_at'] 
\ No newline at end of file
+        fields = ['id', 'file', 'original_filename', 'file_type', 'size', 'uploaded_at',
+                  'last_accessed_at', 'codec', 'stored_size']
+        read_only_fields = ['id', 'uploaded_at', 'last_accessed_at']
+
+    def get_codec(self, obj):
+        return (obj.blob.codec or None) if obj.blob_id else None
+
+    def get_stored_size(self, obj):
+        """Bytes this file's content takes on disk (shared by every copy)"""
+        if obj.blob_id and obj.blob.codec:
+            return obj.blob.stored_size
+        return obj.size
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Content is served by the download endpoint, never straight from storage
+        request = self.context.get('request')
+        url = instance.content_url
+        data['file'] = request.build_absolute_uri(url) if request else url
+        return data
+
+class FileProbeSerializer(serializers.Serializer):
+    hash = serializers.RegexField(r'^[0-9a-f]{64}$')  # SHA-256 hex digest
+    size = serializers.IntegerField(min_value=0)
+    name = serializers.CharField(max_length=255)
+    file_type = serializers.CharField(max_length=100, required=False, default='application/octet-stream')
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    total_chunks = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'original_filename', 'file_type', 'size', 'chunk_size',
+                  'total_chunks', 'received_chunks', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+    def get_received_chunks(self, obj):
+        return list(obj.chunks.order_by('index').values_list('index', flat=True))
+
+    def validate_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError('Size must not be negative.')
+        return value
+
+    def validate_chunk_size(self, value):
+        if not 0 < value <= settings.UPLOAD_CHUNK_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Chunk size must be between 1 and {settings.UPLOAD_CHUNK_MAX_SIZE} bytes.'
+            )
+        return value
@@ -1,17 +1,98 @@
-from django.db.models.signals import post_save, post_delete
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.signals import post_migrate, post_save, post_delete
 from django.dispatch import receiver
 
-from .models import File
-from dedup.models import DedupJob
-from dedup.tasks import deduplicate_files
+from . import caching, stats
+from .models import Blob, File
+from .search import ensure_index
+from .tasks import chunk_blob
+from core import metrics
+from dedup import index
+from dedup.tasks import sketch_blob
+
+@receiver(post_save, sender=File)
+def record_insert_time(sender, instance, created, **kwargs):
+    """
+    Record how long the new row took to insert. Connected first, so the
+    receivers below are timed as the signal stage by File.save.
+    """
+    if hasattr(instance, '_insert_started'):
+        instance._signals_started = time.perf_counter()
+        metrics.observe(
+            'vault_upload_stage_seconds', instance._signals_started - instance._insert_started, stage='insert'
+        )
 
 @receiver(post_save, sender=File)
 @receiver(post_delete, sender=File)
-def invalidate_and_rerun_dedup_jobs(sender, instance, **kwargs):
+def invalidate_cached_responses(sender, instance, **kwargs):
     """
-    Invalidate deduplication jobs when files are added or deleted.
+    Bump the vault version so cached list and report responses are not served again.
     """
-    DedupJob.objects.filter(is_valid=True).update(is_valid=False)
+    if instance.deleted_at:
+        # Invalidated when batch_delete marked it
+        return
+    caching.bump_version()
 
-    # Trigger a new deduplication job
-    deduplicate_files.delay()
\ No newline at end of file
+@receiver(post_save, sender=File)
+def count_file(sender, instance, created, **kwargs):
+    """
+    Add newly created files to the vault statistics.
+    """
+    if created:
+        stats.file_added(instance.size, instance.file_type)
+
+@receiver(post_delete, sender=File)
+def uncount_file(sender, instance, **kwargs):
+    """
+    Remove deleted files from the vault statistics.
+    """
+    if instance.deleted_at:
+        # Uncounted when batch_delete marked it
+        return
+    stats.file_removed(instance.size, instance.file_type)
+
+@receiver(post_save, sender=File)
+def add_to_duplicate_index(sender, instance, created, **kwargs):
+    """
+    Count newly created files in the duplicate index.
+    """
+    if created and instance.file_hash:
+        index.file_added(instance.file_hash, instance.size, instance.file_type)
+
+@receiver(post_delete, sender=File)
+def remove_from_duplicate_index(sender, instance, **kwargs):
+    """
+    Drop deleted files from the duplicate index.
+    """
+    if instance.file_hash and not instance.deleted_at:
+        index.file_removed(instance.file_hash, instance.size)
+
+@receiver(post_save, sender=Blob)
+def schedule_blob_chunking(sender, instance, created, **kwargs):
+    """
+    Queue new large blobs for block-level deduplication when it is enabled.
+    """
+    if created and settings.BLOCK_DEDUP_ENABLED and instance.size >= settings.BLOCK_DEDUP_MIN_SIZE:
+        transaction.on_commit(lambda: chunk_blob.delay(instance.pk))
+
+@receiver(post_save, sender=Blob)
+def schedule_blob_sketch(sender, instance, created, **kwargs):
+    """
+    Queue new blobs for near-duplicate detection.
+    """
+    if created and settings.SIMILARITY_ENABLED and (
+        settings.SIMILARITY_MIN_SIZE <= instance.size <= settings.SIMILARITY_MAX_SIZE
+    ):
+        transaction.on_commit(lambda: sketch_blob.delay(instance.pk))
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    """
+    Recreate the search index if a migration dropped it; SQLite drops the
+    sync triggers whenever a migration has to rebuild the files table.
+    """
+    if sender.name == 'files':
+        ensure_index(connections[using])
@@ -0,0 +1,165 @@
+"""
+Vault statistics kept as counters.
+
+Every File insert and delete adjusts the counters in its own transaction
+(duplicate totals are adjusted by the duplicate index), so reading the
+statistics never aggregates over the files table. Each counter is spread
+over STATS_COUNTER_SLOTS rows and every update picks one at random, so
+concurrent uploads rarely wait on the same row lock.
+"""
+import random
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, Case, Count, F, Sum, Value, When
+
+from .categories import CATEGORIES, category_of
+from .models import StatCounter
+
+FILES = 'files'
+BYTES = 'bytes'
+DUPLICATE_BYTES = 'duplicate_bytes'  # Bytes in every file whose content is stored more than once
+RECLAIMABLE_BYTES = 'reclaimable_bytes'  # Bytes freed by keeping one file per content
+
+
+def category_files(category):
+    return f'category:{category}:files'
+
+
+def category_bytes(category):
+    return f'category:{category}:bytes'
+
+
+def add(deltas):
+    """Apply ``{counter: delta}`` to the counters in one UPDATE where possible"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    slot = random.randrange(settings.STATS_COUNTER_SLOTS)
+    counters = StatCounter.objects.filter(slot=slot, name__in=deltas)
+    updated = counters.update(value=F('value') + Case(
+        *[When(name=name, then=Value(delta)) for name, delta in deltas.items()],
+        default=Value(0),
+        output_field=BigIntegerField(),
+    ))
+    if updated == len(deltas):
+        return
+
+    existing = set(counters.values_list('name', flat=True))
+    for name, delta in deltas.items():
+        if name in existing:
+            continue
+        try:
+            with transaction.atomic():
+                StatCounter.objects.create(name=name, slot=slot, value=delta)
+        except IntegrityError:
+            # Created by a concurrent transaction after our UPDATE
+            StatCounter.objects.filter(name=name, slot=slot).update(value=F('value') + delta)
+
+
+def file_deltas(size, file_type, count=1):
+    category = category_of(file_type)
+    return {
+        FILES: count,
+        BYTES: size * count,
+        category_files(category): count,
+        category_bytes(category): size * count,
+    }
+
+
+def file_added(size, file_type, count=1):
+    """Count ``count`` new files of ``size`` bytes"""
+    add(file_deltas(size, file_type, count))
+
+
+def file_removed(size, file_type, count=1):
+    """Uncount ``count`` removed files of ``size`` bytes"""
+    add(file_deltas(size, file_type, -count))
+
+
+def files_added(files):
+    """Count many new files, e.g. after a bulk insert, in one update"""
+    deltas = Counter()
+    for file in files:
+        deltas.update(file_deltas(file.size, file.file_type))
+    add(deltas)
+
+
+def files_removed(queryset):
+    """Uncount every file in ``queryset`` before a bulk delete"""
+    deltas = Counter()
+    for group in queryset.values('file_type').annotate(files=Count('id'), bytes=Sum('size')):
+        category = category_of(group['file_type'])
+        for name, delta in ((FILES, group['files']), (BYTES, group['bytes']),
+                            (category_files(category), group['files']),
+                            (category_bytes(category), group['bytes'])):
+            deltas[name] -= delta
+    add(deltas)
+
+
+def duplicate_deltas(size, count_before, count_after):
+    def duplicated(count):
+        return count if count > 1 else 0
+
+    return {
+        DUPLICATE_BYTES: size * (duplicated(count_after) - duplicated(count_before)),
+        RECLAIMABLE_BYTES: size * (max(count_after - 1, 0) - max(count_before - 1, 0)),
+    }
+
+
+def duplicates_changed(size, count_before, count_after):
+    """Adjust the duplicate totals for content of ``size`` bytes whose file count changed"""
+    add(duplicate_deltas(size, count_before, count_after))
+
+
+def read():
+    """Every counter's current value"""
+    return dict(StatCounter.objects.values('name').annotate(total=Sum('value')).values_list('name', 'total'))
+
+
+def snapshot():
+    counters = read()
+    return {
+        'total_files': counters.get(FILES, 0),
+        'total_bytes': counters.get(BYTES, 0),
+        'categories': {
+            category: {
+                'files': counters.get(category_files(category), 0),
+                'bytes': counters.get(category_bytes(category), 0),
+            }
+            for category in CATEGORIES
+        },
+        'duplicate_bytes': counters.get(DUPLICATE_BYTES, 0),
+        'reclaimable_bytes': counters.get(RECLAIMABLE_BYTES, 0),
+    }
+
+
+def compute(file_model, group_model):
+    """Count every statistic from scratch; takes the models so migrations can pass historical ones"""
+    totals = Counter()
+    for group in file_model.objects.values('file_type').annotate(files=Count('id'), bytes=Sum('size')).order_by():
+        category = category_of(group['file_type'])
+        totals[FILES] += group['files']
+        totals[BYTES] += group['bytes']
+        totals[category_files(category)] += group['files']
+        totals[category_bytes(category)] += group['bytes']
+
+    duplicates = group_model.objects.filter(file_count__gt=1).aggregate(
+        duplicate_bytes=Sum(F('size') * F('file_count')),
+        reclaimable_bytes=Sum('reclaimable_bytes'),
+    )
+    totals[DUPLICATE_BYTES] = duplicates['duplicate_bytes'] or 0
+    totals[RECLAIMABLE_BYTES] = duplicates['reclaimable_bytes'] or 0
+    return totals
+
+
+@transaction.atomic
+def rebuild():
+    """Recount every statistic, repairing drift from writes made outside the ORM"""
+    from dedup.models import DuplicateGroup
+    from .models import File
+
+    totals = compute(File, DuplicateGroup)
+    StatCounter.objects.all().delete()
+    StatCounter.objects.bulk_create(StatCounter(name=name, value=value) for name, value in totals.items())
@@ -0,0 +1,202 @@
+from collections import Counter
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import caching, chunking, coldstorage
+from .backfill import backfill_file_hashes
+from .hashing import RateLimiter
+from .models import Blob, BlobChunk, Chunk, File, UploadSession
+
+
+@shared_task
+def purge_stale_upload_sessions():
+    """
+    Task to garbage-collect chunked upload sessions that stopped receiving chunks.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    purged = 0
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+        with transaction.atomic():
+            session.discard()
+        purged += 1
+
+    return {'sessions_purged': purged}
+
+
+@shared_task
+def purge_deleted_files():
+    """
+    Task to reclaim the storage of files marked deleted by batch_delete.
+
+    Rows are removed and their blobs released a batch at a time; each
+    batch's bytes are unlinked once it commits, paced at
+    FILE_PURGE_UNLINK_RATE so a large purge never saturates the disk.
+    """
+    limiter = RateLimiter(settings.FILE_PURGE_UNLINK_RATE)
+    storage = File._meta.get_field('file').storage
+    purged = unlinked = 0
+    while True:
+        with transaction.atomic():
+            # Skip rows a concurrent purge has claimed (where the database supports it)
+            batch = list(
+                File.all_objects.select_for_update(skip_locked=True)
+                .filter(deleted_at__isnull=False)
+                .order_by()  # Any order will do; lets the partial deleted_at index serve the query
+                .values_list('pk', 'blob_id', 'file')[:settings.FILE_PURGE_BATCH_SIZE]
+            )
+            if not batch:
+                break
+            File.all_objects.filter(pk__in=[pk for pk, _, _ in batch]).delete()
+            blob_refs = Counter(blob_id for _, blob_id, _ in batch if blob_id)
+            names = Blob.objects.release_many(blob_refs) if blob_refs else []
+            # Files uploaded before the blob store own their bytes outright
+            names += [name for _, blob_id, name in batch if not blob_id and name]
+
+        for name in names:
+            limiter.consume(1)
+            storage.delete(name)
+        purged += len(batch)
+        unlinked += len(names)
+
+    return {'files_purged': purged, 'files_unlinked': unlinked}
+
+
+@shared_task(bind=True)
+def backfill_hashes(self, batch_size=500, workers=8, after=None):
+    """
+    Task to hash every file whose file_hash is NULL, reporting progress as task state.
+    """
+    return backfill_file_hashes(
+        batch_size=batch_size,
+        workers=workers,
+        after=after,
+        progress=lambda totals: self.update_state(state='PROGRESS', meta=totals),
+    )
+
+
+@shared_task
+def chunk_blob(blob_id):
+    """
+    Task to convert a whole-file blob into content-defined chunks, storing
+    each unique chunk once and deleting the whole-file copy.
+    """
+    blob = Blob.objects.filter(pk=blob_id, chunked=False).first()
+    if not blob:
+        return {'blob_id': blob_id, 'skipped': True}
+
+    # Chunks are stored outside the final transaction so a large file does
+    # not hold the database write lock while it is being split
+    manifest = []
+    new_bytes = 0
+    offset = 0
+    try:
+        with blob.open() as content:
+            for index, data in enumerate(chunking.iter_chunks(content)):
+                chunk, created = Chunk.objects.acquire(data)
+                manifest.append(BlobChunk(index=index, offset=offset, chunk=chunk))
+                offset += len(data)
+                if created:
+                    new_bytes += len(data)
+
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(pk=blob_id, chunked=False).first()
+            if not blob:
+                # Deleted or converted while we were chunking; give the references back
+                Chunk.objects.release(Counter(entry.chunk_id for entry in manifest))
+                return {'blob_id': blob_id, 'skipped': True}
+
+            for entry in manifest:
+                entry.blob = blob
+            BlobChunk.objects.bulk_create(manifest, batch_size=1000)
+            storage, name = blob.file.storage, blob.file.name
+            Blob.objects.filter(pk=blob.pk).update(chunked=True, file='', codec='', stored_size=None)
+            # Its files are read through the chunk manifest from now on
+            File.all_objects.filter(blob_id=blob.pk).update(file='')
+            if blob.codec:
+                # Its files are listed with their compressed size until now
+                caching.bump_version()
+            transaction.on_commit(lambda: storage.delete(name))
+    except BaseException:
+        # Failed part way (unreadable content, a lost database, a worker
+        # shutting down): nothing references the chunks taken so far
+        with transaction.atomic():
+            Chunk.objects.release(Counter(entry.chunk_id for entry in manifest))
+        raise
+
+    return {
+        'blob_id': blob_id,
+        'chunks': len(manifest),
+        'new_chunk_bytes': new_bytes,
+        'size': offset,
+    }
+
+
+@shared_task
+def compress_cold_blobs():
+    """
+    Task to move cold, compressible blobs into the compressed storage tier.
+
+    A blob is cold when none of its files has been read (or, if never read,
+    uploaded) within COLD_STORAGE_AFTER seconds.
+    """
+    if not settings.COLD_STORAGE_ENABLED:
+        return {'skipped': True}
+    codec = settings.COLD_STORAGE_CODEC
+    coldstorage.check_codec(codec)
+
+    cutoff = timezone.now() - timedelta(seconds=settings.COLD_STORAGE_AFTER)
+    compressible = File.objects.filter(coldstorage.compressible_types(), blob=OuterRef('pk'))
+    candidates = (
+        Blob.objects.filter(chunked=False, codec='', size__gte=settings.COLD_STORAGE_MIN_SIZE)
+        .filter(Exists(compressible))
+        .annotate(last_used=Max(Coalesce('files__last_accessed_at', 'files__uploaded_at')))
+        .filter(last_used__lt=cutoff)
+    )
+
+    compressed = 0
+    saved = 0
+    for blob_id in candidates.values_list('pk', flat=True).iterator():
+        savings = compress_blob(blob_id, codec)
+        if savings is not None:
+            compressed += 1
+            saved += savings
+
+    return {'blobs_compressed': compressed, 'bytes_saved': saved}
+
+
+def compress_blob(blob_id, codec):
+    """
+    Rewrite one whole-file blob compressed with ``codec``, returning the bytes
+    saved or None if it was left as it is.
+    """
+    blob = Blob.objects.filter(pk=blob_id, chunked=False, codec='').first()
+    if not blob:
+        return None
+    storage, name = blob.file.storage, blob.file.name
+
+    # Compress outside the transaction so readers and uploads are not held up
+    with storage.open(name, 'rb') as source:
+        if not coldstorage.worth_compressing(source.read(coldstorage.SAMPLE_SIZE), codec):
+            return None
+        result = coldstorage.compress_to_storage(source, storage, name, codec)
+    if result is None:
+        return None
+    stored_name, stored_size = result
+
+    with transaction.atomic():
+        if not Blob.objects.select_for_update().filter(pk=blob_id, chunked=False, codec='', file=name).exists():
+            # Deleted or rewritten while we were compressing
+            transaction.on_commit(lambda: storage.delete(stored_name))
+            return None
+        Blob.objects.filter(pk=blob_id).update(file=stored_name, codec=codec, stored_size=stored_size)
+        File.all_objects.filter(blob_id=blob_id).update(file=stored_name)
+        caching.bump_version()
+        transaction.on_commit(lambda: storage.delete(name))
+
+    return blob.size - stored_size
@@ -0,0 +1,1140 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+
+import redis
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, RequestAborted
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+from rest_framework.test import APIClient
+
+from dedup.models import DuplicateGroup
+
+from . import caching, chunking, coldstorage, stats
+from .asgi import WRITE_SIZE, StreamingASGIHandler
+from .backfill import backfill_file_hashes
+from .downloads import BLOCK_SIZE, MAX_RANGES, parse_range
+from .management.commands.benchmark import LIST_SCENARIOS, Command as BenchmarkCommand
+from .models import Blob, Chunk, File, StatCounter, UploadSession, blob_writes
+from .tasks import chunk_blob, compress_cold_blobs, purge_deleted_files
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='vault-tests-')
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    UPLOAD_SESSION_ROOT=os.path.join(MEDIA_ROOT, 'upload_sessions'),
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    METRICS_URL=None,
+)
+class VaultTestCase(TestCase):
+    """Runs against a temporary media directory and an in-memory response cache"""
+
+    def setUp(self):
+        # The cache outlives each test's rolled back transaction
+        caches['default'].clear()
+        self.client = APIClient()
+
+    def upload(self, content, name='file.txt', content_type='text/plain'):
+        upload = SimpleUploadedFile(name, content, content_type)
+        response = self.client.post('/api/files/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return File.objects.get(pk=response.data['id'])
+
+
+def stored_copies(content):
+    """Names of the files in blob storage holding ``content``, left behind by any test"""
+    file_hash = hashlib.sha256(content).hexdigest()
+    directory = os.path.join(MEDIA_ROOT, 'blobs', file_hash[:2], file_hash[2:4])
+    return [name for name in os.listdir(directory) if name.startswith(file_hash)] if os.path.isdir(directory) else []
+
+
+class BlobReferenceTests(VaultTestCase):
+    def test_identical_uploads_share_one_blob(self):
+        first = self.upload(b'same content', 'a.txt')
+        second = self.upload(b'same content', 'b.txt')
+        other = self.upload(b'other content', 'c.txt')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertNotEqual(first.blob_id, other.blob_id)
+        self.assertEqual(Blob.objects.get(pk=first.blob_id).ref_count, 2)
+        self.assertEqual(Blob.objects.get(pk=other.blob_id).ref_count, 1)
+        self.assertEqual(first.file.name, second.file.name)
+
+    def test_acquire_without_content_needs_an_existing_blob(self):
+        with self.assertRaises(Blob.DoesNotExist):
+            Blob.objects.acquire('0' * 64, 1)
+
+    def test_release_deletes_the_blob_with_its_last_reference(self):
+        first = self.upload(b'shared', 'a.txt')
+        second = self.upload(b'shared', 'b.txt')
+        blob = Blob.objects.get(pk=first.blob_id)
+        path = blob.file.path
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_content_reads_back(self):
+        file = self.upload(b'stored once', 'a.txt')
+        with file.open_content() as content:
+            self.assertEqual(content.read(), b'stored once')
+
+    def test_rolled_back_uploads_unlink_the_content_they_stored(self):
+        with mock.patch('dedup.index.file_added', side_effect=RuntimeError('index unavailable')):
+            with self.assertRaises(RuntimeError):
+                self.upload(b'rolled back upload', 'a.txt')
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(stored_copies(b'rolled back upload'), [])
+
+    def test_rolled_back_uploads_keep_content_stored_before(self):
+        file = self.upload(b'stored before', 'a.txt')
+        with mock.patch('dedup.index.file_added', side_effect=RuntimeError('index unavailable')):
+            with self.assertRaises(RuntimeError):
+                self.upload(b'stored before', 'b.txt')
+        self.assertEqual(Blob.objects.get(pk=file.blob_id).ref_count, 1)
+        self.assertTrue(os.path.exists(file.blob.file.path))
+
+    def test_content_stored_in_a_savepoint_is_unlinked_with_the_enclosing_block(self):
+        with self.assertRaises(RuntimeError):
+            with blob_writes():
+                File.objects.create(file=SimpleUploadedFile('a.txt', b'stored in a savepoint'),
+                                    original_filename='a.txt', file_type='text/plain', size=21)
+                self.assertEqual(len(stored_copies(b'stored in a savepoint')), 1)
+                raise RuntimeError('a later step failed')
+        self.assertEqual(stored_copies(b'stored in a savepoint'), [])
+
+
+class HashingUploadTests(VaultTestCase):
+    def assertHashedOnReceipt(self, content):
+        with mock.patch('files.models.calculate_file_hash') as rehash:
+            file = self.upload(content)
+        rehash.assert_not_called()
+        self.assertEqual(file.file_hash, hashlib.sha256(content).hexdigest())
+
+    def test_uploads_held_in_memory_are_hashed_on_receipt(self):
+        self.assertHashedOnReceipt(b'small upload')
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_uploads_spooled_to_disk_are_hashed_on_receipt(self):
+        self.assertHashedOnReceipt(os.urandom(200 * 1024))
+
+
+class ProbeTests(VaultTestCase):
+    def probe(self, content, size=None, name='copy.txt'):
+        return self.client.post('/api/files/probe/', {
+            'hash': hashlib.sha256(content).hexdigest(),
+            'size': len(content) if size is None else size,
+            'name': name,
+            'file_type': 'text/plain',
+        }, format='json')
+
+    def test_known_content_is_stored_without_an_upload(self):
+        existing = self.upload(b'known content')
+
+        response = self.probe(b'known content')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        file = File.objects.get(pk=response.data['id'])
+        self.assertEqual(file.original_filename, 'copy.txt')
+        self.assertEqual(file.blob_id, existing.blob_id)
+        self.assertEqual(file.file_hash, existing.file_hash)
+        self.assertEqual(Blob.objects.get(pk=existing.blob_id).ref_count, 2)
+
+    def test_unknown_content_is_not_found(self):
+        self.upload(b'known content')
+        self.assertEqual(self.probe(b'unknown content').status_code, 404)
+        self.assertEqual(self.probe(b'known content', size=1).status_code, 404)
+        self.assertEqual(File.objects.count(), 1)
+
+    def test_invalid_hash(self):
+        response = self.client.post('/api/files/probe/', {'hash': 'abc', 'size': 1, 'name': 'a'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_blob_released_before_the_file_is_created(self):
+        self.upload(b'known content')
+
+        with mock.patch.object(Blob.objects, 'acquire', side_effect=Blob.DoesNotExist):
+            response = self.probe(b'known content')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(File.objects.count(), 1)
+
+
+class UploadSessionTests(VaultTestCase):
+    CONTENT = bytes(range(256)) * 10
+
+    def start_session(self, chunk_size=1000):
+        response = self.client.post('/api/uploads/', {
+            'original_filename': 'big.bin',
+            'file_type': 'application/octet-stream',
+            'size': len(self.CONTENT),
+            'chunk_size': chunk_size,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def send_chunk(self, session_id, index, chunk_size=1000):
+        data = self.CONTENT[index * chunk_size:(index + 1) * chunk_size]
+        response = self.client.put(
+            f'/api/uploads/{session_id}/chunks/{index}/', data, content_type='application/octet-stream',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_finalize_assembles_chunks_received_in_any_order(self):
+        session_id = self.start_session()
+        for index in [2, 0, 1]:
+            self.send_chunk(session_id, index)
+
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        file = File.objects.get(pk=response.data['id'])
+        self.assertEqual(file.size, len(self.CONTENT))
+        with file.open_content() as content:
+            self.assertEqual(content.read(), self.CONTENT)
+        self.assertFalse(UploadSession.objects.filter(pk=session_id).exists())
+
+    def test_received_chunks_are_listed_for_resuming(self):
+        session_id = self.start_session()
+        self.send_chunk(session_id, 2)
+        self.send_chunk(session_id, 0)
+
+        response = self.client.get(f'/api/uploads/{session_id}/')
+
+        self.assertEqual(response.data['total_chunks'], 3)
+        self.assertEqual(response.data['received_chunks'], [0, 2])
+
+    def test_chunks_of_the_wrong_size_are_rejected(self):
+        session_id = self.start_session()
+        response = self.client.put(
+            f'/api/uploads/{session_id}/chunks/0/', b'short', content_type='application/octet-stream',
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put(
+            f'/api/uploads/{session_id}/chunks/3/', b'x', content_type='application/octet-stream',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').data['received_chunks'], [])
+
+    def test_finalize_reports_missing_chunks(self):
+        session_id = self.start_session()
+        self.send_chunk(session_id, 1)
+
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['missing_chunks'], [0, 2])
+        self.assertFalse(File.objects.exists())
+
+    def test_finalize_shares_the_blob_of_identical_content(self):
+        existing = self.upload(self.CONTENT, 'existing.bin')
+        session_id = self.start_session()
+        for index in range(3):
+            self.send_chunk(session_id, index)
+
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+
+        file = File.objects.get(pk=response.data['id'])
+        self.assertEqual(file.blob_id, existing.blob_id)
+        self.assertEqual(Blob.objects.get(pk=file.blob_id).ref_count, 2)
+
+    def test_a_session_consumed_concurrently_is_not_finalized_twice(self):
+        session_id = self.start_session()
+        for index in range(3):
+            self.send_chunk(session_id, index)
+        assemble = UploadSession.assemble
+
+        def assemble_then_lose_race(session):
+            upload = assemble(session)
+            # Another finalize commits first
+            UploadSession.objects.filter(pk=session.pk).delete()
+            return upload
+
+        with mock.patch.object(UploadSession, 'assemble', assemble_then_lose_race):
+            response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+
+class ScrubStorageTests(VaultTestCase):
+    def scrub(self, *args):
+        stdout = io.StringIO()
+        call_command('scrub_storage', '--workers', '2', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_files_with_a_unique_size_are_not_read_fully(self):
+        self.upload(b'a' * 10, 'a.txt')
+        self.upload(b'b' * 20, 'b.txt')
+        self.upload(b'c' * 20, 'c.txt')
+
+        output = self.scrub()
+
+        # Only the two 20 byte files share a size, and their head/tail hashes differ
+        self.assertIn('Scrubbed 3 stored objects', output)
+        self.assertIn('0 fully hashed, 0 mismatched', output)
+        self.assertIn('3 fully hashed, 0 mismatched', self.scrub('--full'))
+
+    def test_missing_and_orphaned_files(self):
+        file = self.upload(b'content', 'a.txt')
+        os.remove(file.blob.file.path)
+        orphan = os.path.join(MEDIA_ROOT, 'blobs', 'orphan')
+        with open(orphan, 'wb') as f:
+            f.write(b'left behind')
+        # Recent files may belong to an upload still in progress
+        self.assertIn('0 orphaned', self.scrub())
+        os.utime(orphan, (time.time() - 2 * 60 * 60,) * 2)
+
+        output = self.scrub('--delete-orphans')
+
+        self.assertIn(f'missing: {file.blob.file.name}', output)
+        self.assertIn('orphaned: blobs/orphan', output)
+        self.assertFalse(os.path.exists(orphan))
+
+    def test_repair_rehashes_content_that_changed_on_disk(self):
+        file = self.upload(b'original', 'a.txt')
+        other = self.upload(b'replaced', 'b.txt')
+        with open(file.blob.file.path, 'wb') as f:
+            f.write(b'replaced')
+
+        output = self.scrub('--repair')
+
+        self.assertIn('1 mismatched, 1 repaired', output)
+        file.refresh_from_db()
+        # The content now matches another blob, which both files share
+        self.assertEqual((file.file_hash, file.blob_id), (other.file_hash, other.blob_id))
+        self.assertEqual(Blob.objects.get(pk=other.blob_id).ref_count, 2)
+        self.assertEqual(DuplicateGroup.objects.get(file_hash=other.file_hash).file_count, 2)
+
+
+class BackfillTests(VaultTestCase):
+    def legacy_file(self, name, content):
+        """A file stored before hashing existed: its own bytes and no hash"""
+        path = os.path.join(MEDIA_ROOT, 'uploads', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if content is not None:
+            with open(path, 'wb') as f:
+                f.write(content)
+        return File.objects.bulk_create([File(
+            file=f'uploads/{name}', original_filename=name, file_type='text/plain', size=len(content or b''),
+        )])[0]
+
+    def test_missing_hashes_are_filled_in_batches(self):
+        files = [self.legacy_file(f'{i}.txt', b'same' if i < 3 else f'{i}'.encode()) for i in range(5)]
+        unreadable = self.legacy_file('gone.txt', None)
+        batches = []
+
+        totals = backfill_file_hashes(batch_size=2, workers=2, progress=batches.append)
+
+        self.assertEqual((totals['hashed'], totals['failed'], totals['remaining']), (5, 1, 0))
+        self.assertEqual(len(batches), 3)
+        for file in files:
+            file.refresh_from_db()
+            with open(file.file.path, 'rb') as f:
+                self.assertEqual(file.file_hash, hashlib.sha256(f.read()).hexdigest())
+        self.assertIsNone(File.objects.get(pk=unreadable.pk).file_hash)
+        same = hashlib.sha256(b'same').hexdigest()
+        self.assertEqual(DuplicateGroup.objects.get(file_hash=same).file_count, 3)
+
+    def test_hashing_invalidates_cached_responses(self):
+        self.legacy_file('a.txt', b'content')
+        version = caching.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            backfill_file_hashes()
+        self.assertNotEqual(caching.version(), version)
+
+    def test_resumes_after_a_file_id(self):
+        files = sorted([self.legacy_file(f'{i}.txt', f'{i}'.encode()) for i in range(3)], key=lambda f: str(f.pk))
+
+        totals = backfill_file_hashes(after=str(files[0].pk))
+
+        self.assertEqual(totals['hashed'], 2)
+        self.assertEqual(File.objects.filter(file_hash__isnull=True).get().pk, files[0].pk)
+
+
+def stored_chunks():
+    return {
+        os.path.join(root, name)
+        for root, _, names in os.walk(os.path.join(MEDIA_ROOT, 'chunks')) for name in names
+    }
+
+
+class ChunkingTests(SimpleTestCase):
+    def chunks(self, data, read_size=chunking.READ_SIZE):
+        with mock.patch.object(chunking, 'READ_SIZE', read_size):
+            return list(chunking.iter_chunks(io.BytesIO(data)))
+
+    def test_chunks_reassemble_within_the_size_bounds(self):
+        data = os.urandom(3 * 1024 * 1024)
+        chunks = self.chunks(data)
+        self.assertEqual(b''.join(chunks), data)
+        self.assertTrue(all(len(chunk) <= chunking.MAX_CHUNK_SIZE for chunk in chunks))
+        self.assertTrue(all(len(chunk) >= chunking.MIN_CHUNK_SIZE for chunk in chunks[:-1]))
+
+    def test_boundaries_do_not_depend_on_the_read_size(self):
+        data = os.urandom(2 * 1024 * 1024)
+        self.assertEqual(self.chunks(data, read_size=300 * 1024), self.chunks(data))
+
+    def test_an_insertion_only_changes_nearby_chunks(self):
+        data = os.urandom(2 * 1024 * 1024)
+        before = self.chunks(data)
+        after = self.chunks(data[:1000] + b'inserted' + data[1000:])
+        self.assertGreaterEqual(len(set(before) & set(after)), len(before) - 2)
+
+    def test_empty_stream(self):
+        self.assertEqual(self.chunks(b''), [])
+
+
+class ChunkBlobTests(VaultTestCase):
+    def test_blobs_are_stored_as_shared_chunks(self):
+        shared = os.urandom(1024 * 1024)
+        first = self.upload(shared + os.urandom(512 * 1024), 'a.bin')
+        second = self.upload(shared + os.urandom(512 * 1024), 'b.bin')
+        path = first.blob.file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = chunk_blob(first.blob_id)
+            chunk_blob(second.blob_id)
+
+        self.assertEqual(result['new_chunk_bytes'], result['size'])
+        first.refresh_from_db()
+        self.assertTrue(first.blob.chunked)
+        self.assertEqual((first.file.name, first.blob.file.name), ('', ''))
+        self.assertFalse(os.path.exists(path))
+        # The common prefix is stored once
+        self.assertTrue(Chunk.objects.filter(ref_count=2).exists())
+        for file in [first, second]:
+            with File.objects.get(pk=file.pk).open_content() as content:
+                self.assertEqual(hashlib.sha256(content.read()).hexdigest(), file.file_hash)
+        self.assertEqual(chunk_blob(first.blob_id), {'blob_id': first.blob_id, 'skipped': True})
+
+    def test_deleting_a_chunked_blob_releases_its_chunks(self):
+        file = self.upload(os.urandom(512 * 1024), 'a.bin')
+        chunk_blob(file.blob_id)
+        paths = [chunk.file.path for chunk in Chunk.objects.all()]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            file.delete()
+
+        self.assertFalse(Chunk.objects.exists())
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_a_failed_conversion_releases_the_chunks_it_took(self):
+        existing = self.upload(b'x' * 300 * 1024, 'existing.bin')
+        chunk_blob(existing.blob_id)
+        held = {chunk.pk: chunk.ref_count for chunk in Chunk.objects.all()}
+        file = self.upload(b'x' * 300 * 1024 + os.urandom(512 * 1024), 'a.bin')
+        iter_chunks = chunking.iter_chunks
+
+        def fail_part_way(content):
+            chunks = iter_chunks(content)
+            yield next(chunks)
+            yield next(chunks)
+            raise OSError('read failed')
+
+        with mock.patch.object(chunking, 'iter_chunks', fail_part_way):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(OSError):
+                    chunk_blob(file.blob_id)
+
+        self.assertEqual({chunk.pk: chunk.ref_count for chunk in Chunk.objects.all()}, held)
+        self.assertEqual(stored_chunks(), {chunk.file.path for chunk in Chunk.objects.all()})
+        file.blob.refresh_from_db()
+        self.assertFalse(file.blob.chunked)
+
+
+class CodecTests(SimpleTestCase):
+    def test_codecs_round_trip(self):
+        data = b'compressible line\n' * 10000
+        for codec in ['gzip', 'xz']:
+            with self.subTest(codec=codec):
+                compressed = io.BytesIO()
+                coldstorage.compress_stream(io.BytesIO(data), compressed, codec)
+                self.assertLess(compressed.tell(), len(data) // 10)
+                compressed.seek(0)
+                with coldstorage.open_decoded(compressed, codec) as decoded:
+                    self.assertEqual(decoded.read(), data)
+
+    def test_only_compressible_samples_are_worth_compressing(self):
+        self.assertTrue(coldstorage.worth_compressing(b'a' * 10000, 'gzip'))
+        self.assertFalse(coldstorage.worth_compressing(os.urandom(10000), 'gzip'))
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ImproperlyConfigured):
+            coldstorage.check_codec('rar')
+
+
+@override_settings(COLD_STORAGE_ENABLED=True, COLD_STORAGE_CODEC='gzip', COLD_STORAGE_AFTER=60 * 60,
+                   COLD_STORAGE_MIN_SIZE=1024)
+class ColdStorageTests(VaultTestCase):
+    TEXT = b'a line of log output that repeats\n' * 5000
+
+    def age(self, *files):
+        File.objects.filter(pk__in=[file.pk for file in files]).update(
+            uploaded_at=timezone.now() - timedelta(hours=2),
+        )
+
+    def test_cold_compressible_blobs_are_compressed(self):
+        file = self.upload(self.TEXT, 'app.log')
+        path = file.blob.file.path
+        self.assertEqual(compress_cold_blobs()['blobs_compressed'], 0)
+        self.age(file)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = compress_cold_blobs()
+
+        self.assertEqual(result['blobs_compressed'], 1)
+        file.refresh_from_db()
+        self.assertEqual(file.blob.codec, 'gzip')
+        self.assertEqual(result['bytes_saved'], len(self.TEXT) - file.blob.stored_size)
+        self.assertFalse(os.path.exists(path))
+        with file.open_content() as content:
+            self.assertEqual(content.read(), self.TEXT)
+        response = self.client.get(f'/api/files/{file.pk}/')
+        self.assertEqual((response.data['codec'], response.data['stored_size']), ('gzip', file.blob.stored_size))
+        self.assertEqual(self.client.get('/api/files/storage/').data['bytes_saved'], result['bytes_saved'])
+
+    def test_recently_read_and_incompressible_blobs_are_left_alone(self):
+        read = self.upload(self.TEXT, 'read.log')
+        noise = self.upload(os.urandom(len(self.TEXT)), 'noise.txt')
+        image = self.upload(self.TEXT, 'picture.png', 'image/png')
+        self.age(read, noise, image)
+        File.objects.filter(pk=read.pk).update(last_accessed_at=timezone.now())
+
+        self.assertEqual(compress_cold_blobs()['blobs_compressed'], 0)
+        self.assertFalse(Blob.objects.exclude(codec='').exists())
+
+    @override_settings(COLD_STORAGE_ENABLED=False)
+    def test_disabled(self):
+        self.age(self.upload(self.TEXT, 'app.log'))
+        self.assertEqual(compress_cold_blobs(), {'skipped': True})
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_ignored_headers(self):
+        for header in [None, '', 'items=0-1', 'bytes=abc', 'bytes=-', 'bytes=5-1', 'bytes=0-1,x']:
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+    def test_too_many_ranges_are_ignored(self):
+        header = 'bytes=' + ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_range(header, 1000))
+
+    def test_single_ranges(self):
+        cases = {
+            'bytes=0-99': [(0, 100)],
+            'bytes=500-': [(500, 1000)],
+            'bytes=-100': [(900, 1000)],
+            'bytes=-2000': [(0, 1000)],
+            'bytes=0-2000': [(0, 1000)],
+            'bytes=999-999': [(999, 1000)],
+            'BYTES = 0 - 0': [(0, 1)],
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 1000), expected)
+
+    def test_unsatisfiable_ranges(self):
+        for header, size in [('bytes=1000-', 1000), ('bytes=-0', 1000), ('bytes=-5', 0), ('bytes=0-', 0)]:
+            with self.subTest(header=header, size=size):
+                self.assertEqual(parse_range(header, size), [])
+
+    def test_ranges_are_sorted_and_coalesced(self):
+        self.assertEqual(parse_range('bytes=30-40,0-10,5-20', 1000), [(0, 21), (30, 41)])
+        self.assertEqual(parse_range('bytes=0-9,10-19', 1000), [(0, 20)])
+        self.assertEqual(parse_range('bytes=0-9,2000-', 1000), [(0, 10)])
+
+
+class DownloadTests(VaultTestCase):
+    CONTENT = bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        self.file = self.upload(self.CONTENT, 'data.bin', 'application/octet-stream')
+        self.url = f'/api/files/{self.file.pk}/download/'
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.CONTENT)
+        self.assertEqual(response['ETag'], f'"{self.file.file_hash}"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment; filename="data.bin"', response['Content-Disposition'])
+        self.assertIn('inline', self.client.get(self.url, {'inline': '1'})['Content-Disposition'])
+
+    def test_single_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(self.body(response), self.CONTENT[10:20])
+
+    def test_multiple_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,100-101')
+        body = self.body(response)
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn(b'Content-Range: bytes 0-1/1024\r\n\r\n' + self.CONTENT[0:2], body)
+        self.assertIn(b'Content-Range: bytes 100-101/1024\r\n\r\n' + self.CONTENT[100:102], body)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_conditional_requests(self):
+        etag = f'"{self.file.file_hash}"'
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # A stale If-Range gets the whole file rather than a range of the wrong content
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+    def test_ranges_of_chunked_content(self):
+        content = os.urandom(600 * 1024)
+        file = self.upload(content, 'big.bin')
+        chunk_blob(file.blob_id)
+        response = self.client.get(f'/api/files/{file.pk}/download/', HTTP_RANGE='bytes=300000-400000')
+        self.assertEqual(self.body(response), content[300000:400001])
+
+    @override_settings(FILE_DOWNLOAD_OFFLOAD='x-accel-redirect', FILE_DOWNLOAD_ACCEL_PREFIX='/protected/')
+    def test_offloaded_to_the_proxy(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.file.blob.file.name}')
+        self.assertEqual(response.content, b'')
+
+    def test_reads_are_recorded(self):
+        self.client.get(self.url)
+        self.file.refresh_from_db()
+        self.assertIsNotNone(self.file.last_accessed_at)
+
+
+class SearchTests(VaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.upload(b'1', 'Q3-report.pdf', 'application/pdf')
+        self.upload(b'2', 'quarterly report draft.docx', 'application/msword')
+        self.upload(b'3', 'holiday photo.jpg', 'image/jpeg')
+
+    def search(self, text, **params):
+        # Rows are changed behind the response cache's back here
+        caches['default'].clear()
+        response = self.client.get('/api/files/', {'search': text, **params})
+        return [row['original_filename'] for row in response.data['results']]
+
+    def test_words_and_word_prefixes_match(self):
+        self.assertEqual(sorted(self.search('rep')), ['Q3-report.pdf', 'quarterly report draft.docx'])
+        self.assertEqual(self.search('report draft'), ['quarterly report draft.docx'])
+        self.assertEqual(self.search('image'), ['holiday photo.jpg'])
+        self.assertEqual(self.search('port'), [])
+        self.assertEqual(len(self.search('!!')), 3)
+
+    def test_relevance_ranks_filename_matches_first(self):
+        self.upload(b'4', 'notes.txt', 'text/report')
+        self.assertEqual(self.search('report', sortBy='relevance')[-1], 'notes.txt')
+
+    def test_index_follows_renames_and_deletes(self):
+        file = File.objects.get(original_filename='holiday photo.jpg')
+        File.objects.filter(pk=file.pk).update(original_filename='beach.jpg')
+        self.assertEqual(self.search('holiday'), [])
+        self.assertEqual(self.search('beach'), ['beach.jpg'])
+
+        file.delete()
+        self.assertEqual(self.search('beach'), [])
+
+    def test_index_does_not_depend_on_the_files_tables_rowids(self):
+        # VACUUM may renumber the implicit rowids of a table without an INTEGER PRIMARY KEY
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE files_file SET rowid = rowid + 1000')
+        self.assertEqual(self.search('holiday'), ['holiday photo.jpg'])
+
+        File.objects.get(original_filename='holiday photo.jpg').delete()
+        self.assertEqual(self.search('holiday'), [])
+        self.assertEqual(len(self.search('rep')), 2)
+
+
+class KeysetPaginationTests(VaultTestCase):
+    SORTS = ['', 'name', 'size', 'date', 'type']
+    ORDERINGS = {
+        '': '-uploaded_at',
+        'name': 'original_filename',
+        'size': '-size',
+        'date': '-uploaded_at',
+        'type': 'file_type',
+    }
+
+    def setUp(self):
+        super().setUp()
+        types = ['text/plain', 'image/png', 'application/pdf']
+        for i in range(23):
+            # Repeated names, sizes, types and upload times, so pages break inside ties
+            self.upload(f'{i:02d}'.encode() * (i % 4 + 1), f'name-{i % 5}.txt', types[i % 3])
+        File.objects.filter(original_filename='name-1.txt').update(uploaded_at=timezone.now())
+
+    def walk(self, params):
+        """Follow next links from the first page, then previous links back from the last"""
+        response = self.client.get('/api/files/', {**params, 'page_size': 4})
+        self.assertIsNone(response.data['previous'])
+        pages = [[row['id'] for row in response.data['results']]]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append([row['id'] for row in response.data['results']])
+
+        backwards = [pages[-1]]
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            backwards.insert(0, [row['id'] for row in response.data['results']])
+        return pages, backwards
+
+    def test_pages_cover_every_sort_in_order(self):
+        for sort in self.SORTS:
+            with self.subTest(sort=sort):
+                pages, _ = self.walk({'sortBy': sort} if sort else {})
+                ordering = self.ORDERINGS[sort]
+                tie_breaker = '-id' if ordering.startswith('-') else 'id'
+                expected = [str(pk) for pk in File.objects.order_by(ordering, tie_breaker).values_list('pk', flat=True)]
+                self.assertEqual([pk for page in pages for pk in page], expected)
+                self.assertTrue(all(len(page) == 4 for page in pages[:-1]))
+
+    def test_previous_links_retrace_the_same_pages(self):
+        for sort in self.SORTS:
+            with self.subTest(sort=sort):
+                pages, backwards = self.walk({'sortBy': sort} if sort else {})
+                self.assertEqual(
+                    [pk for page in backwards for pk in page],
+                    [pk for page in pages for pk in page],
+                )
+
+    def test_invalid_cursor(self):
+        for cursor in ['not-base64!', 'bnVsbA==', 'eyJwb3NpdGlvbiI6IFsxXX0=']:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get('/api/files/', {'cursor': cursor}).status_code, 404)
+
+
+class StatisticsTests(VaultTestCase):
+    def assertMatchesRebuild(self):
+        """The incrementally maintained counters equal a recount"""
+        counters = stats.read()
+        stats.rebuild()
+        self.assertEqual({name: value for name, value in stats.read().items() if value},
+                         {name: value for name, value in counters.items() if value})
+
+    def test_uploads_and_deletes_are_counted(self):
+        first = self.upload(b'twice', 'a.txt')
+        self.upload(b'twice', 'b.txt')
+        self.upload(b'image', 'c.png', 'image/png')
+
+        snapshot = self.client.get('/api/files/stats/').data
+        self.assertEqual((snapshot['total_files'], snapshot['total_bytes']), (3, 15))
+        self.assertEqual(snapshot['categories']['documents'], {'files': 2, 'bytes': 10})
+        self.assertEqual(snapshot['categories']['images'], {'files': 1, 'bytes': 5})
+        self.assertEqual((snapshot['duplicate_bytes'], snapshot['reclaimable_bytes']), (10, 5))
+        self.assertMatchesRebuild()
+
+        first.delete()
+
+        snapshot = stats.snapshot()
+        self.assertEqual((snapshot['total_files'], snapshot['total_bytes']), (2, 10))
+        self.assertEqual((snapshot['duplicate_bytes'], snapshot['reclaimable_bytes']), (0, 0))
+        self.assertMatchesRebuild()
+
+    @override_settings(STATS_COUNTER_SLOTS=4)
+    def test_counters_are_summed_over_their_slots(self):
+        for i in range(20):
+            self.upload(f'{i:02d}'.encode(), f'{i}.txt')
+        self.assertGreater(StatCounter.objects.filter(name=stats.FILES).count(), 1)
+        self.assertEqual(stats.snapshot()['total_files'], 20)
+        self.assertMatchesRebuild()
+
+
+class BatchUploadTests(VaultTestCase):
+    def batch_upload(self, *contents):
+        uploads = [SimpleUploadedFile(f'{i}.txt', content, 'text/plain') for i, content in enumerate(contents)]
+        return self.client.post('/api/files/batch_upload/', {'files': uploads}, format='multipart')
+
+    def test_files_are_created_in_order_sharing_blobs(self):
+        response = self.batch_upload(b'same', b'other', b'same')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([row['original_filename'] for row in response.data], ['0.txt', '1.txt', '2.txt'])
+        files = [File.objects.get(pk=row['id']) for row in response.data]
+        self.assertEqual(files[0].blob_id, files[2].blob_id)
+        self.assertEqual(Blob.objects.get(pk=files[0].blob_id).ref_count, 2)
+        with files[1].open_content() as content:
+            self.assertEqual(content.read(), b'other')
+
+    def test_content_already_stored_is_referenced(self):
+        existing = self.upload(b'same', 'existing.txt')
+        response = self.batch_upload(b'same', b'same')
+        self.assertEqual({File.objects.get(pk=row['id']).blob_id for row in response.data}, {existing.blob_id})
+        self.assertEqual(Blob.objects.get(pk=existing.blob_id).ref_count, 3)
+
+    def test_files_are_counted(self):
+        self.batch_upload(b'same', b'same', b'same', b'other')
+
+        self.assertEqual(DuplicateGroup.objects.get(file_hash=hashlib.sha256(b'same').hexdigest()).file_count, 3)
+        snapshot = stats.snapshot()
+        self.assertEqual((snapshot['total_files'], snapshot['reclaimable_bytes']), (4, 8))
+
+    def test_all_or_nothing(self):
+        with mock.patch('dedup.index.files_added', side_effect=RuntimeError('index unavailable')):
+            with self.assertRaises(RuntimeError):
+                self.batch_upload(b'batch one', b'batch two')
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(stored_copies(b'batch one') + stored_copies(b'batch two'), [])
+
+    def test_no_files(self):
+        self.assertEqual(self.client.post('/api/files/batch_upload/', {}, format='multipart').status_code, 400)
+
+
+class BatchDeleteTests(VaultTestCase):
+    def batch_delete(self, *files):
+        # The purge is queued on commit; tests run it themselves
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(
+                '/api/files/batch_delete/', {'file_ids': [str(file.pk) for file in files]}, format='json',
+            )
+        return response, callbacks
+
+    def test_files_disappear_before_the_purge(self):
+        first = self.upload(b'thrice', 'a.txt')
+        self.upload(b'thrice', 'b.txt')
+        self.upload(b'thrice', 'c.txt')
+        single = self.upload(b'single', 'd.txt')
+
+        with mock.patch.object(purge_deleted_files, 'delay') as purge:
+            response, callbacks = self.batch_delete(first, single)
+            for callback in callbacks:
+                callback()
+
+        self.assertEqual(response.status_code, 202)
+        purge.assert_called_once_with()
+        self.assertTrue(File.all_objects.filter(pk=first.pk).exists())
+        self.assertFalse(File.objects.filter(pk__in=[first.pk, single.pk]).exists())
+        self.assertEqual(self.client.get(f'/api/files/{first.pk}/').status_code, 404)
+        self.assertEqual(DuplicateGroup.objects.get(file_hash=first.file_hash).file_count, 2)
+        snapshot = stats.snapshot()
+        self.assertEqual((snapshot['total_files'], snapshot['reclaimable_bytes']), (2, 6))
+
+    def test_deleted_files_are_uncounted_once(self):
+        first = self.upload(b'thrice', 'a.txt')
+        second = self.upload(b'thrice', 'b.txt')
+        self.upload(b'thrice', 'c.txt')
+
+        self.batch_delete(first)
+        response, callbacks = self.batch_delete(second, first)
+
+        self.assertEqual(response.data['message'], '1 files deleted successfully')
+        self.assertEqual(DuplicateGroup.objects.get(file_hash=first.file_hash).file_count, 1)
+        self.assertEqual(stats.snapshot()['total_files'], 1)
+
+        purge_deleted_files()
+
+        self.assertFalse(File.all_objects.filter(deleted_at__isnull=False).exists())
+        self.assertEqual(DuplicateGroup.objects.get(file_hash=first.file_hash).file_count, 1)
+        self.assertEqual(stats.snapshot()['total_files'], 1)
+
+    def test_purge_releases_the_blobs_of_deleted_files(self):
+        kept = self.upload(b'kept', 'a.txt')
+        self.upload(b'kept', 'b.txt')
+        dropped = self.upload(b'dropped', 'c.txt')
+        dropped_path = dropped.blob.file.path
+
+        self.batch_delete(kept, dropped)
+        self.assertEqual(Blob.objects.get(pk=kept.blob_id).ref_count, 2)
+
+        self.assertEqual(purge_deleted_files(), {'files_purged': 2, 'files_unlinked': 1})
+        self.assertEqual(Blob.objects.get(pk=kept.blob_id).ref_count, 1)
+        self.assertFalse(Blob.objects.filter(pk=dropped.blob_id).exists())
+        self.assertFalse(os.path.exists(dropped_path))
+
+    def test_unknown_or_missing_ids(self):
+        self.assertEqual(self.client.post('/api/files/batch_delete/', {}, format='json').status_code, 400)
+        response, callbacks = self.batch_delete(File(pk='0' * 32))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(callbacks, [])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], DATABASE_REPLICA_MAX_LAG=10)
+class ReplicaCacheMissTests(VaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file = self.upload(b'one', 'one.txt')
+        self.replica_reads = []
+        patcher = mock.patch.object(caching, 'replica_reads', self.record_replica_read)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @contextmanager
+    def record_replica_read(self):
+        # The test database has no replica; note the read and serve it from the primary
+        self.replica_reads.append(caching.version())
+        yield
+
+    def list_files(self, query=''):
+        return self.client.get(f'/api/files/{query}').data
+
+    def test_misses_are_served_by_a_replica(self):
+        self.list_files()
+        self.list_files()
+        self.assertEqual(len(self.replica_reads), 1)
+        self.assertEqual(caching.counters()['hits'], 1)
+
+    def test_misses_just_after_a_write_read_the_primary(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file.delete()
+        self.assertEqual(self.list_files()['results'], [])
+        self.assertEqual(self.replica_reads, [])
+
+        caching.get_cache().delete(caching.RECENT_BUMP_KEY)  # The lag window has passed
+        self.list_files('?sort=name')
+        self.assertEqual(len(self.replica_reads), 1)
+
+    def test_responses_read_before_a_bump_are_not_stored(self):
+        record = caching.replica_reads
+
+        @contextmanager
+        def write_during_read():
+            with record():
+                yield
+            caching._bump()
+
+        cache = caching.get_cache()
+        with mock.patch.object(caching, 'replica_reads', write_during_read), \
+                mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.list_files()
+        stored = [call.args[0] for call in cache_set.call_args_list]
+        self.assertFalse([key for key in stored if key.startswith('vault:response:')], stored)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_misses_read_the_primary(self):
+        self.list_files()
+        self.assertEqual(self.replica_reads, [])
+
+
+class ResponseCacheTests(VaultTestCase):
+    def list_names(self):
+        return sorted(row['original_filename'] for row in self.client.get('/api/files/').data['results'])
+
+    def test_repeated_reads_are_served_from_the_cache(self):
+        self.upload(b'one', 'one.txt')
+        self.list_names()
+        before = caching.counters()
+        self.list_names()
+        after = caching.counters()
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['misses'], before['misses'])
+
+    def test_uploads_invalidate_cached_responses(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(b'one', 'one.txt')
+        self.assertEqual(self.list_names(), ['one.txt'])
+        self.assertEqual(self.client.get('/api/files/stats/').data['total_files'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(b'two', 'two.txt')
+        self.assertEqual(self.list_names(), ['one.txt', 'two.txt'])
+        self.assertEqual(self.client.get('/api/files/stats/').data['total_files'], 2)
+
+    def test_deletes_invalidate_cached_responses(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            file = self.upload(b'one', 'one.txt')
+            self.upload(b'two', 'two.txt')
+        self.assertEqual(self.list_names(), ['one.txt', 'two.txt'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            file.delete()
+        self.assertEqual(self.list_names(), ['two.txt'])
+
+    def test_uncommitted_changes_do_not_bump_the_version(self):
+        version = caching.version()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.upload(b'one', 'one.txt')
+        self.assertEqual(caching.version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(caching.version(), version)
+
+    def test_cache_counters_endpoint(self):
+        self.list_names()
+        self.list_names()
+        self.assertEqual(self.client.get('/api/files/cache/').data, {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_views_run_uncached_while_redis_is_unreachable(self):
+        self.addCleanup(setattr, caching, '_unavailable_until', 0.0)
+        self.addCleanup(setattr, caching, '_missed_bump', False)
+        self.upload(b'one', 'one.txt')
+        cache = caching.get_cache()
+        with mock.patch.object(cache, 'get_many', side_effect=redis.RedisError('down')), \
+                self.assertLogs('files.caching', 'WARNING'):
+            self.assertEqual(self.list_names(), ['one.txt'])
+        self.assertFalse(caching._available())
+
+        # Bumps lost meanwhile start a new version once Redis is back
+        version = caching.version()
+        caching._bump()
+        caching._unavailable_until = 0.0
+        self.assertNotEqual(caching.version(), version)
+
+
+class StreamingASGIHandlerTests(VaultTestCase):
+    def request(self, method, path, body=b'', content_type=None, chunk_size=64 * 1024):
+        """Send a request through the handler in body chunks, returning the messages sent back"""
+        headers = [(b'content-length', str(len(body)).encode())]
+        if content_type:
+            headers.append((b'content-type', content_type.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': method, 'path': path, 'query_string': b'', 'headers': headers,
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 1234),
+        }
+        messages = [
+            {'type': 'http.request', 'body': body[i:i + chunk_size], 'more_body': i + chunk_size < len(body)}
+            for i in range(0, max(len(body), 1), chunk_size)
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(StreamingASGIHandler())(scope, receive, send)
+        return sent
+
+    def test_uploads_are_spooled_before_the_view_runs(self):
+        content = os.urandom(3 * WRITE_SIZE + 5)
+        body = encode_multipart(BOUNDARY, {'file': SimpleUploadedFile('big.bin', content)})
+        sent = self.request('POST', '/api/files/', body, MULTIPART_CONTENT)
+
+        self.assertEqual(sent[0]['status'], 201)
+        file = File.objects.get()
+        self.assertEqual(file.size, len(content))
+        with file.open_content() as stored:
+            self.assertEqual(stored.read(), content)
+
+    def test_downloads_are_sent_block_by_block(self):
+        content = os.urandom(2 * BLOCK_SIZE + 5)
+        file = self.upload(content, 'big.bin', 'application/octet-stream')
+
+        sent = self.request('GET', f'/api/files/{file.pk}/download/')
+
+        self.assertEqual(sent[0]['status'], 200)
+        bodies = [message['body'] for message in sent[1:] if message.get('body')]
+        self.assertGreater(len(bodies), 1)
+        self.assertEqual(b''.join(bodies), content)
+
+    def test_disconnect_before_the_body_arrives(self):
+        messages = [{'type': 'http.request', 'body': b'partial', 'more_body': True}, {'type': 'http.disconnect'}]
+
+        async def receive():
+            return messages.pop(0)
+
+        with self.assertRaises(RequestAborted):
+            async_to_sync(StreamingASGIHandler().read_body)(receive)
+
+    @override_settings(ASGI_MAX_CONCURRENT_VIEWS=2)
+    def test_views_wait_for_a_slot(self):
+        running = []
+        peak = 0
+
+        async def view(handler, request):
+            nonlocal peak
+            running.append(request)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.01)
+            running.remove(request)
+
+        async def serve_all(handler):
+            await asyncio.gather(*(handler.get_response_async(number) for number in range(5)))
+
+        with mock.patch('django.core.handlers.asgi.ASGIHandler.get_response_async', view):
+            async_to_sync(serve_all)(StreamingASGIHandler())
+        self.assertEqual(peak, 2)
+
+
+class BenchmarkTests(VaultTestCase):
+    def test_refuses_to_run_against_the_real_database(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark', stderr=io.StringIO())
+
+    def test_small_run(self):
+        root = tempfile.mkdtemp(dir=MEDIA_ROOT)
+        output = os.path.join(MEDIA_ROOT, 'results.json')
+        with override_settings(BENCHMARK_ROOT=root):
+            call_command('benchmark', rows=[40, 20], uploads=3, upload_size=1000, hash_size=100_000,
+                         repeat=2, output=output, stderr=io.StringIO())
+
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(list(results['vaults']), ['20', '40'])
+        vault = results['vaults']['40']
+        self.assertEqual(vault['rows'], 40)
+        self.assertEqual(set(vault['list']), set(LIST_SCENARIOS))
+        self.assertEqual(vault['create']['runs'], 3)
+        self.assertGreater(results['hashing']['hash_path']['mib_per_s'], 0)
+        self.assertFalse(os.path.exists(root))
+
+
+class BenchmarkComparisonTests(SimpleTestCase):
+    def compare(self, baseline, results):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'baseline.json')
+        with open(path, 'w') as f:
+            json.dump(baseline, f)
+        command = BenchmarkCommand(stderr=io.StringIO())
+        command.compare(results, path, tolerance=0.25)
+        return command.stderr.getvalue()
+
+    def results(self, p50_ms, queries, mib_per_s):
+        return {
+            'meta': {'options': {'rows': [10], 'seed': 0}},
+            'hashing': {'hash_path': {'mib_per_s': mib_per_s}},
+            'vaults': {'10': {'list': {'default': {'p50_ms': p50_ms, 'queries': queries}}}},
+        }
+
+    def test_within_tolerance(self):
+        self.assertIn('No regressions', self.compare(self.results(10, 3, 100), self.results(12, 3, 90)))
+
+    def test_regressions(self):
+        with self.assertRaises(CommandError) as raised:
+            self.compare(self.results(10, 3, 100), self.results(13, 4, 70))
+        message = str(raised.exception)
+        for path in ['vaults.10.list.default.p50_ms', 'vaults.10.list.default.queries', 'hashing.hash_path.mib_per_s']:
+            self.assertIn(path, message)
+
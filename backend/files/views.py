@@ -1,25 +1,29 @@
 from django.shortcuts import render
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.decorators import action
-from django.db.models import Q
-from .models import File
-from .serializers import FileSerializer
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from . import batch, caching, downloads, stats
+from .categories import filter_by_category
+from .pagination import KeysetPagination
+from .models import Blob, File, UploadChunk, UploadSession, blob_writes
+from .search import search as search_files
+from .serializers import FileProbeSerializer, FileSerializer, UploadSessionSerializer
+from .tasks import purge_deleted_files
 
-from django.db.models.signals import post_delete
-from .signals import invalidate_and_rerun_dedup_jobs
-from dedup.tasks import deduplicate_files
+from dedup import index
 
 # Create your views here.
 
-class FilePagination(PageNumberPagination):
+class FilePagination(KeysetPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
 
 class FileViewSet(viewsets.ModelViewSet):
-    queryset = File.objects.all()
+    queryset = File.objects.select_related('blob')
     serializer_class = FileSerializer
     pagination_class = FilePagination
 
@@ -37,11 +41,40 @@ class FileViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        # Digest computed by the upload handler while the body was received
+        serializer.save(file_hash=getattr(file_obj, 'sha256', None))
         
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
     
+    @action(detail=False, methods=['post'])
+    def batch_upload(self, request, *args, **kwargs):
+        """
+        Upload many files in one multipart request, each sent as a 'files' field.
+
+        All the files are stored in one transaction: either every file is
+        created or none is.
+        """
+        uploads = request.FILES.getlist('files')
+        if not uploads:
+            return Response({'error': 'No files provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer(data=[
+            {
+                'file': upload,
+                'original_filename': upload.name,
+                'file_type': upload.content_type,
+                'size': upload.size,
+            }
+            for upload in uploads
+        ], many=True)
+        serializer.is_valid(raise_exception=True)
+
+        files = batch.create_files(uploads)
+        serializer = self.get_serializer(files, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @caching.cached_response
     def list(self, request, *args, **kwargs):
         # Get query parameters
         search = request.query_params.get('search', '')
@@ -51,59 +84,13 @@ class FileViewSet(viewsets.ModelViewSet):
         # Start with base queryset
         queryset = self.get_queryset()
         
-        # Apply search filter
+        # Apply search filter through the full-text index
         if search:
-            queryset = queryset.filter(
-                Q(original_filename__icontains=search) |
-                Q(file_type__icontains=search)
-            )
+            queryset = search_files(queryset, search)
         
         # Apply file type filter
         if file_type and file_type != 'all':
-            # Map frontend filter types to file extensions
-            file_type_mapping = {
-                'images': [
-                    'image/jpeg', 'image/jpg', 'image/png', 'image/gif', 
-                    'image/bmp', 'image/svg+xml', 'image/webp', 'image/tiff'
-                ],
-                'documents': [
-                    'application/pdf', 'application/msword', 
-                    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                    'text/plain', 'application/rtf', 'application/vnd.oasis.opendocument.text',
-                    'application/vnd.ms-excel', 
-                    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    'application/vnd.ms-powerpoint', 
-                    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-                    'text/csv', 'application/vnd.oasis.opendocument.spreadsheet',
-                    'application/vnd.oasis.opendocument.presentation'
-                ],
-                'videos': [
-                    'video/mp4', 'video/avi', 'video/quicktime', 'video/x-msvideo',
-                    'video/x-flv', 'video/webm', 'video/x-matroska', 'video/mpeg',
-                    'video/3gpp', 'video/x-ms-wmv'
-                ],
-                'audio': [
-                    'audio/mpeg', 'audio/wav', 'audio/flac', 'audio/aac',
-                    'audio/ogg', 'audio/x-ms-wma', 'audio/mp3', 'audio/x-wav',
-                    'audio/vorbis', 'audio/mp4'
-                ],
-                'archives': [
-                    'application/zip', 'application/x-rar-compressed', 
-                    'application/x-7z-compressed', 'application/x-tar',
-                    'application/gzip', 'application/x-bzip2', 'application/x-compress',
-                    'application/x-compressed', 'application/x-zip-compressed'
-                ]
-            }
-            
-            if file_type in file_type_mapping:
-                file_extensions = file_type_mapping[file_type]
-                queryset = queryset.filter(file_type__in=file_extensions)
-            elif file_type == 'other':
-                # Filter out known file types
-                all_known_types = []
-                for types in file_type_mapping.values():
-                    all_known_types.extend(types)
-                queryset = queryset.exclude(file_type__in=all_known_types)
+            queryset = filter_by_category(queryset, file_type)
         
         # Apply sorting
         sort_mapping = {
@@ -113,7 +100,9 @@ class FileViewSet(viewsets.ModelViewSet):
             'type': 'file_type'
         }
         
-        if sort_by in sort_mapping:
+        if sort_by == 'relevance' and search:
+            queryset = queryset.order_by('search_rank', '-uploaded_at')
+        elif sort_by in sort_mapping:
             queryset = queryset.order_by(sort_mapping[sort_by])
         else:
             queryset = queryset.order_by('-uploaded_at')  # Default sort
@@ -128,26 +117,183 @@ class FileViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        Serve a file's content with Range and conditional request support.
+
+        Pass ``?inline=1`` to let the browser display it (e.g. to play video).
+        """
+        file = self.get_object()
+        file.mark_accessed()
+        return downloads.serve(request, file, as_attachment=request.query_params.get('inline') != '1')
+
+    @action(detail=False, methods=['get'])
+    @caching.cached_response
+    def stats(self, request):
+        """
+        Report vault totals, read from counters kept current on every insert and delete.
+        """
+        return Response(stats.snapshot())
+
+    @action(detail=False, methods=['get'], url_path='cache')
+    def cache_stats(self, request):
+        """
+        Report response cache hits and misses since the counters were created.
+        """
+        return Response(caching.counters())
+
+    @action(detail=False, methods=['get'])
+    @caching.cached_response
+    def storage(self, request):
+        """
+        Report how much space the compressed storage tier saves.
+        """
+        totals = Blob.objects.exclude(codec='').aggregate(
+            compressed_blobs=Count('id'),
+            original_bytes=Sum('size'),
+            stored_bytes=Sum('stored_size'),
+        )
+        totals = {key: value or 0 for key, value in totals.items()}
+        return Response({
+            **totals,
+            'bytes_saved': totals['original_bytes'] - totals['stored_bytes'],
+        })
+
+    @action(detail=False, methods=['post'])
+    def probe(self, request, *args, **kwargs):
+        """
+        Create a file from content the vault already stores, without an upload.
+
+        Responds 404 when no blob matches the hash and size, in which case the
+        client should fall back to a regular upload.
+        """
+        probe = FileProbeSerializer(data=request.data)
+        probe.is_valid(raise_exception=True)
+
+        not_found = Response({'error': 'No stored content matches this hash'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            with transaction.atomic():
+                # Locked so a purge cannot release the blob before the file references it
+                blob = Blob.objects.select_for_update().filter(
+                    file_hash=probe.validated_data['hash'],
+                    size=probe.validated_data['size'],
+                ).first()
+                if not blob:
+                    return not_found
+
+                file = File.objects.create(
+                    blob=blob,
+                    original_filename=probe.validated_data['name'],
+                    file_type=probe.validated_data['file_type'],
+                    size=blob.size,
+                )
+        except Blob.DoesNotExist:
+            # Released after all, e.g. on a database without row locks
+            return not_found
+        serializer = self.get_serializer(file)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
     @action(detail=False, methods=['post'])
     def batch_delete(self, request, *args, **kwargs):
+        """
+        Delete many files at once.
+
+        The files disappear from the vault immediately; their storage is
+        reclaimed in the background by the purge task.
+        """
         file_ids = request.data.get('file_ids', [])
         if not file_ids:
             return Response({'error': 'No file IDs provided'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Temporarily disconnect the post_delete signal
-        post_delete.disconnect(receiver=invalidate_and_rerun_dedup_jobs, sender=File)
 
-        try:
-            # Perform batch deletion
-            deleted_count, _ = File.objects.filter(id__in=file_ids).delete()
-        finally:
-            # Reconnect the post_delete signal
-            post_delete.connect(receiver=invalidate_and_rerun_dedup_jobs, sender=File)
+        with transaction.atomic():
+            # The UPDATE claims each live row once, even against an overlapping batch delete,
+            # and the rows it claimed are read back through the deleted_at index
+            deleted_at = timezone.now()
+            deleted_count = File.objects.filter(id__in=file_ids).update(deleted_at=deleted_at)
+            if deleted_count:
+                files = File.all_objects.filter(deleted_at=deleted_at)
+                index.files_removed(files)
+                stats.files_removed(files)
+                caching.bump_version()
+                transaction.on_commit(purge_deleted_files.delay)
 
         if deleted_count == 0:
             return Response({'error': 'No files found for the provided IDs'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Manually trigger deduplication after batch delete
-        deduplicate_files.delay()
-        
-        return Response({'message': f'{deleted_count} files deleted successfully'}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response({'message': f'{deleted_count} files deleted successfully'}, status=status.HTTP_202_ACCEPTED)
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable chunked uploads: create a session, PUT numbered chunks in any
+    order (and in parallel), then finalize to assemble the file. Retrieving
+    a session lists the chunks already received so clients can resume.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.discard()
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        session = self.get_object()
+        index = int(index)
+        if index >= session.total_chunks:
+            return Response({'error': 'Chunk index out of range'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.stream is None:
+            return Response({'error': 'No chunk data provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            size, sha256 = session.write_chunk(index, request.stream)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        UploadChunk.objects.update_or_create(
+            session=session, index=index, defaults={'size': size, 'sha256': sha256},
+        )
+        # Keep active sessions clear of the stale-session sweep
+        UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+
+        return Response({'index': index, 'size': size, 'sha256': sha256}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        missing = set(range(session.total_chunks)) - set(session.chunks.values_list('index', flat=True))
+        if missing:
+            return Response(
+                {'error': 'Upload is incomplete', 'missing_chunks': sorted(missing)},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        try:
+            upload = session.assemble()
+        except FileNotFoundError:
+            # A concurrent finalize consumed the session and removed its chunks
+            return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            with blob_writes():
+                # Only one finalize may turn the session into a file
+                if not UploadSession.objects.select_for_update().filter(pk=session.pk).exists():
+                    return Response({'error': 'Upload session not found'}, status=status.HTTP_404_NOT_FOUND)
+                file = File.objects.create(
+                    file=upload,
+                    original_filename=session.original_filename,
+                    file_type=session.file_type,
+                    size=session.size,
+                    file_hash=upload.sha256,
+                )
+                session.discard()
+        finally:
+            upload.close()
+
+        serializer = FileSerializer(file, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -11,4 +11,9 @@ python manage.py migrate
 
 # Start server
 echo "Starting server..."
-gunicorn --bind 0.0.0.0:8000 core.wsgi:application 
\ No newline at end of file
+if [ "$SERVER_MODE" = "asgi" ]; then
+  # Slow uploads and downloads wait on the event loop instead of holding a worker
+  uvicorn core.asgi:application --host 0.0.0.0 --port 8000
+else
+  gunicorn --bind 0.0.0.0:8000 core.wsgi:application
+fi
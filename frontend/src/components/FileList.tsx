@@ -18,7 +18,7 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
   const [filter, setFilter] = useState<FilterType>("all");
   const [sortBy, setSortBy] = useState<SortType>("date");
   const [searchTerm, setSearchTerm] = useState("");
-  const [currentPage, setCurrentPage] = useState(1);
+  const [cursor, setCursor] = useState<string | undefined>(undefined);
   const [pageSize, setPageSize] = useState(10);
 
   const debouncedSearchTerm = useDebounce(searchTerm, 300);
@@ -34,7 +34,7 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
       debouncedSearchTerm,
       sortBy,
       filter,
-      currentPage,
+      cursor,
       pageSize,
     ],
     queryFn: () =>
@@ -42,13 +42,17 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
         search: debouncedSearchTerm,
         sortBy: sortBy,
         fileType: filter,
-        page: currentPage,
+        cursor,
         page_size: pageSize,
       }),
   });
 
   const { results: files } = paginatedFiles ?? {};
 
+  // Pages are addressed by opaque cursors taken from the next/previous links
+  const cursorFromLink = (link: string | null | undefined) =>
+    link ? new URL(link).searchParams.get("cursor") ?? undefined : undefined;
+
   // Mutation for deleting files
   const deleteMutation = useMutation({
     mutationFn: fileService.deleteFile,
@@ -142,7 +146,7 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
               value={pageSize}
               onChange={(e) => {
                 setPageSize(Number(e.target.value));
-                setCurrentPage(1);
+                setCursor(undefined);
               }}
               className="px-2 py-1 border border-gray-300 rounded-md text-sm focus:outline-none focus:ring-primary-500 focus:border-primary-500"
             >
@@ -155,7 +159,9 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
 
           {/* Total count */}
           <div className="text-sm text-gray-500">
-            {paginatedFiles?.count || 0} total files
+            {paginatedFiles?.count ?? 0}
+            {paginatedFiles && !paginatedFiles.count_exact ? "+" : ""} total
+            files
           </div>
         </div>
       </div>
@@ -168,7 +174,10 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
             type="text"
             placeholder="Search files..."
             value={searchTerm}
-            onChange={(e) => setSearchTerm(e.target.value)}
+            onChange={(e) => {
+              setSearchTerm(e.target.value);
+              setCursor(undefined);
+            }}
             className="w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-primary-500 focus:border-primary-500"
           />
         </div>
@@ -180,7 +189,10 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
             <label className="text-sm font-medium text-gray-700">Type:</label>
             <select
               value={filter}
-              onChange={(e) => setFilter(e.target.value as FilterType)}
+              onChange={(e) => {
+                setFilter(e.target.value as FilterType);
+                setCursor(undefined);
+              }}
               className="px-3 py-1 border border-gray-300 rounded-md text-sm focus:outline-none focus:ring-primary-500 focus:border-primary-500"
             >
               <option value="all">All Files</option>
@@ -198,7 +210,10 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
             <label className="text-sm font-medium text-gray-700">Sort:</label>
             <select
               value={sortBy}
-              onChange={(e) => setSortBy(e.target.value as SortType)}
+              onChange={(e) => {
+                setSortBy(e.target.value as SortType);
+                setCursor(undefined);
+              }}
               className="px-3 py-1 border border-gray-300 rounded-md text-sm focus:outline-none focus:ring-primary-500 focus:border-primary-500"
             >
               <option value="date">Date (Newest)</option>
@@ -215,6 +230,7 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
                 setFilter("all");
                 setSearchTerm("");
                 setSortBy("date");
+                setCursor(undefined);
               }}
               className="px-3 py-1 text-sm text-primary-600 hover:text-primary-700 font-medium ml-auto"
             >
@@ -276,6 +292,30 @@ export const FileList: React.FC<FileListProps> = ({ setIsPolling }) => {
               </li>
             ))}
           </ul>
+
+          {/* Pagination */}
+          {(paginatedFiles?.previous || paginatedFiles?.next) && (
+            <div className="mt-6 flex justify-between">
+              <button
+                onClick={() =>
+                  setCursor(cursorFromLink(paginatedFiles?.previous))
+                }
+                disabled={!paginatedFiles?.previous}
+                className="px-3 py-1 border border-gray-300 rounded-md text-sm text-gray-700 hover:bg-gray-50 disabled:opacity-50"
+              >
+                Previous
+              </button>
+              <button
+                onClick={() =>
+                  setCursor(cursorFromLink(paginatedFiles?.next))
+                }
+                disabled={!paginatedFiles?.next}
+                className="px-3 py-1 border border-gray-300 rounded-md text-sm text-gray-700 hover:bg-gray-50 disabled:opacity-50"
+              >
+                Next
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>
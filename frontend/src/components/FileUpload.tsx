@@ -12,18 +12,21 @@ export const FileUpload: React.FC<FileUploadProps> = ({
   onUploadSuccess,
   setIsPolling,
 }) => {
-  const [selectedFile, setSelectedFile] = useState<File | null>(null);
+  const [selectedFiles, setSelectedFiles] = useState<File[]>([]);
   const [error, setError] = useState<string | null>(null);
   const queryClient = useQueryClient();
 
   const uploadMutation = useMutation({
-    mutationFn: fileService.uploadFile,
+    mutationFn: (files: File[]) =>
+      files.length === 1
+        ? fileService.uploadFile(files[0])
+        : fileService.uploadFiles(files),
     onSuccess: () => {
       // Invalidate and refetch files query
       setIsPolling(true);
       queryClient.invalidateQueries({ queryKey: ["dedupData"] });
       queryClient.invalidateQueries({ queryKey: ["files"] });
-      setSelectedFile(null);
+      setSelectedFiles([]);
       onUploadSuccess();
     },
     onError: (error) => {
@@ -33,21 +36,21 @@ export const FileUpload: React.FC<FileUploadProps> = ({
   });
 
   const handleFileSelect = (event: React.ChangeEvent<HTMLInputElement>) => {
-    if (event.target.files && event.target.files[0]) {
-      setSelectedFile(event.target.files[0]);
+    if (event.target.files && event.target.files.length > 0) {
+      setSelectedFiles(Array.from(event.target.files));
       setError(null);
     }
   };
 
   const handleUpload = async () => {
-    if (!selectedFile) {
+    if (selectedFiles.length === 0) {
       setError("Please select a file");
       return;
     }
 
     try {
       setError(null);
-      await uploadMutation.mutateAsync(selectedFile);
+      await uploadMutation.mutateAsync(selectedFiles);
     } catch (err) {
       // Error handling is done in onError callback
     }
@@ -67,12 +70,13 @@ export const FileUpload: React.FC<FileUploadProps> = ({
                 htmlFor="file-upload"
                 className="relative cursor-pointer bg-white rounded-md font-medium text-primary-600 hover:text-primary-500 focus-within:outline-none focus-within:ring-2 focus-within:ring-offset-2 focus-within:ring-primary-500"
               >
-                <span>Upload a file</span>
+                <span>Upload files</span>
                 <input
                   id="file-upload"
                   name="file-upload"
                   type="file"
                   className="sr-only"
+                  multiple
                   onChange={handleFileSelect}
                   disabled={uploadMutation.isPending}
                 />
@@ -82,9 +86,12 @@ export const FileUpload: React.FC<FileUploadProps> = ({
             <p className="text-xs text-gray-500">Any file up to 10MB</p>
           </div>
         </div>
-        {selectedFile && (
+        {selectedFiles.length > 0 && (
           <div className="text-sm text-gray-600">
-            Selected: {selectedFile.name}
+            Selected:{" "}
+            {selectedFiles.length === 1
+              ? selectedFiles[0].name
+              : `${selectedFiles.length} files`}
           </div>
         )}
         {error && (
@@ -94,9 +101,9 @@ export const FileUpload: React.FC<FileUploadProps> = ({
         )}
         <button
           onClick={handleUpload}
-          disabled={!selectedFile || uploadMutation.isPending}
+          disabled={selectedFiles.length === 0 || uploadMutation.isPending}
           className={`w-full flex justify-center py-2 px-4 border border-transparent rounded-md shadow-sm text-sm font-medium text-white ${
-            !selectedFile || uploadMutation.isPending
+            selectedFiles.length === 0 || uploadMutation.isPending
               ? "bg-gray-300 cursor-not-allowed"
               : "bg-primary-600 hover:bg-primary-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-primary-500"
           }`}
@@ -6,4 +6,15 @@ export const dedupService = {
     const response = await axios.get(`${API_URL}/dedup/latest`);
     return response.data;
   },
+
+  // Pass the previous page's `next` URL as `cursorUrl` to continue
+  getDuplicateGroups: async (fileType?: string, cursorUrl?: string | null) => {
+    const url =
+      cursorUrl ??
+      `${API_URL}/dedup/groups/${
+        fileType && fileType !== "all" ? `?fileType=${fileType}` : ""
+      }`;
+    const response = await axios.get(url);
+    return response.data;
+  },
 };
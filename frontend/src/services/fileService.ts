@@ -3,8 +3,47 @@ import { File as FileType } from "../types/file";
 import { PaginatedResponse, GetFilesParams } from "../types/api";
 import { API_URL } from "./constant";
 
+// Files above this size skip the probe: crypto.subtle needs the whole file in memory
+const MAX_PROBE_SIZE = 256 * 1024 * 1024;
+
+async function hashFile(file: File): Promise<string | null> {
+  if (!window.crypto?.subtle || file.size > MAX_PROBE_SIZE) return null;
+
+  const digest = await window.crypto.subtle.digest(
+    "SHA-256",
+    await file.arrayBuffer()
+  );
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+}
+
 export const fileService = {
+  async probeFile(file: File): Promise<FileType | null> {
+    const hash = await hashFile(file);
+    if (!hash) return null;
+
+    try {
+      const response = await axios.post(`${API_URL}/files/probe/`, {
+        hash,
+        size: file.size,
+        name: file.name,
+        file_type: file.type || "application/octet-stream",
+      });
+      return response.data;
+    } catch (error) {
+      if (axios.isAxiosError(error) && error.response?.status === 404) {
+        return null;
+      }
+      throw error;
+    }
+  },
+
   async uploadFile(file: File): Promise<FileType> {
+    // Skip sending the bytes when the vault already stores this content
+    const existing = await fileService.probeFile(file).catch(() => null);
+    if (existing) return existing;
+
     const formData = new FormData();
     formData.append("file", file);
 
@@ -16,6 +55,23 @@ export const fileService = {
     return response.data;
   },
 
+  async uploadFiles(files: File[]): Promise<FileType[]> {
+    // One request and one transaction for the whole selection
+    const formData = new FormData();
+    files.forEach((file) => formData.append("files", file));
+
+    const response = await axios.post(
+      `${API_URL}/files/batch_upload/`,
+      formData,
+      {
+        headers: {
+          "Content-Type": "multipart/form-data",
+        },
+      }
+    );
+    return response.data;
+  },
+
   async getFiles(
     params?: GetFilesParams
   ): Promise<PaginatedResponse<FileType>> {
@@ -23,7 +79,7 @@ export const fileService = {
 
     if (params?.search) queryParams.append("search", params.search);
     if (params?.sortBy) queryParams.append("sortBy", params.sortBy);
-    if (params?.page) queryParams.append("page", String(params.page));
+    if (params?.cursor) queryParams.append("cursor", params.cursor);
     if (params?.page_size)
       queryParams.append("page_size", String(params.page_size));
     if (params?.fileType) queryParams.append("fileType", params.fileType);
@@ -2,12 +2,13 @@ export interface GetFilesParams {
   search?: string;
   sortBy?: string;
   fileType?: string;
-  page?: number;
+  cursor?: string;
   page_size?: number;
 }
 
 export interface PaginatedResponse<T> {
-  count: number;
+  count: number | null;
+  count_exact: boolean;
   next: string | null;
   previous: string | null;
   results: T[];